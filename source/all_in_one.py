@@ -31,7 +31,7 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky", "Jakub Geyer"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.0.2"
+__version__ = "1.4.3"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
@@ -39,21 +39,22 @@ __status__ = "Beta"
 __python__ = "3.8.0"
 
 # Import required libs
+import time
 from pathlib import Path
 
 # Import custom libs
 import dataprocess as dp
 import uploader as up
+from cancel import Cancelled
+from progress import ByteProgress
 
 # Check if uploader and dataprocess has correct versions
 from version_check import check_version
-check_version(dp.__version__, [1, 1, 3], "dataprocess.py")
-check_version(up.__version__, [1, 1, 1], "uploader.py")
+check_version(dp.__version__, [1, 10, 0], "dataprocess.py")
+check_version(up.__version__, [1, 16, 0], "uploader.py")
 
-# Global for interupting the script
-BREAK = False
-
-def all_in_one(path, origin, user="Test User In AiO", progresshandler=None, uploaderhandler=None, consolecall=False):
+def all_in_one(path, origin, user="Test User In AiO", progresshandler=None, uploaderhandler=None, consolecall=False,
+               metricshandler=None, report_path=None, etahandler=None, cancel=None, completed=None, grouphandler=None):
     """
     Script which uses dataprocessing and uploader to automatically process data in given folder
     and upload them to UniCatDB. Does not save any metadata of processed folders!
@@ -69,73 +70,112 @@ def all_in_one(path, origin, user="Test User In AiO", progresshandler=None, uplo
         User name who commits current batch to DB for easy fail detection and rollbacks.
         Defaults to "Test Script".
     progresshandler : method, optional
-        Handler for attached GUI of its progressbar. Defaults to None.
+        Handler for attached GUI of its progressbar. Progress is weighted by bytes of processed and
+        uploaded files. First call comes with ct_max None while folders are scanned. Defaults to None.
     uploadhandler : method, optional
         Handler for attached GUI of its uploadbar. Defaults to None.
     consolecall : bool, optional
         Bool trigger for console prints for easier debugging. Defaults to False
+    metricshandler : method, optional
+        Callback receiving upload metrics events, see metrics.UploadMetrics. Defaults to None.
+    report_path : str, optional
+        Path where upload run report should be saved (.json or .csv). Defaults to UPLOAD_REPORT from config.
+    etahandler : method, optional
+        Handler receiving progress state with ETA, current rate and remaining bytes.
+        See progress.ByteProgress.state. Defaults to None.
+    cancel : cancel.CancelToken, optional
+        Token which stops processing and upload within one image or chunk. Defaults to None.
+    completed : set, optional
+        Keys of groups uploaded by interrupted run which should be skipped, see dataprocess.group_key.
+        Defaults to None.
+    grouphandler : method, optional
+        Handler called with key and data of every completely uploaded group. Defaults to None.
 
     Returns
     -------
-    None.
+    dict
+        Summary of upload metrics for this run. Contains aborted with the error if run stopped
+        on unexpected error.
     """
-    # Setup global so this can be stopped on another thread.
-    global BREAK
+    # Total is not known until folders are scanned, let GUI show indeterminate progress
+    if progresshandler:
+        progresshandler(0)
+    # Scan folders first so the amount of work is known in bytes
+    jobs = dp.scan_folders(path, origin)
+    if completed:
+        jobs = [job for job in jobs if dp.group_key(job[2]) not in completed]
+    sizes = [dp.group_size(group) for _, _, group in jobs]
+    # Every file is processed and then uploaded, both stages are measured separately
+    progress = ByteProgress({"process": sum(sizes), "upload": sum(sizes)},
+                            progresshandler=progresshandler, etahandler=etahandler)
+    progress.notify()
 
     # Init data generator
-    data_generator = dp.main(path, origin=origin, consolecall=False, generator=True)
-
-    # Get amount of files for progress bar and init it
-    nr = dp.get_amount_of_files(path)+1
-    if progresshandler:
-        progresshandler(0, ct_max=nr*2)
+    # Keyence images read by processing are handed over to upload, so they are read from disk once
+    data_generator = dp.main(path, origin=origin, consolecall=False, generator=True, jobs=jobs, cancel=cancel,
+                             keep_buffers=True)
 
     # Init uploader
     uploader = up.Connector()
-
-    ct = 0
-    while not BREAK:
-        try:
-            # Load data
-            group = next(data_generator)
-            # Change path to str for upload
-            temp_group = []
-            for data in group:
-                data['img_path'] = data['img_path'].as_posix()
-                data['meta_path'] = data['meta_path'].as_posix()
-
+    uploader.start_run(metricshandler, cancel)
+
+    # Run report, ledger and metrics are closed even if the loop is cancelled or fails
+    try:
+        pos = 0
+        while True:
+            try:
+                # Load data
+                start = time.perf_counter()
+                group = next(data_generator)
                 # Update progress bar for processing part
-                ct += 1
-                if progresshandler:
-                    progresshandler(ct)
-
-                # Resolve path for data
-                if not Path(data['img_path']).is_absolute():
-                    abs_data_path = dp.rcwd / Path(data['img_path'])
-                    data['img_path'] = abs_data_path.as_posix()
-                # Resolve path for meta
-                if not Path(data['meta_path']).is_absolute():
-                    abs_meta_path = dp.rcwd / Path(data['meta_path'])
-                    data['meta_path'] = abs_meta_path.as_posix()
-
-                # Add user to data
-                data['user'] = user
-                # Append to temp group
-                temp_group.append(data)
-            # Upload processed group
-            uploader.commit_one_group(temp_group, uploaderhandler)
-
-            # Increment progress bar
-            ct += 1
-            if progresshandler:
-                progresshandler(ct)
-        except StopIteration:
-            if consolecall:
-                print("All data have been processed.")
-            break
-    BREAK = False
-    if progresshandler:
-        progresshandler(ct, finished=True)
+                progress.advance("process", sizes[pos], time.perf_counter() - start)
+                # Change path to str for upload
+                temp_group = []
+                for data in group:
+                    data['img_path'] = data['img_path'].as_posix()
+                    data['meta_path'] = data['meta_path'].as_posix()
+
+                    # Resolve path for data
+                    if not Path(data['img_path']).is_absolute():
+                        abs_data_path = dp.rcwd / Path(data['img_path'])
+                        data['img_path'] = abs_data_path.as_posix()
+                    # Resolve path for meta
+                    if not Path(data['meta_path']).is_absolute():
+                        abs_meta_path = dp.rcwd / Path(data['meta_path'])
+                        data['meta_path'] = abs_meta_path.as_posix()
+
+                    # Add user to data
+                    data['user'] = user
+                    # Append to temp group
+                    temp_group.append(data)
+                # Upload processed group
+                start = time.perf_counter()
+                uploader.prepare_group(temp_group)
+                uploaded = uploader.commit_one_group(temp_group, uploaderhandler)
+                # Only complete group is checkpointed, resumed run uploads failed one again
+                if grouphandler and uploaded:
+                    grouphandler(dp.group_key(jobs[pos][2]), temp_group)
+
+                # Increment progress bar
+                progress.advance("upload", sizes[pos], time.perf_counter() - start)
+                pos += 1
+            except StopIteration:
+                if consolecall:
+                    print("All data have been processed.")
+                break
+            except Cancelled:
+                if consolecall:
+                    print("Processing has been stopped.")
+                break
+            except Exception as e:
+                print("Undefined Error in all in one occured:" + str(e.__class__.__name__) + " " + e.__str__())
+                # Run broke off before all groups were uploaded, callers find the error in summary and report
+                uploader.metrics.section("aborted", str(e.__class__.__name__) + " " + e.__str__())
+                break
+    finally:
+        summary = uploader.finish_run(report_path)
+    progress.notify(finished=True)
+    return summary
 
 if __name__ == "__main__":
     # Runs this script in specified PATH. Uploads all species within that folder.
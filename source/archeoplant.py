@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+"""
+archeoplant.py: Headless command line entry point of the uploader. Runs Pre
+Loader, Uploader and All-in-One modes without jupyter, suitable for cron and
+batch schedulers. Heavy libraries are imported only by the selected mode.
+
+Usage (from source folder, api.token is read from current folder):
+    python -m archeoplant preload <folder> [--origin keyence] [--output <folder>]
+    python -m archeoplant upload <preload_data.json> --user <name>
+    python -m archeoplant all-in-one <folder> --user <name>
+    python -m archeoplant watch <folder> --user <name> [--polling]
+    python -m archeoplant query <preload_data.sqlite> [--species <name>] [--status failed]
+    python -m archeoplant export <preload_data.json> <measurements.parquet>
+    python -m archeoplant retry <preload_data.json> [--set THRESHOLD_PAD=30] [--overrides <overrides.json>]
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.7.2"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs. Only standard library here, processing and upload
+# scripts are imported by the mode which needs them to keep startup fast.
+import argparse
+import json
+import signal
+import sys
+from pathlib import Path
+
+import config
+from cancel import CancelToken
+from progress import format_eta
+
+# Microscopes accepted by dataprocess.parse_meta, same as in GUI
+ORIGINS = ["Zeiss Axiocam 305c", "Keyence"]
+
+def console_progress(state):
+    """
+    Etahandler printing progress with ETA to stderr.
+
+    Parameters
+    ----------
+    state : dict
+        Progress state, see progress.ByteProgress.state
+    """
+    print(f"{state['fraction'] * 100:5.1f} % | {state['rate'] / 1e6:6.2f} MB/s | ETA {format_eta(state['eta'])}",
+          file=sys.stderr)
+
+def origin_type(value):
+    """
+    Case insensitive argparse type of microscope origin.
+    """
+    for origin in ORIGINS:
+        if origin.lower() == value.lower():
+            return origin
+    raise argparse.ArgumentTypeError(f"unknown microscope {value}, use one of: {', '.join(ORIGINS)}")
+
+def absolute(value):
+    """
+    Argparse type resolving path against current folder. dataprocess.resolve_path resolves single
+    part paths against parent of source folder, which would surprise command line users.
+    """
+    return Path(value).expanduser().resolve().as_posix()
+
+def limit_type(value):
+    """
+    Argparse type of bandwidth limit. Returns MB/s, None for "off" or "schedule".
+    """
+    if value.lower() in ("off", "schedule"):
+        return value.lower()
+    try:
+        limit = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid limit {value}, use MB/s, off or schedule")
+    if limit <= 0:
+        raise argparse.ArgumentTypeError("limit has to be positive, use off for unlimited")
+    return limit
+
+def setting_type(value):
+    """
+    Argparse type of segmentation setting override NAME=VALUE. Returns (name, number).
+    """
+    name, _, number = value.partition("=")
+    try:
+        number = int(number)
+    except ValueError:
+        try:
+            number = float(number)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid setting {value}, use NAME=VALUE, e.g. THRESHOLD_PAD=30")
+    return name.strip(), number
+
+def build_parser():
+    """
+    Builds argument parser of the command line.
+
+    Returns
+    -------
+    argparse.ArgumentParser
+        Parser with preload, upload and all-in-one subcommands
+    """
+    parser = argparse.ArgumentParser(prog="archeoplant", description="Seed image pre loader and uploader into UniCatDB.")
+    parser.add_argument("--quiet", action="store_true", help="do not print processing status")
+    parser.add_argument("--progress", action="store_true", help="print progress with ETA to stderr")
+    modes = parser.add_subparsers(dest="mode", metavar="mode")
+    modes.required = True
+
+    upload_options = argparse.ArgumentParser(add_help=False)
+    upload_options.add_argument("--user", default="Command line", help="user name stored with uploaded findings")
+    upload_options.add_argument("--report", type=absolute, default=None,
+                                help="path of upload run report (.json or .csv), defaults to UPLOAD_REPORT")
+    upload_options.add_argument("--server", default=None, help="UniCatDB server (live, test, local or url), defaults to SERVER")
+    upload_options.add_argument("--recompress", choices=["none", "deflate", "lzw", "zstd"], default=None,
+                                help="lossless TIFF recompression before upload, defaults to RECOMPRESS")
+
+    select_options = argparse.ArgumentParser(add_help=False)
+    select_options.add_argument("--species", default=None, help="only images of given species (case insensitive)")
+    select_options.add_argument("--type", default=None, help="only images of given type (Seed or Diaspore)")
+    select_options.add_argument("--vendor", default=None, help="only images of given microscope vendor")
+    select_options.add_argument("--status", choices=["pending", "uploaded", "failed"], default=None,
+                                help="only images in given upload status (preload store only)")
+    select_options.add_argument("--extraction", choices=["ok", "failed"], default=None,
+                                help="only images whose seed extraction succeeded or failed")
+
+    preload = modes.add_parser("preload", help="process images and store their data into preload_data.json")
+    preload.add_argument("path", type=absolute, help="folder with species folders")
+    preload.add_argument("--origin", type=origin_type, default=ORIGINS[0], help="microscope which took the images")
+    preload.add_argument("--output", type=absolute, default=absolute("."), help="folder for preload_data.json")
+    preload.add_argument("--relative", action="store_true", help="store image paths relative to repository folder")
+    preload.add_argument("--format", choices=["json", "sqlite"], default=None,
+                         help="save preload_data.json or preload_data.sqlite store, defaults to PRELOAD_FORMAT")
+    preload.add_argument("--export", type=absolute, default=None,
+                         help="columnar export of measurements (.parquet, .arrow or .npz), defaults to MEASUREMENTS_EXPORT")
+    preload.set_defaults(run=run_preload)
+
+    upload = modes.add_parser("upload", parents=[upload_options, select_options], help="upload preloaded json into UniCatDB")
+    upload.add_argument("path", type=absolute, help="preload_data.json or preload_data.sqlite created by preload")
+    upload.set_defaults(run=run_upload)
+
+    export = modes.add_parser("export", parents=[select_options], help="export measurements of preloaded images for analytics")
+    export.add_argument("path", type=absolute, help="preload_data.json or preload_data.sqlite created by preload")
+    export.add_argument("output", type=absolute, help="columnar export (.parquet, .arrow or .npz)")
+    export.set_defaults(run=run_export)
+
+    query = modes.add_parser("query", parents=[select_options], help="list preloaded images and their upload status")
+    query.add_argument("path", type=absolute, help="preload_data.sqlite created by preload")
+    query.add_argument("--count", action="store_true", help="print only amount of images in each upload status")
+    query.set_defaults(run=run_query)
+
+    retry = modes.add_parser("retry", help="run seed extraction again for failed images and merge it into preloaded data")
+    retry.add_argument("path", type=absolute, help="preload_data.json or preload_data.sqlite created by preload")
+    retry.add_argument("--set", type=setting_type, action="append", default=[], metavar="NAME=VALUE",
+                       help="segmentation setting of config used for all retried images, e.g. THRESHOLD_PAD=30")
+    retry.add_argument("--overrides", type=absolute, default=None,
+                       help="json {\"*\" or image path or file name: {setting: value}}, named images are retried too")
+    retry.add_argument("--flagged-only", action="store_true", help="retry only images named in overrides")
+    retry.set_defaults(run=run_retry)
+
+    aio = modes.add_parser("all-in-one", parents=[upload_options], help="process and upload images group by group")
+    aio.add_argument("path", type=absolute, help="folder with species folders")
+    aio.add_argument("--origin", type=origin_type, default=ORIGINS[0], help="microscope which took the images")
+    aio.set_defaults(run=run_all_in_one)
+
+    watch = modes.add_parser("watch", parents=[upload_options],
+                             help="watch folder and upload every new seed group once it is completely written")
+    watch.add_argument("path", type=absolute, help="folder with species folders")
+    watch.add_argument("--origin", type=origin_type, default=ORIGINS[0], help="microscope which took the images")
+    watch.add_argument("--polling", action="store_true", help="poll the folder instead of filesystem notifications")
+    watch.set_defaults(run=run_watch)
+
+    queue_options = argparse.ArgumentParser(add_help=False)
+    queue_options.add_argument("--queue", type=absolute, default=None, help="job queue database, defaults to JOB_QUEUE")
+
+    enqueue = modes.add_parser("enqueue", parents=[upload_options, queue_options],
+                               help="add preload, upload or all-in-one job to persistent queue")
+    enqueue.add_argument("kind", choices=["preload", "upload", "all-in-one"], help="mode run by worker")
+    enqueue.add_argument("path", type=absolute, help="folder with species folders or preload_data.json for upload")
+    enqueue.add_argument("--origin", type=origin_type, default=ORIGINS[0], help="microscope which took the images")
+    enqueue.add_argument("--output", type=absolute, default=absolute("."), help="folder for preload_data.json")
+    enqueue.add_argument("--relative", action="store_true", help="store image paths relative to repository folder")
+    enqueue.add_argument("--priority", type=int, default=0, help="jobs with higher priority run first")
+    enqueue.set_defaults(run=run_enqueue)
+
+    jobs = modes.add_parser("jobs", parents=[queue_options], help="list jobs in persistent queue")
+    jobs.add_argument("--state", action="append", choices=["queued", "running", "done", "failed", "cancelled"],
+                      help="show only jobs in given state, may be repeated")
+    jobs.set_defaults(run=run_jobs)
+
+    worker = modes.add_parser("worker", parents=[queue_options], help="run queued jobs until interrupted")
+    worker.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    worker.add_argument("--once", action="store_true", help="stop once the queue is empty")
+    worker.set_defaults(run=run_worker)
+
+    cancel_job = modes.add_parser("cancel-job", parents=[queue_options], help="cancel queued or running job")
+    cancel_job.add_argument("id", type=int, help="ID of the job, see jobs")
+    cancel_job.set_defaults(run=run_cancel_job)
+
+    serve = modes.add_parser("serve", help="run local upload service shared by lab computers")
+    serve.add_argument("--host", default=None, help="address to listen on, defaults to SERVICE_HOST")
+    serve.add_argument("--port", type=int, default=None, help="port to listen on, defaults to SERVICE_PORT")
+    serve.add_argument("--report", type=absolute, default=None,
+                       help="path of upload run report saved on stop (.json or .csv), defaults to UPLOAD_REPORT")
+    serve.add_argument("--server", default=None, help="UniCatDB server (live, test, local or url), defaults to SERVER")
+    serve.add_argument("--standin", action="store_true",
+                       help="upload into in-memory stand-in UniCatDB server for offline tests")
+    serve.set_defaults(run=run_serve, recompress=None)
+
+    service_options = argparse.ArgumentParser(add_help=False)
+    service_options.add_argument("--service", default=None, help="url of upload service, defaults to SERVICE_HOST:SERVICE_PORT")
+
+    submit = modes.add_parser("submit", parents=[service_options], help="submit preloaded json to upload service")
+    submit.add_argument("path", type=absolute, help="preload_data.json created by preload or json lines file")
+    submit.add_argument("--user", default="Command line", help="user name stored with uploaded findings")
+    submit.set_defaults(run=run_submit)
+
+    service_status = modes.add_parser("service-status", parents=[service_options], help="print state of upload service")
+    service_status.set_defaults(run=run_service_status)
+
+    limit = modes.add_parser("limit", help="change bandwidth limit of running uploads on this computer")
+    limit.add_argument("value", type=limit_type, help="limit in MB/s, off for unlimited or schedule for UPLOAD_LIMIT_SCHEDULE")
+    limit.set_defaults(run=run_limit)
+
+    reconcile = modes.add_parser("reconcile", help="delete findings left without files by interrupted uploads")
+    reconcile.add_argument("--server", default=None, help="UniCatDB server (live, test, local or url), defaults to SERVER")
+    reconcile.add_argument("--dry-run", action="store_true", help="only list findings without files")
+    reconcile.set_defaults(run=run_reconcile, recompress=None)
+    return parser
+
+def apply_upload_options(args):
+    """
+    Overrides config values by command line options. Connector reads config on construction.
+    """
+    if args.server is not None:
+        config.SERVER = args.server
+    if args.recompress is not None:
+        config.RECOMPRESS = None if args.recompress == "none" else args.recompress
+
+def selection(args):
+    """
+    Returns filters of preloaded images selected by command line options, see preloadstore.PreloadStore.groups.
+    """
+    return {"species": args.species, "type": args.type, "vendor": args.vendor, "status": args.status,
+            "failed": None if args.extraction is None else args.extraction == "failed"}
+
+def quiet_upload(msg, file_size, chunk=0, nr_chunks=0):
+    """
+    Uploaderhandler which drops per chunk messages, they would flood logs of scheduled runs.
+    """
+
+def run_preload(args, cancel):
+    """
+    Runs Pre Loader mode.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    if args.format is not None:
+        config.PRELOAD_FORMAT = args.format
+    import dataprocess as dp
+    # Scheduled runs may point to fresh folder, do not fail after processing everything
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    dp.preload_data(args.path, args.origin, output_path=args.output, save=True, relative=args.relative,
+                    consolecall=not args.quiet, etahandler=console_progress if args.progress else None,
+                    cancel=cancel, export=args.export)
+    return 0
+
+def run_upload(args, cancel):
+    """
+    Runs Uploader mode.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if any file or finding failed or upload stopped on error
+    """
+    apply_upload_options(args)
+    import uploader as up
+    summary = up.Connector().commit_all(args.path, user=args.user, consolecall=not args.quiet, report_path=args.report,
+                                        uploaderhandler=quiet_upload,
+                                        etahandler=console_progress if args.progress else None, cancel=cancel,
+                                        select=selection(args))
+    return 1 if summary["failed_files"] or summary["failed_findings"] or summary.get("aborted") else 0
+
+def run_all_in_one(args, cancel):
+    """
+    Runs All-in-One mode.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if any file or finding failed or run stopped on error
+    """
+    apply_upload_options(args)
+    import all_in_one as aio
+    summary = aio.all_in_one(args.path, args.origin, user=args.user, consolecall=not args.quiet, report_path=args.report,
+                             uploaderhandler=quiet_upload,
+                             etahandler=console_progress if args.progress else None, cancel=cancel)
+    return 1 if summary["failed_files"] or summary["failed_findings"] or summary.get("aborted") else 0
+
+def run_export(args, cancel):
+    """
+    Exports measurements of preloaded images matching selection into columnar file.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    from preloadstore import load_groups
+    from export import export_groups
+    path = export_groups(load_groups(args.path, **selection(args)), args.output)
+    if not args.quiet:
+        print(f"Measurements exported into {path}.")
+    return 0
+
+def run_retry(args, cancel):
+    """
+    Runs seed extraction again for failed and flagged preloaded images.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if any image still failed or settings are invalid
+    """
+    import dataprocess
+    overrides = {}
+    if args.overrides:
+        with open(args.overrides, "r") as fin:
+            overrides = json.load(fin)
+    if args.set:
+        overrides["*"] = dict(overrides.get("*", {}), **dict(args.set))
+    try:
+        summary = dataprocess.retry_failed(args.path, overrides, flagged_only=args.flagged_only,
+                                           consolecall=not args.quiet, cancel=cancel)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    return 1 if summary["failed"] else 0
+
+def run_query(args, cancel):
+    """
+    Lists images of preload store matching selection with their upload status.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if store does not exist
+    """
+    from preloadstore import PreloadStore, is_store
+    if not is_store(args.path) or not Path(args.path).is_file():
+        print(f"{args.path} is not preload store, preload with --format sqlite.", file=sys.stderr)
+        return 1
+    store = PreloadStore(args.path)
+    if not args.count:
+        for image in store.images(**selection(args)):
+            extraction = "extraction failed" if image["extraction_failed"] else "extracted"
+            print(f"{image['img_path']}\t{image['species_name']}\t{image['type']}\t{extraction}\t{image['status']}"
+                  + (f"\t{image['error']}" if image["error"] else ""))
+    counts = store.counts(**selection(args))
+    print(", ".join(f"{images} {status}" for status, images in counts.items()) + f", {sum(counts.values())} images.")
+    return 0
+
+def run_watch(args, cancel):
+    """
+    Runs watch mode until interrupted.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if any file or finding failed
+    """
+    apply_upload_options(args)
+    from watcher import FolderWatcher
+    watcher = FolderWatcher(args.path, args.origin, user=args.user, uploaderhandler=quiet_upload, polling=args.polling,
+                            consolecall=not args.quiet)
+    summary = watcher.run(cancel, report_path=args.report)
+    return 1 if summary["failed_files"] or summary["failed_findings"] else 0
+
+def run_enqueue(args, cancel):
+    """
+    Adds job to persistent queue.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    from jobqueue import JobQueue
+    params = {"path": args.path}
+    if args.kind != "upload":
+        params["origin"] = args.origin
+    if args.kind == "preload":
+        params.update(output=args.output, relative=args.relative)
+    else:
+        params.update(report=args.report, server=args.server, recompress=args.recompress)
+    job_id = JobQueue(args.queue or config.JOB_QUEUE).enqueue(args.kind, params, args.user, priority=args.priority)
+    print(f"Queued job {job_id}.")
+    return 0
+
+def run_jobs(args, cancel):
+    """
+    Prints jobs in persistent queue.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    from jobqueue import JobQueue
+    for job in JobQueue(args.queue or config.JOB_QUEUE).jobs(args.state):
+        line = (f"{job['id']:5d} {job['state']:9s} {job['priority']:4d} {job['kind']:10s} {job['user']:15s} "
+                f"{job['groups_done']:5d} groups  {job['params']['path']}")
+        if job["error"]:
+            line += f"  ({job['error']})"
+        print(line)
+    return 0
+
+def run_worker(args, cancel):
+    """
+    Runs queued jobs in worker processes until interrupted.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    import jobqueue
+    if args.workers > 1:
+        jobqueue.start_workers(args.queue or config.JOB_QUEUE, workers=args.workers, once=args.once,
+                               consolecall=not args.quiet)
+    else:
+        jobqueue.work(args.queue or config.JOB_QUEUE, cancel=cancel, once=args.once, consolecall=not args.quiet)
+    return 0
+
+def run_cancel_job(args, cancel):
+    """
+    Cancels job in persistent queue.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if the job has already ended
+    """
+    from jobqueue import JobQueue
+    if JobQueue(args.queue or config.JOB_QUEUE).cancel(args.id):
+        print(f"Job {args.id} cancelled.")
+        return 0
+    print(f"Job {args.id} is not queued nor running.", file=sys.stderr)
+    return 1
+
+def run_serve(args, cancel):
+    """
+    Runs local upload service until interrupted.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if any file or finding failed
+    """
+    standin = None
+    if args.standin:
+        from standin import StandinServer
+        standin = StandinServer().start()
+        args.server = "local"
+        print(f"Uploading into stand-in UniCatDB server at {standin.url}.")
+    apply_upload_options(args)
+    from service import UploadService
+    service = UploadService(host=args.host or config.SERVICE_HOST, port=args.port or config.SERVICE_PORT,
+                            consolecall=not args.quiet)
+    try:
+        summary = service.run(cancel, report_path=args.report)
+    finally:
+        if standin:
+            standin.stop()
+    return 1 if summary["failed_files"] or summary["failed_findings"] else 0
+
+def run_submit(args, cancel):
+    """
+    Submits preloaded json to upload service.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if service refused the batch
+    """
+    import urllib.error
+    from service import submit_batch
+    try:
+        batch = submit_batch(args.path, args.user, url=args.service)
+    except ValueError as e:
+        print(f"Invalid batch: {e}", file=sys.stderr)
+        return 1
+    except urllib.error.HTTPError as e:
+        print(f"Service refused the batch: {e.read().decode(errors='replace')}", file=sys.stderr)
+        return 1
+    print(f"Submitted batch {batch['id']}: {batch['groups']} groups queued, {batch['skipped_groups']} skipped, "
+          f"{len(batch['duplicate_images'])} duplicate images.")
+    return 0
+
+def run_service_status(args, cancel):
+    """
+    Prints state of upload service.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    import json
+    from service import service_status
+    print(json.dumps(service_status(args.service), indent=2))
+    return 0
+
+def run_limit(args, cancel):
+    """
+    Writes bandwidth limit override picked up by running uploads.
+
+    Returns
+    -------
+    int
+        Exit code
+    """
+    import dataprocess as dp
+    from ratelimit import write_override
+    path = dp.resolve_path(config.UPLOAD_LIMIT_FILE)
+    if args.value == "schedule":
+        write_override(path)
+        print("Uploads follow UPLOAD_LIMIT_SCHEDULE.")
+    else:
+        write_override(path, None if args.value == "off" else args.value)
+        print("Uploads are not limited." if args.value == "off" else f"Uploads are limited to {args.value:g} MB/s.")
+    return 0
+
+def run_reconcile(args, cancel):
+    """
+    Deletes findings recorded in finding ledgers which did not get all their files.
+
+    Returns
+    -------
+    int
+        Exit code, 1 if any finding could not be deleted
+    """
+    apply_upload_options(args)
+    import uploader as up
+    report = up.Connector().reconcile_findings(dry_run=args.dry_run, consolecall=True)
+    if args.dry_run:
+        print(f"{report['pending']} findings without all files.")
+    else:
+        print(f"Deleted {report['deleted']} findings without all files, {report['failed']} could not be deleted.")
+    if report["running"]:
+        print(f"Skipped {report['running']} ledgers of running uploads.")
+    return 1 if report["failed"] else 0
+
+def main(argv=None):
+    """
+    Runs command line with given arguments.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. Defaults to None, sys.argv is used.
+
+    Returns
+    -------
+    int
+        Exit code. 0 on success, 1 on failed uploads, 130 if interrupted.
+    """
+    args = build_parser().parse_args(argv)
+    cancel = CancelToken()
+    # First Ctrl+C (or SIGTERM of scheduler) stops the job gracefully, second one kills it
+    def interrupt(signum, frame):
+        if cancel.cancelled:
+            raise KeyboardInterrupt()
+        print("Stopping...", file=sys.stderr)
+        cancel.cancel()
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+    code = args.run(args, cancel)
+    return 130 if cancel.cancelled else code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+bench_import.py: Import time benchmark of custom scripts. Every script is
+imported in fresh interpreter with -X importtime, heavy libraries it must not
+load and its cumulative import time are checked against budgets below. Exits
+with non zero code on regression, so it can guard changes of imports.
+
+Usage (from source folder):
+    python bench_import.py [--repeat 5] [--tolerance 0.25] [script ...]
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+# Heavy libraries, loaded only by code paths which use them
+OPENCV = {"cv2", "scipy", "imutils", "numpy"}
+UNICATDB = {"unicatdb", "tusclient"}
+JUPYTER = {"ipywidgets", "IPython", "ipyfilechooser"}
+
+# Script: (libraries and scripts it must not import, budget of cumulative import time in ms)
+IMPORT_BUDGETS = {
+    "config": (OPENCV | UNICATDB | JUPYTER, 20),
+    "archeoplant": (OPENCV | UNICATDB | JUPYTER | {"dataprocess", "uploader"}, 60),
+    "dataprocess": (OPENCV | UNICATDB | JUPYTER | {"imgprocess"}, 150),
+    "imgprocess": (UNICATDB | JUPYTER, 600),
+    "uploader": (OPENCV | JUPYTER | {"imgprocess", "recompress"}, 700),
+    "all_in_one": (OPENCV | JUPYTER | {"imgprocess", "recompress"}, 700),
+    "uploadergui": (OPENCV | UNICATDB | {"imgprocess", "uploader", "all_in_one"}, 800)
+}
+
+def import_profile(script):
+    """
+    Imports given script in fresh interpreter and parses its -X importtime report.
+
+    Parameters
+    ----------
+    script : str
+        Name of custom script module
+
+    Returns
+    -------
+    float
+        Cumulative import time of the script in ms
+    set
+        Top level names of all imported modules
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {script}"],
+                          cwd=Path(__file__).resolve().parent, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Import of {script} failed:\n{proc.stderr}")
+    cumulative = None
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumul, name = line[len("import time:"):].split("|")
+        modules.add(name.strip().split(".")[0])
+        # Top level entry of the script itself has no indentation
+        if name.rstrip() == " " + script:
+            cumulative = int(cumul) / 1000
+    if cumulative is None:
+        raise RuntimeError(f"Import time report of {script} not found")
+    return cumulative, modules
+
+def bench(scripts, repeat=5, tolerance=0.25):
+    """
+    Benchmarks import of given scripts and prints the results.
+
+    Parameters
+    ----------
+    scripts : list of str
+        Scripts from IMPORT_BUDGETS to benchmark
+    repeat : int, optional
+        Number of fresh imports per script, the fastest one is used. Defaults to 5.
+    tolerance : float, optional
+        Allowed relative overrun of time budget, absorbs noise of machines. Defaults to 0.25.
+
+    Returns
+    -------
+    list of str
+        Found regressions, empty if all scripts are within budgets.
+    """
+    failures = []
+    print(f"{'script':<14}{'ms':>9}{'budget':>9}  forbidden imports")
+    for script in scripts:
+        forbidden, budget = IMPORT_BUDGETS[script]
+        runs = [import_profile(script) for _ in range(repeat)]
+        best = min(ms for ms, _ in runs)
+        loaded = sorted(forbidden & runs[0][1])
+        print(f"{script:<14}{best:9.1f}{budget:9d}  {', '.join(loaded) or '-'}")
+        if loaded:
+            failures.append(f"{script} imports {', '.join(loaded)}")
+        if best > budget * (1 + tolerance):
+            failures.append(f"{script} import takes {best:.1f} ms, budget is {budget} ms")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time benchmark of custom scripts.")
+    parser.add_argument("scripts", nargs="*", metavar="script",
+                        help=f"scripts to benchmark, all by default ({', '.join(IMPORT_BUDGETS)})")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh imports per script")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative overrun of budget")
+    args = parser.parse_args()
+    unknown = [script for script in args.scripts if script not in IMPORT_BUDGETS]
+    if unknown:
+        parser.error(f"unknown scripts {', '.join(unknown)}")
+    failures = bench(args.scripts or list(IMPORT_BUDGETS), repeat=args.repeat, tolerance=args.tolerance)
+    for failure in failures:
+        print("REGRESSION: " + failure)
+    sys.exit(1 if failures else 0)
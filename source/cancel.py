@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+cancel.py: Cooperative cancellation of processing and upload jobs. One token is
+shared by the caller (e.g. GUI) and the worker thread, workers check it between
+images, processing stages and upload chunks.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import threading
+
+class Cancelled(BaseException):
+    """
+    Raised by CancelToken.check when job has been cancelled. Derived from BaseException (same as
+    asyncio.CancelledError), so it passes through generic "except Exception" error handlers
+    which keep processing going after failure of single image or upload.
+    """
+
+class CancelToken():
+    """
+    Thread safe cancellation flag. Caller cancels the token, worker calls check at safe points
+    and stops by propagating Cancelled.
+    """
+    def __init__(self):
+        """
+        Constructor of CancelToken class. For full documentation do see class doc.
+        """
+        self.event = threading.Event()
+
+    def cancel(self):
+        """
+        Requests cancellation of the job.
+        """
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        """
+        Bool, True if cancellation has been requested.
+        """
+        return self.event.is_set()
+
+    def check(self):
+        """
+        Raises Cancelled if cancellation has been requested.
+
+        Raises
+        ------
+        Cancelled
+            Raises when the token has been cancelled.
+        """
+        if self.event.is_set():
+            raise Cancelled()
+
+    def wait(self, timeout=None):
+        """
+        Sleeps up to timeout seconds, wakes up early on cancellation.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Time to wait in seconds. Defaults to None, waits for cancellation.
+
+        Returns
+        -------
+        Bool
+            True if cancellation has been requested.
+        """
+        return self.event.wait(timeout)
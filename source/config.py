@@ -18,6 +18,13 @@ TYPE = "Recent"
 # Minimal username length accepted by user GUI in jupyter notebook
 MIN_USERNAME_LENGTH = 3
 
+# Refresh rate of progress bars in jupyter GUI (updates per second). Updates from workers are coalesced in between.
+GUI_REFRESH_RATE = 10
+
+# Statistics panel of jupyter GUI. Rates are computed over last GUI_STATS_WINDOW seconds, panel refreshes every GUI_STATS_INTERVAL seconds.
+GUI_STATS_WINDOW = 30
+GUI_STATS_INTERVAL = 1
+
 # Description where data from which location data have been uploaded (NOT AQUIRED!)
 LOCATION_DESCRIPTION = "Uploaded from University Southern Bohemia"
 
@@ -92,6 +99,11 @@ INTERNAL_NUMBER = {"RE":{
 # Image suffix names which shall be filtered out from name space.
 IMAGE_SUFFIX_NAMES = ["_c1", "_c2", "_c3"]
 
+# Channel images of one capture (same name up to suffix from IMAGE_SUFFIX_NAMES) are segmented once on REFERENCE_CHANNEL,
+# other channels reuse its contour and only their color is computed. If reference channel is missing, first channel is used.
+CHANNEL_AWARE = True
+REFERENCE_CHANNEL = "_c1"
+
 # Image name additions before numbers
 IMAGE_ADDITIONS = ["diaspore", "same", "hülle"]
 
@@ -109,6 +121,89 @@ H_AREA = 4000000
 # Uploader settings
 CHUNK_SIZE = 1000000
 
+# Number of retries of failed chunk upload and delay between them in seconds
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 5
+
+# Send SHA-256 checksum with every uploaded chunk if server supports TUS checksum extension. File digests are always stored in run report.
+UPLOAD_CHECKSUM = True
+
+# Path to machine readable upload run report. Suffix .csv stores per file table, anything else full json report. None disables the report.
+UPLOAD_REPORT = None
+
+# Lossless recompression of TIFFs before upload. None uploads files as they are, other options are "deflate", "lzw", "zstd"
+RECOMPRESS = None
+RECOMPRESS_WORKERS = 2
+
+# Files of at least PARALLEL_UPLOAD_MIN MB are split into PARALLEL_UPLOAD_PARTS partial uploads sent in parallel and joined
+# by server (TUS concatenation extension). Helps large stitched images over high latency links, servers without the
+# extension get sequential upload. 1 uploads every file sequentially.
+PARALLEL_UPLOAD_PARTS = 1
+PARALLEL_UPLOAD_MIN = 100
+
+# Findings of next FINDING_WINDOW groups are created while current group uploads, 0 creates each finding just before its files.
+FINDING_WINDOW = 2
+# Created findings are recorded in FINDING_LEDGER folder until all their files are uploaded. Findings left without all files
+# by interrupted runs are deleted by python -m archeoplant reconcile, or at start of every upload if RECONCILE_FINDINGS is
+# True. Deleted finding loses files which were already uploaded to it, check them with reconcile --dry-run first.
+FINDING_LEDGER = "findings_ledger"
+RECONCILE_FINDINGS = False
+
+# Upload bandwidth limit in MB/s shared by all uploads of one program, None is unlimited. UPLOAD_LIMIT_SCHEDULE overrides
+# it in day time windows ("HH:MM", "HH:MM", MB/s or None), e.g. [("07:00", "19:00", 5)] limits uploads to 5 MB/s during
+# lab hours, windows may cross midnight. Running uploads follow UPLOAD_LIMIT_FILE override set by python -m archeoplant limit.
+UPLOAD_LIMIT = None
+UPLOAD_LIMIT_SCHEDULE = []
+UPLOAD_LIMIT_FILE = "upload_limit.json"
+
+# Read-ahead of images on slow storage (USB drives, network shares). Next PREFETCH_FILES images are read in background while
+# current one is processed, read-ahead holds at most PREFETCH_MEMORY MB. 0 disables read-ahead.
+PREFETCH_FILES = 2
+PREFETCH_MEMORY = 512
+
+# Local staging cache for images on network shares. Every image is copied once to STAGING_DIR (local SSD folder), processing
+# and upload then read the local copy. Least recently used copies are removed above STAGING_QUOTA MB. None disables the cache.
+STAGING_DIR = None
+STAGING_QUOTA = 20000
+
+# Watch mode (python -m archeoplant watch). File is complete after WATCH_SETTLE seconds without change, seed group after
+# WATCH_GROUP_SETTLE seconds without change or once next seed is started. Folder is polled every WATCH_POLL_INTERVAL seconds
+# if watchdog library is not installed. Committed images are kept in WATCH_STATE json.
+WATCH_SETTLE = 2
+WATCH_GROUP_SETTLE = 5
+WATCH_POLL_INTERVAL = 2
+WATCH_STATE = "watch_state.json"
+
+# Persistent job queue (python -m archeoplant enqueue/jobs/worker). Workers hold claimed job for JOB_LEASE seconds and renew
+# the lease while running, job of dead worker is resumed by another one after the lease expires, at most JOB_MAX_ATTEMPTS
+# times. Idle workers look for new jobs every JOB_POLL_INTERVAL seconds.
+JOB_QUEUE = "jobs.sqlite"
+JOB_LEASE = 60
+JOB_POLL_INTERVAL = 5
+JOB_MAX_ATTEMPTS = 3
+
+# Local upload service (python -m archeoplant serve) shared by lab computers, clients submit batches with
+# python -m archeoplant submit. Service has no authentication, use "0.0.0.0" as host only within trusted lab network.
+# Throughput in status is computed over last SERVICE_STATS_WINDOW seconds.
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 5200
+SERVICE_STATS_WINDOW = 30
+
+# Pre Loader output. "json" saves preload_data.json, "sqlite" saves preload_data.sqlite store with images indexed by
+# species, type, vendor, upload status and extraction failure, suitable for large campaigns and partial uploads.
+PRELOAD_FORMAT = "json"
+
+# Columnar export of seed measurements written by Pre Loader next to preloaded data, e.g. "measurements.parquet". Suffix
+# gives format: .parquet or .arrow need pyarrow (.npz of the same name is written without it), .npz needs numpy only.
+# Records are written in batches of EXPORT_BATCH. None disables the export.
+MEASUREMENTS_EXPORT = None
+EXPORT_BATCH = 65536
+
+# Skip exact duplicates of images (same content in more folders) before processing and upload
+DEDUP = True
+# Json store of file fingerprints kept for later runs, None keeps them in memory only
+DEDUP_STORE = "fingerprints.json"
+
 # Color extraction settings
 COLOR_SAMPLE_SIZE = 50
 THRESHOLD_PAD = 20
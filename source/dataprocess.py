@@ -32,7 +32,7 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.1.4"
+__version__ = "1.14.1"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
@@ -41,21 +41,34 @@ __python__ = "3.8.0"
 
 # Import sys and pip libs
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import xml.etree.ElementTree as ET
 import xmltodict
 
-# Import custom scripts
-import imgprocess as ip
+# Import custom scripts. imgprocess (OpenCV, scipy) is imported on first image processing only,
+# metadata only runs and upload do not need it.
 # Get suffixes to fix file names of images. For more suffixes to filter, change config.py
-from config import IMAGE_SUFFIX_NAMES, IMAGE_ADDITIONS
+from config import IMAGE_SUFFIX_NAMES, IMAGE_ADDITIONS, DEDUP, DEDUP_STORE, CHANNEL_AWARE, REFERENCE_CHANNEL, \
+    PREFETCH_FILES, PREFETCH_MEMORY, STAGING_DIR, STAGING_QUOTA, MEASUREMENTS_EXPORT
 
 # Check if imgprocess has correct version
-from imgprocess import __version__ as __imv__
 from parsers import __zeiss_axiocam305c_parser__, __keyence_parser__
-from version_check import check_version
-check_version(__imv__, [1, 0, 6], "imgprocess.py")
-check_version(__imv__, [1, 0, 4], "parsers.py")
+from cancel import Cancelled
+from dedup import Deduplicator, report_duplicates
+from export import MeasurementExport
+from imagerecord import ImageRecord, plain
+from instrumentation import record
+from preloadstore import PreloadStore, is_store, load_groups, save_groups
+from progress import ByteProgress
+from staging import open_cache, format_report
+from version_check import check_version, module_version
+__imv__ = module_version("imgprocess")
+check_version(__imv__, [1, 3, 0], "imgprocess.py")
+check_version(module_version("parsers"), [1, 1, 0], "parsers.py")
 
 
 # Get current working directory for file management as global var
@@ -63,8 +76,14 @@ cwd = Path.cwd()
 rcwd = cwd / ".."
 rcwd = rcwd.resolve()
 
-# Global for interupting the script
-BREAK = False
+def __getattr__(name):
+    """
+    Lazy access to imgprocess as dataprocess.ip for scripts which used it before it became lazy.
+    """
+    if name == "ip":
+        import imgprocess
+        return imgprocess
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
 # clean addition and suffixes
 for pos, item in enumerate(IMAGE_SUFFIX_NAMES):
@@ -122,7 +141,7 @@ def img_meta_pair(groups, origin):
 
     return groups_holder
 
-def parse_meta(path, origin='zeiss axiocam 305c'):
+def parse_meta(path, origin='zeiss axiocam 305c', buffer=None):
     """
     Takes path to xml file with microscope meta data and extracts desired data for specified database.
 
@@ -132,6 +151,8 @@ def parse_meta(path, origin='zeiss axiocam 305c'):
         Path to target xml file with meta data to parse.
     origin : str, optional
         Origin of meta data. Important for various parsing mechanisms. Defaults to zeiss axiocam 305c.
+    buffer : bytes, optional
+        Already read content of Keyence image, meta data are parsed from it. Defaults to None.
 
     Returns
     -----
@@ -149,7 +170,7 @@ def parse_meta(path, origin='zeiss axiocam 305c'):
         meta_dict = xmltodict.parse(ET.tostring(ET.parse(path).getroot()))
         parsed_meta = __zeiss_axiocam305c_parser__(meta_dict)
     elif origin.lower() == 'keyence':
-        parsed_meta = __keyence_parser__(path)
+        parsed_meta = __keyence_parser__(path, buffer)
     else:
         raise IOError(f"Unknown meta data origin for {origin}! Please code missing meta parser.")
 
@@ -354,7 +375,90 @@ def get_groups(path, seed_delimiter = "_", seed_image_delimiter = "--", filetype
 
     return groups
 
-def raw_data_processing(pair, origin):
+def channel_sets(group):
+    """
+    Splits group of [img, meta] pairs to channel sets. Images which differ only by suffix from
+    IMAGE_SUFFIX_NAMES and share the same meta data are channels of one capture.
+
+    Parameters
+    ----------
+    group : list of lists
+        Group of [img, meta] pairs, see img_meta_pair
+
+    Returns
+    -------
+    list of lists
+        Positions of pairs in group, one list for every capture in order of first appearance
+    """
+    sets = {}
+    for pos, (img, meta) in enumerate(group):
+        img_path = Path(img)
+        if img_path.stem[-3:] in IMAGE_SUFFIX_NAMES:
+            stem = img_path.stem[:-3]
+        else:
+            stem = img_path.stem
+        sets.setdefault((img_path.parent / stem, str(meta)), []).append(pos)
+    return list(sets.values())
+
+def reference_channel(pairs):
+    """
+    Returns position of REFERENCE_CHANNEL image in channel set, 0 if there is none.
+
+    Parameters
+    ----------
+    pairs : list of lists
+        [img, meta] pairs of one capture
+
+    Returns
+    -------
+    int
+        Position of reference channel in pairs
+    """
+    for pos, (img, _) in enumerate(pairs):
+        if Path(img).stem[-3:] == REFERENCE_CHANNEL.lower():
+            return pos
+    return 0
+
+def raw_channel_processing(pairs, origin, cancel=None, keep_buffers=False, prefetcher=None, staging=None):
+    """Processes channel images of one capture with their meta data. Seed is segmented only on
+    reference channel, see imgprocess.preproces_channel_images.
+
+    Parameters
+    ----------
+    pairs : list of lists
+        [img, meta] pairs of one capture, see channel_sets
+    origin : str
+        Type of microscope used to aquire data
+    cancel : cancel.CancelToken, optional
+        Token checked between processing stages. Defaults to None.
+    keep_buffers : Bool, optional
+        Keeps read content of images in data, see raw_data_processing. Defaults to False.
+    prefetcher : Prefetcher, optional
+        Read-ahead of images, images are decoded from its buffers. Defaults to None.
+    staging : staging.StagingCache, optional
+        Local cache images are read from if they have not been read ahead. Defaults to None.
+
+    Returns
+    ------
+    list of dictionaries
+        Dictionary describing each image file in pairs order
+
+    Raises
+    ------
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
+    """
+    buffers = [prefetcher.get(img) if prefetcher else None for img, _ in pairs]
+    if len(pairs) == 1:
+        return [raw_data_processing(pairs[0], origin, cancel=cancel, keep_buffer=keep_buffers, buffer=buffers[0],
+                                    staging=staging)]
+    import imgprocess as ip
+    sources = [staging.stage(img) if staging and buffer is None else img for (img, _), buffer in zip(pairs, buffers)]
+    measures = ip.preproces_channel_images(sources, reference_channel(pairs), cancel=cancel, buffers=buffers)
+    return [raw_data_processing(pair, origin, cancel=cancel, measures=measure, keep_buffer=keep_buffers, buffer=buffer)
+            for pair, measure, buffer in zip(pairs, measures, buffers)]
+
+def raw_data_processing(pair, origin, cancel=None, measures=None, keep_buffer=False, buffer=None, staging=None):
     """Processed one image with its associated meta data.
     Calculates seed dimensions, color, boundingbox ratio.
 
@@ -364,27 +468,86 @@ def raw_data_processing(pair, origin):
         Pair of image to be processed with associated metadata
     origin : str
         Type of microscope used to aquire data
+    cancel : cancel.CancelToken, optional
+        Token checked between processing stages. Defaults to None.
+    measures : tuple, optional
+        Already measured (max_x_dist, max_y_dist, area, hex_color) of the image, see
+        imgprocess.preproces_seed_image. Defaults to None, which processes the image.
+    keep_buffer : Bool, optional
+        Keyence image is read from disk once for meta data and image decode. If True, content of
+        read image is kept in data as img_buffer, so upload does not need to read it again.
+        Defaults to False.
+    buffer : bytes, optional
+        Already read content of the image, e.g. from Prefetcher. Defaults to None.
+    staging : staging.StagingCache, optional
+        Local cache the image is read from if no buffer is given. Defaults to None.
 
     Returns
     ------
-    dictionary
-        Dictionary describing one image file
+    imagerecord.ImageRecord
+        Record describing one image file, mapping of preload json schema
+
+    Raises
+    ------
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
     """
     # lets process those damn data!
     imag = pair[0]
     meta = pair[1]
 
+    # Keyence stores meta data inside of the image, read the file once for both
+    source = staging.stage(imag) if staging and buffer is None else imag
+    if buffer is None and origin.lower() == 'keyence' and str(imag) == str(meta):
+        buffer = read_file(source)
+
     # Parse meta data
-    data = parse_meta(meta, origin=origin)
+    start = time.perf_counter()
+    data = parse_meta(meta, origin=origin, buffer=buffer)
+    record("metadata", time.perf_counter() - start)
+    if cancel:
+        cancel.check()
+
+    # Process image data, OpenCV gets loaded with first image
+    if measures is None:
+        import imgprocess as ip
+        measures = ip.preproces_seed_image(source, cancel=cancel, buffer=buffer)
+    failed = apply_measures(data, measures)
+    record("image", nbytes=file_size(imag), items=1, failed=failed)
+    data['img_path'] = imag
+    data['meta_path'] = meta
+    if keep_buffer and buffer is not None:
+        data['img_buffer'] = buffer
+    return ImageRecord(data)
+
+def apply_measures(data, measures):
+    """
+    Converts measures of image to seed dimensions, color and bounding box ratio of its data.
+    Failed extraction is recorded as extraction_failure with its stage and error.
+
+    Parameters
+    ----------
+    data : dict
+        Parsed meta data of the image, updated in place
+    measures : tuple
+        (max_x_dist, max_y_dist, area, hex_color) of the image, see imgprocess.preproces_seed_image
 
-    # Process image data
-    max_x_dist, max_y_dist, area, hex_color = ip.preproces_seed_image(imag)
+    Returns
+    -------
+    Bool
+        True if extraction failed
+    """
+    max_x_dist, max_y_dist, area, hex_color = measures
     # Catch if image processing failed
-    if max_x_dist == 0 or max_y_dist == 0 or area == 0:
+    failed = max_x_dist == 0 or max_y_dist == 0 or area == 0
+    if failed:
         data['x_length'] = 0
         data['y_length'] = 0
         data['area'] = 0
         data['bound_seed_ratio'] = 0
+        # Measures without error are seed which was found with zero size
+        data['extraction_failure'] = {"stage": getattr(measures, "stage", "segmentation"),
+                                      "error": getattr(measures, "error", "Seed has zero size")}
     else:
         # Convert pixels to um
         data['x_length'] = px_to_metric(max_x_dist, data['scaling']['x'], data['scalingunit'])
@@ -392,12 +555,267 @@ def raw_data_processing(pair, origin):
         data['area'] = px_to_metric(area, (data['scaling']['x']+data['scaling']['y'])/2,
                                     data['scalingunit'])
         data['bound_seed_ratio'] = data['area'] / (data['x_length'] * data['y_length'])
+        data.pop('extraction_failure', None)
     data['hex_color'] = "#"+hex_color
-    data['img_path'] = imag
-    data['meta_path'] = meta
-    return data
+    return failed
+
+def scan_folders(path, origin, dedup=None):
+    """
+    Scans given folder for species folders and pairs their images with meta data. Scan is done
+    upfront, so the amount of files and their sizes is known before any processing starts.
+    Images with the same content as an earlier scanned image are reported and skipped.
+
+    Parameters
+    ----------
+    path : str
+        Path to folder with seed folders which contain images and meta data
+    origin : str
+        Origin of images. Important to say, which microscope took the pictures
+    dedup : Bool, optional
+        Toggles skipping of duplicate images. Defaults to None, DEDUP from config is used.
+
+    Returns
+    -------
+    list of tuples
+        One tuple (species_name, nr, group) for every group of images in processing order.
+        nr is 0 for diaspore groups and 1 for seed groups, group is list of [img, meta] pairs.
+    """
+    IMG_SUBS = resolve_folders(path)
+    jobs = []
+    for folder in IMG_SUBS:
+        # Get species name. Folder naming is important!
+        SPECIES_NAME = folder.name.title()
+        # Check if in nested folders there is one named diaspore
+        DIASPORE_CONTENT_GROUPS = []
+        for subfolder in [f for f in folder.iterdir() if f.is_dir()]:
+            if subfolder.name.lower() == 'diaspore':
+                # If there is one, lets get them in image groups and get img and meta data paths
+                try:
+                    DIASPORE_CONTENT_GROUPS = img_meta_pair(get_groups(subfolder), origin)
+                except IndexError:
+                    DIASPORE_CONTENT_GROUPS = []
+
+        # Lets get seed and meta data paths
+        try:
+            SEED_CONTENT_GROUPS = img_meta_pair(get_groups(folder), origin)
+        except IndexError:
+            SEED_CONTENT_GROUPS = []
+
+        for nr, groups in enumerate([DIASPORE_CONTENT_GROUPS, SEED_CONTENT_GROUPS]):
+            for group in groups:
+                jobs.append((SPECIES_NAME, nr, group))
+
+    if DEDUP if dedup is None else dedup:
+        groups, found = Deduplicator(resolve_path(DEDUP_STORE) if DEDUP_STORE else None).filter_groups(
+            [group for _, _, group in jobs])
+        report_duplicates(found)
+        jobs = [(SPECIES_NAME, nr, group) for (SPECIES_NAME, nr, _), group in zip(jobs, groups) if group]
+    return jobs
+
+def read_file(path):
+    """
+    Reads entire file into memory.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to file
+
+    Returns
+    -------
+    bytes
+        Content of the file
+    """
+    start = time.perf_counter()
+    buffer = Path(path).read_bytes()
+    record("read", time.perf_counter() - start, nbytes=len(buffer))
+    return buffer
+
+def processing_order(jobs):
+    """
+    Returns image paths of scanned jobs in the order in which main processes them.
+
+    Parameters
+    ----------
+    jobs : list of tuples
+        Output of scan_folders
+
+    Returns
+    -------
+    list of str
+        Paths of images
+    """
+    order = []
+    for _, _, group in jobs:
+        sets = channel_sets(group) if CHANNEL_AWARE else [[pos] for pos in range(len(group))]
+        for positions in sets:
+            order.extend(str(group[pos][0]) for pos in positions)
+    return order
+
+class Prefetcher():
+    """
+    Read-ahead of images on slow storage. Files of next images are read in background threads
+    while the current image is processed, processing then decodes them from memory. Files are
+    requested by get in the order given on construction. Files skipped by the caller are dropped.
+    """
+    def __init__(self, paths, depth=PREFETCH_FILES, budget=PREFETCH_MEMORY, staging=None):
+        """
+        Constructor of Prefetcher class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        paths : list of str or pathlib.Path
+            Paths of files in order of their processing, see processing_order
+        depth : int, optional
+            Maximal amount of files read ahead. Defaults to PREFETCH_FILES from config.
+        budget : numeric, optional
+            Maximal size of read ahead files in MB. One file is always read ahead, even if it is
+            larger. Defaults to PREFETCH_MEMORY from config.
+        staging : staging.StagingCache, optional
+            Local cache files are copied to and read from. Defaults to None.
+        """
+        self.paths = [str(path) for path in paths]
+        self.index = {path: pos for pos, path in reversed(list(enumerate(self.paths)))}
+        self.depth = depth
+        self.budget = budget * 1000000
+        self.staging = staging
+        self.pool = ThreadPoolExecutor(max_workers=max(depth, 1), thread_name_prefix="prefetch")
+        self.jobs = {}
+        self.held = 0
+        self.pos = 0
+        self.lock = threading.Lock()
+        with self.lock:
+            self.__fill__()
+
+    def __fill__(self):
+        """
+        Schedules reads of next files within depth and memory budget. Has to be called with lock.
+        """
+        while self.pos < len(self.paths) and len(self.jobs) < self.depth:
+            path = self.paths[self.pos]
+            size = file_size(path)
+            if self.jobs and self.held + size > self.budget:
+                break
+            self.pos += 1
+            if path in self.jobs:
+                continue
+            self.jobs[path] = (self.pool.submit(self.__read__, path), size, self.pos - 1)
+            self.held += size
+
+    def __read__(self, path):
+        """
+        Reads one file, through staging cache if there is one.
+        """
+        return read_file(self.staging.stage(path) if self.staging else path)
+
+    def get(self, path):
+        """
+        Returns content of given file, waits for its read if it is still running. Schedules
+        read of next files.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to file
+
+        Returns
+        -------
+        bytes or None
+            Content of the file or None if it has not been read ahead (or the read failed),
+            caller should read the file itself.
+        """
+        path = str(path)
+        with self.lock:
+            job = self.jobs.pop(path, None)
+            if job is None:
+                # Not read ahead yet, continue reading behind it
+                self.pos = max(self.pos, self.index.get(path, -1) + 1)
+            else:
+                self.held -= job[1]
+            # Drop files the caller skipped
+            for skipped in [key for key, (_, _, pos) in self.jobs.items() if pos < self.index.get(path, -1)]:
+                future, size, _ = self.jobs.pop(skipped)
+                future.cancel()
+                self.held -= size
+            self.__fill__()
+        if job is None:
+            return None
+        try:
+            return job[0].result()
+        except OSError:
+            return None
+
+    def close(self):
+        """
+        Stops reading ahead and frees read ahead files.
+        """
+        with self.lock:
+            for future, _, _ in self.jobs.values():
+                future.cancel()
+            self.jobs = {}
+            self.held = 0
+            self.pos = len(self.paths)
+        self.pool.shutdown(wait=False)
+
+def group_key(group):
+    """
+    Returns key of group which stays the same between runs, used to resume interrupted jobs.
+
+    Parameters
+    ----------
+    group : list
+        Group of [img, meta] pairs or of processed data dictionaries
+
+    Returns
+    -------
+    str
+        Posix path of the first image of group
+    """
+    first = group[0]
+    return Path(first[0] if isinstance(first, (list, tuple)) else first['img_path']).as_posix()
+
+def file_size(path):
+    """
+    Returns size of file in bytes, 0 if file does not exist.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to file
+
+    Returns
+    -------
+    int
+        Size of file in bytes
+    """
+    try:
+        return Path(path).stat().st_size
+    except OSError:
+        return 0
+
+def group_size(group):
+    """
+    Returns amount of bytes of all files in group of [img, meta] pairs. Keyence pairs, where image
+    and meta data are the same file, are counted once.
+
+    Parameters
+    ----------
+    group : list of lists
+        Group of [img, meta] pairs
 
-def main(path, origin, generator=True, save=False, consolecall=False):
+    Returns
+    -------
+    int
+        Size of all files in group in bytes
+    """
+    size = 0
+    for img, meta in group:
+        size += file_size(img)
+        if str(meta) != str(img):
+            size += file_size(meta)
+    return size
+
+def main(path, origin, generator=True, save=False, consolecall=False, jobs=None, cancel=None, keep_buffers=False):
     """
     Checks content of given folder for .tif files and their associated meta data.
     For each image reads relevant data from its meta data and calculates
@@ -413,6 +831,14 @@ def main(path, origin, generator=True, save=False, consolecall=False):
     save : Bool, optional
         Changes whether output of processing should be saved as json or not to cwd.
         Defaults to False
+    jobs : list, optional
+        Output of scan_folders if the folder has already been scanned. Defaults to None, which
+        scans the folder.
+    cancel : cancel.CancelToken, optional
+        Token checked before every image and between its processing stages. Defaults to None.
+    keep_buffers : Bool, optional
+        Keeps read content of images in data as img_buffer for upload. Not json serializable,
+        use with generator only. Defaults to False.
 
     Returns
     -------
@@ -425,71 +851,67 @@ def main(path, origin, generator=True, save=False, consolecall=False):
     ------
     NotImplementedError
         Should never occure, unless you change the code below. Indicates more groups than defined
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
     """
-    IMG_SUBS = resolve_folders(path)
+    if jobs is None:
+        jobs = scan_folders(path, origin)
     data_out = []
-    # Open folders one by one and process images inside
-    for folder in IMG_SUBS:
-        # Get species name. Folder naming is important!
-        SPECIES_NAME = folder.name.title()
-        if consolecall:
-            print(f"Now processing {SPECIES_NAME}")
-        # Check opened folder has nested folders
-        diaspore = [f for f in folder.iterdir() if f.is_dir()]
-        if len(diaspore) >= 1:
-            # Check if in found folders there is one named diaspore
-            for subfolder in diaspore:
-                if subfolder.name.lower() == 'diaspore':
-                    # If there is one, lets get them in image groups and get img and meta data paths
-                    groups = get_groups(subfolder)
-                    pairs = img_meta_pair(groups, origin)
-                    if pairs is not None:
-                        DIASPORE_CONTENT_GROUPS = pairs
-                    else:
-                        DIASPORE_CONTENT_GROUPS = []
-        else:
-            DIASPORE_CONTENT_GROUPS = []
-
-        # Lets get seed and meta data paths
-        try:
-            groups = get_groups(folder)
-            pairs = img_meta_pair(groups, origin)
-            if pairs is not None:
-                SEED_CONTENT_GROUPS = pairs
-            else:
-                SEED_CONTENT_GROUPS = []
-        except IndexError:
-            SEED_CONTENT_GROUPS = []
-
-        for nr, groups in enumerate([DIASPORE_CONTENT_GROUPS, SEED_CONTENT_GROUPS]):
+    current_species = None
+    # Images on network share are copied to local staging cache once
+    staging = open_cache(STAGING_DIR, STAGING_QUOTA) if STAGING_DIR else None
+    # Read images ahead in background while current one is processed
+    prefetcher = Prefetcher(processing_order(jobs), staging=staging) if PREFETCH_FILES > 0 else None
+    try:
+        # Process groups one by one in scanned order
+        for SPECIES_NAME, nr, group in jobs:
+            if consolecall and SPECIES_NAME != current_species:
+                print(f"Now processing {SPECIES_NAME}")
+            current_species = SPECIES_NAME
             group_temp = []
-            for group in groups:
-                for pair in group:
-                    data = raw_data_processing(pair, origin)
-                    # Add species name to data
-                    data['species_name'] = SPECIES_NAME
-                    # Add seed or diaspore. Diaspore = 0, Seed = 1
-                    if nr == 0:
-                        data['type'] = ['Diaspore']
-                    elif nr == 1:
-                        data['type'] = ['Seed']
-                    else:
-                        raise NotImplementedError("Unexpected type classificator. nr should be only 0 or 1.")
-
-                    group_temp.append(data)
-                if generator:
-                    yield group_temp
-                data_out.append(group_temp)
-                group_temp = []
+            # Channel images of one capture are processed together, results keep order of group
+            if CHANNEL_AWARE:
+                sets = channel_sets(group)
+            else:
+                sets = [[pos] for pos in range(len(group))]
+            results = [None] * len(group)
+            for positions in sets:
+                if cancel:
+                    cancel.check()
+                processed = raw_channel_processing([group[pos] for pos in positions], origin, cancel=cancel,
+                                                   keep_buffers=keep_buffers, prefetcher=prefetcher, staging=staging)
+                for pos, data in zip(positions, processed):
+                    results[pos] = data
+            for data in results:
+                # Add species name to data
+                data['species_name'] = SPECIES_NAME
+                # Add seed or diaspore. Diaspore = 0, Seed = 1
+                if nr == 0:
+                    data['type'] = ['Diaspore']
+                elif nr == 1:
+                    data['type'] = ['Seed']
+                else:
+                    raise NotImplementedError("Unexpected type classificator. nr should be only 0 or 1.")
+
+                group_temp.append(data)
+            if generator:
+                yield group_temp
+            data_out.append(group_temp)
+    finally:
+        if prefetcher:
+            prefetcher.close()
+        if staging:
+            staging.save()
     if save:
         if consolecall:
             print("Saving results...")
         with open(cwd / "preload_data.json", 'w') as fout:
-            json.dump(data_out , fout, indent=2)
+            json.dump(data_out , fout, indent=2, default=plain)
     if not generator:
         return data_out
 
-def preload_data(input_path, origin, output_path="", save=False, relative=False, consolecall=False, progresshandler=None):
+def preload_data(input_path, origin, output_path="", save=False, relative=False, consolecall=False, progresshandler=None,
+                 etahandler=None, cancel=None, completed=None, grouphandler=None, export=None):
     """
     Prepares data for delayed upload. Extracts all required data from metadata and images and saves
     or returns them as dictionary or json.
@@ -503,7 +925,8 @@ def preload_data(input_path, origin, output_path="", save=False, relative=False,
     output_path : str, optional
         Output where json should be stored. Defaults to "" which means cwd.
     save : Bool, optional
-        Toggles saving of preloaded data as json. Saves as preload_data.json The default is False.
+        Toggles saving of preloaded data. Saves as preload_data.json, or preload_data.sqlite store
+        if PRELOAD_FORMAT in config is "sqlite". The default is False.
     relative : Bool, optional
         Toggles whether preloaded directory should be relative or absolute. Relative directory can
         be later uploaded even from different computer. The default is False.
@@ -512,6 +935,23 @@ def preload_data(input_path, origin, output_path="", save=False, relative=False,
     progresshandler : method
         Method of GUI which manages progressbar. Method has to accept 2 arguments. Numeric count of
         processed file. Bool finished is flag on last execution to let GUI know evertything is done
+        Progress is weighted by bytes of processed files, see progress.ByteProgress. First call comes
+        with ct_max None while folders are scanned and total is not known yet.
+    etahandler : method, optional
+        Handler receiving progress state with ETA, current rate and remaining bytes on each update.
+        See progress.ByteProgress.state. Defaults to None.
+    cancel : cancel.CancelToken, optional
+        Token which stops processing within one image. Groups processed until then are kept.
+        Defaults to None.
+    completed : set, optional
+        Keys of groups processed by interrupted run which should be skipped, see group_key.
+        Defaults to None.
+    grouphandler : method, optional
+        Handler called with key and processed data of every finished group. Defaults to None.
+    export : str, optional
+        Path of columnar export of measurements written while groups are processed, see
+        export.MeasurementExport. Relative path is placed into output_path when saving.
+        Defaults to None, MEASUREMENTS_EXPORT from config. False disables the export.
 
     Returns
     -------
@@ -520,9 +960,20 @@ def preload_data(input_path, origin, output_path="", save=False, relative=False,
         uploaded. If saving is enforced, returns number of saved elements in generated json
         (file count).
     """
-    global BREAK
+    # Total is not known until folders are scanned, let GUI show indeterminate progress
+    if progresshandler:
+        progresshandler(0)
+    # Scan folders first so the amount of work is known in bytes
+    jobs = scan_folders(input_path, origin)
+    if completed:
+        jobs = [job for job in jobs if group_key(job[2]) not in completed]
+    sizes = [group_size(group) for _, _, group in jobs]
+    staging = open_cache(STAGING_DIR, STAGING_QUOTA) if STAGING_DIR else None
+    staging_since = staging.counters() if staging else None
+    progress = ByteProgress({"process": sum(sizes)}, progresshandler=progresshandler, etahandler=etahandler)
+    progress.notify()
     # Preload groups in generator
-    group_generator = main(input_path, origin=origin, consolecall=consolecall, generator=True)
+    group_generator = main(input_path, origin=origin, consolecall=consolecall, generator=True, jobs=jobs, cancel=cancel)
 
     if save:
         # Check, if path is relative or has to be cwd
@@ -537,47 +988,176 @@ def preload_data(input_path, origin, output_path="", save=False, relative=False,
     # Holder for output list
     output_holder = []
     ct = 0
-    while not BREAK:
-        try:
-            # Get one group and process it
-            group = next(group_generator)
-            temp_group = []
-            for data in group:
-                if relative:
-                    try:
-                        data['img_path'] = data['img_path'].relative_to(rcwd).as_posix()
-                        data['meta_path'] = data['meta_path'].relative_to(rcwd).as_posix()
-                    except ValueError: # Not nices way to catch paths but hey it works
+    # Measurements are exported group by group, groups processed until error or cancel are kept
+    if export is None:
+        export = MEASUREMENTS_EXPORT
+    exporter = None
+    if export:
+        exporter = MeasurementExport(output_path / export if save else resolve_path(export))
+    try:
+        while True:
+            try:
+                # Get one group and process it
+                start = time.perf_counter()
+                group = next(group_generator)
+                progress.advance("process", sizes[len(output_holder)], time.perf_counter() - start)
+                temp_group = []
+                for data in group:
+                    if relative:
+                        try:
+                            data['img_path'] = data['img_path'].relative_to(rcwd).as_posix()
+                            data['meta_path'] = data['meta_path'].relative_to(rcwd).as_posix()
+                        except ValueError: # Not nices way to catch paths but hey it works
+                            data['img_path'] = data['img_path'].as_posix()
+                            data['meta_path'] = data['meta_path'].as_posix()
+                    else:
                         data['img_path'] = data['img_path'].as_posix()
                         data['meta_path'] = data['meta_path'].as_posix()
-                else:
-                    data['img_path'] = data['img_path'].as_posix()
-                    data['meta_path'] = data['meta_path'].as_posix()
-                temp_group.append(data)
-                ct += 1
-                if progresshandler:
-                    progresshandler(ct, ct_max=None)
-            # Append group to output list and reset temp group
-            output_holder.append(temp_group)
-            temp_group = []
-        except StopIteration:
-            if consolecall:
-                print("All data have been processed.")
-            break
-    BREAK = False
-    if progresshandler:
-        progresshandler(ct, ct_max=None, finished=True)
+                    temp_group.append(data)
+                    ct += 1
+                if grouphandler:
+                    grouphandler(group_key(jobs[len(output_holder)][2]), temp_group)
+                if exporter:
+                    exporter.write_group(temp_group)
+                # Append group to output list and reset temp group
+                output_holder.append(temp_group)
+                temp_group = []
+            except StopIteration:
+                if consolecall:
+                    print("All data have been processed.")
+                break
+            except Cancelled:
+                if consolecall:
+                    print("Processing has been stopped.")
+                break
+    finally:
+        if exporter:
+            exporter.close()
+    progress.notify(finished=True)
+    if staging and consolecall:
+        print(format_report(staging.report(staging_since)))
     # If promted save groups as json, else return list of lists with dictionaries
     if save:
         if consolecall:
             print("Saving results...")
-        with open(output_path / "preload_data.json", 'w') as fout:
-            json.dump(output_holder , fout, indent=2)
+        # Relative image paths are relative to repository folder
+        save_groups(output_holder, output_path, base=rcwd)
         # If saving, returns number of groups in json
         return ct
     else:
         return output_holder
 
+def retry_overrides(overrides, data):
+    """
+    Returns segmentation overrides of one preloaded image. Settings of "*" apply to every image,
+    settings keyed by image path (as stored by preload) or file name are added on top of them.
+
+    Parameters
+    ----------
+    overrides : dict
+        {"*" or image path or file name: {setting name: value}}, see imgprocess.extraction_params
+    data : dict
+        Preloaded data of the image
+
+    Returns
+    -------
+    dict
+        Settings overridden for the image keyed by names of config, empty if none
+    """
+    path = Path(data['img_path'])
+    params = {}
+    for key in ("*", path.name, path.as_posix()):
+        params.update({name.upper(): value for name, value in overrides.get(key, {}).items()})
+    return params
+
+def retry_failed(path, overrides=None, flagged_only=False, consolecall=False, cancel=None):
+    """
+    Runs feature extraction again for failed images of preloaded data and merges the results into
+    it in place. Images named in overrides are flagged and run again even if they did not fail.
+    Meta data are not parsed again, measures are converted by stored scaling.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to preload_data.json or preload store. Relative image paths are resolved against its
+        folder, same as upload does.
+    overrides : dict, optional
+        Segmentation settings overridden for retried images, see retry_overrides. Used settings are
+        stored in data of image as extraction_params. Defaults to None, settings of config.
+    flagged_only : Bool, optional
+        Runs only images named in overrides, not all failed ones. Defaults to False.
+    consolecall : Bool, optional
+        Toggles console prints about processing status. Defaults to False.
+    cancel : cancel.CancelToken, optional
+        Token which stops retry, images finished until then are merged. Defaults to None.
+
+    Returns
+    -------
+    dict
+        Amount of retried images, fixed ones and ones which still failed
+
+    Raises
+    ------
+    ValueError
+        Raises when overrides contain unknown setting.
+    """
+    import imgprocess as ip
+    overrides = overrides or {}
+    for params in overrides.values():
+        ip.extraction_params(params)
+    flagged = set(overrides) - {"*"}
+    path = resolve_path(path).resolve()
+    parent = path.parent
+    store = is_store(path)
+    # Store answers failed images by its index, flagged ones can be anywhere
+    groups = load_groups(path, failed=None if flagged or not store else True)
+    selected = []
+    for group in groups:
+        for data in group:
+            img = Path(data['img_path'])
+            if img.name in flagged or img.as_posix() in flagged:
+                selected.append(data)
+            elif not flagged_only and (data.get('extraction_failure') or not data.get('area')):
+                selected.append(data)
+    summary = {"retried": 0, "fixed": 0, "failed": 0}
+    if consolecall:
+        print(f"Retrying feature extraction of {len(selected)} images...")
+    retried = []
+    for data in selected:
+        try:
+            if cancel:
+                cancel.check()
+            params = retry_overrides(overrides, data)
+            img = Path(data['img_path'])
+            measures = ip.preproces_seed_image(parent / img, cancel=cancel, params=params)
+        except Cancelled:
+            if consolecall:
+                print("Retry has been stopped.")
+            break
+        failed = apply_measures(data, measures)
+        if params:
+            data['extraction_params'] = params
+        else:
+            data.pop('extraction_params', None)
+        record("image", nbytes=file_size(parent / img), items=1, failed=failed)
+        retried.append(data)
+        summary["retried"] += 1
+        summary["failed" if failed else "fixed"] += 1
+        if consolecall:
+            print(f"{img.name}: " + (f"failed in {data['extraction_failure']['stage']}" if failed else "fixed"))
+    # Merge results into preloaded data, json is replaced atomically
+    if retried:
+        if store:
+            PreloadStore(path).update(retried)
+        else:
+            tmp = Path(str(path) + ".tmp")
+            with open(tmp, 'w') as fout:
+                json.dump(groups, fout, indent=2, default=plain)
+            os.replace(tmp, path)
+    if consolecall:
+        print(f"Retried {summary['retried']} images, {summary['fixed']} fixed, {summary['failed']} still failed.")
+    return summary
+
 if __name__ == "__main__":
     # Runs this script in current working directory. Looks for folder
     # named to_be_uploaded
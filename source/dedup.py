@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+dedup.py: Content based deduplication of images before processing and upload.
+Files are fingerprinted cheaply: size first, sampled hash of files with equal
+size next and full SHA-256 only on sampled hash collision. Fingerprints are
+stored in json file and reused by later runs while files stay unchanged.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Size of one sampled block, start, middle and end of file are sampled
+SAMPLE_BLOCK = 65536
+
+def sampled_hash(path, size):
+    """
+    Hashes size and start, middle and end blocks of the file. Small files are hashed whole.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to file
+    size : int
+        Size of the file in bytes
+
+    Returns
+    -------
+    str
+        Hex digest of sampled content
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(size.to_bytes(8, "little"))
+    with open(path, "rb") as fin:
+        if size <= 3 * SAMPLE_BLOCK:
+            digest.update(fin.read())
+        else:
+            for offset in (0, size // 2 - SAMPLE_BLOCK // 2, size - SAMPLE_BLOCK):
+                fin.seek(offset)
+                digest.update(fin.read(SAMPLE_BLOCK))
+    return digest.hexdigest()
+
+def full_hash(path):
+    """
+    Hashes whole file with SHA-256, same digest as stored in upload run report.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to file
+
+    Returns
+    -------
+    str
+        Hex digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FingerprintStore():
+    """
+    Json store of file fingerprints. Fingerprint is reused only while size and modification time
+    of the file stay the same.
+    """
+    def __init__(self, path=None):
+        """
+        Constructor of FingerprintStore class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path, optional
+            Path to json store. Defaults to None, fingerprints are kept in memory only.
+        """
+        self.path = Path(path) if path else None
+        self.files = {}
+        self.changed = False
+        if self.path and self.path.is_file():
+            try:
+                with open(self.path, "r") as fin:
+                    self.files = json.load(fin)["files"]
+            except (ValueError, KeyError, OSError) as e:
+                print("Fingerprint store could not be loaded, starting empty: " + str(e.__class__.__name__) + " " + str(e))
+
+    def get(self, path, stat, kind):
+        """
+        Returns stored fingerprint of given kind ("sample" or "full") or None.
+        """
+        entry = self.files.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry.get(kind)
+
+    def put(self, path, stat, kind, value):
+        """
+        Stores fingerprint of given kind ("sample" or "full").
+        """
+        entry = self.files.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = self.files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        entry[kind] = value
+        self.changed = True
+
+    def save(self):
+        """
+        Writes the store if anything changed. File is replaced atomically.
+        """
+        if not self.path or not self.changed:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as fout:
+            json.dump({"version": 1, "files": self.files}, fout)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+class Deduplicator():
+    """
+    Finds exact duplicates of files. Only files of equal size are hashed, sampled hash goes first
+    and full hash is computed only for files with equal sampled hash.
+    """
+    def __init__(self, store_path=None):
+        """
+        Constructor of Deduplicator class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        store_path : str or pathlib.Path, optional
+            Path to json store of fingerprints kept for later runs. Defaults to None.
+        """
+        self.store = FingerprintStore(store_path)
+
+    def duplicates(self, paths):
+        """
+        Finds duplicates among given files. The first occurence of content is the original.
+
+        Parameters
+        ----------
+        paths : list of str
+            Paths to files in priority order
+
+        Returns
+        -------
+        dict
+            {duplicate path: original path}
+        """
+        # Size first, unreadable files are never duplicates
+        stats = {}
+        by_size = {}
+        for path in dict.fromkeys(Path(p).resolve().as_posix() for p in paths):
+            try:
+                stats[path] = os.stat(path)
+            except OSError:
+                continue
+            by_size.setdefault(stats[path].st_size, []).append(path)
+
+        found = {}
+        for size, candidates in by_size.items():
+            if len(candidates) < 2:
+                continue
+            by_sample = {}
+            for path in candidates:
+                by_sample.setdefault(self.__fingerprint__(path, stats[path], "sample"), []).append(path)
+            for same_sample in by_sample.values():
+                if len(same_sample) < 2:
+                    continue
+                originals = {}
+                for path in same_sample:
+                    digest = self.__fingerprint__(path, stats[path], "full")
+                    if digest in originals:
+                        found[path] = originals[digest]
+                    else:
+                        originals[digest] = path
+        self.store.save()
+        return found
+
+    def filter_groups(self, groups, key=lambda pair: pair[0]):
+        """
+        Removes items whose file duplicates file of an earlier item.
+
+        Parameters
+        ----------
+        groups : list of lists
+            Groups of items, e.g. [img, meta] pairs or processed image dictionaries
+        key : method, optional
+            Returns path of image from item. Defaults to first element of pair.
+
+        Returns
+        -------
+        list of lists
+            Groups without duplicates in the same order, groups may become empty
+        dict
+            {duplicate path: original path} of skipped items
+        """
+        found = self.duplicates([key(item) for group in groups for item in group])
+        kept = [[item for item in group if Path(key(item)).resolve().as_posix() not in found] for group in groups]
+        return kept, found
+
+    def __fingerprint__(self, path, stat, kind):
+        """
+        Returns fingerprint of given kind from store or computes it.
+        """
+        value = self.store.get(path, stat, kind)
+        if value is None:
+            value = sampled_hash(path, stat.st_size) if kind == "sample" else full_hash(path)
+            self.store.put(path, stat, kind, value)
+        return value
+
+def report_duplicates(found):
+    """
+    Prints skipped duplicates.
+
+    Parameters
+    ----------
+    found : dict
+        {duplicate path: original path}
+    """
+    for duplicate, original in found.items():
+        print(f"Skipping duplicate image {duplicate} (same content as {original})")
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+export.py: Columnar export of seed measurements extracted by Pre Loader for
+analytics. Writes Parquet or Arrow IPC (pyarrow) or NumPy .npz without extra
+dependencies. Records are written batch by batch while groups are preloaded,
+repeated strings (species, microscope meta data) are dictionary encoded.
+
+__doc__ using Sphnix Style
+"""
+
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.1"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+
+# Import required libs. numpy and pyarrow are imported by the writer which needs them,
+# dataprocess imports this script and has to stay light.
+import importlib.util
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+
+from config import EXPORT_BATCH
+
+# Numeric columns and keys of their values in preloaded data
+NUMERIC = {"x_length": ("x_length",), "y_length": ("y_length",), "area": ("area",),
+           "bound_seed_ratio": ("bound_seed_ratio",), "timestamp": ("timestamp",),
+           "totalmagnification": ("totalmagnification",), "pixelaccuracy": ("pixelaccuracy",),
+           "scaling_x": ("scaling", "x"), "scaling_y": ("scaling", "y"), "scaling_z": ("scaling", "z")}
+# String columns with few distinct values, dictionary encoded
+CATEGORIES = ["species_name", "type", "hex_color", "vendor", "model", "sdk", "adapter", "objective", "focusmethod",
+              "texturemethod", "topographymethod", "scalingunit"]
+# String columns unique for every record, stored plain
+TEXTS = ["img_path", "meta_path"]
+# Suffixes of export formats
+FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".npz": "npz"}
+
+def export_format(path):
+    """
+    Returns export format of given path, npz if pyarrow format is requested without pyarrow installed.
+
+    Raises
+    ------
+    ValueError
+        Raises when suffix of path is not one of FORMATS.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix not in FORMATS:
+        raise ValueError(f"Unknown export format {suffix}! Use one of {', '.join(FORMATS)}.")
+    # pyarrow is optional, exports fall back to npz without it
+    if FORMATS[suffix] != "npz" and importlib.util.find_spec("pyarrow") is None:
+        return "npz"
+    return FORMATS[suffix]
+
+def row(data):
+    """
+    Returns values of export columns of one preloaded image. Missing values are None.
+    """
+    values = {}
+    for name, keys in NUMERIC.items():
+        value = data
+        for key in keys:
+            value = value.get(key) if isinstance(value, dict) else None
+        values[name] = float(value) if isinstance(value, (int, float)) else None
+    for name in CATEGORIES + TEXTS:
+        value = data.get(name)
+        # Type is list of one element in preloaded data
+        if isinstance(value, list):
+            value = value[0] if value else None
+        values[name] = None if value is None else str(value)
+    # Failed extraction is recorded with its stage, older preloads mark it by zero area only, see dataprocess.apply_measures
+    values["extraction_failed"] = bool(data.get("extraction_failure")) or not data.get("area")
+    return values
+
+class MeasurementExport():
+    """
+    Streaming writer of seed measurements. Records are buffered up to EXPORT_BATCH and then
+    written as one row group (Parquet), record batch (Arrow IPC) or appended to column files
+    which are packed into npz on close. Memory use does not grow with amount of records.
+    Use as context manager or call close.
+    """
+    def __init__(self, path, batch=EXPORT_BATCH):
+        """
+        Constructor of MeasurementExport class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path of export, format is given by suffix (.parquet, .arrow, .feather or .npz). Parquet
+            and Arrow need pyarrow, without it .npz with the same name is written instead.
+        batch : int, optional
+            Records per written batch. Defaults to EXPORT_BATCH from config.
+        """
+        self.format = export_format(path)
+        self.path = Path(path) if self.format != "npz" else Path(path).with_suffix(".npz")
+        if self.path != Path(path):
+            print(f"pyarrow is not installed, measurements are exported into {self.path.name} instead.")
+        self.batch = batch
+        self.records = 0
+        self.groups = 0
+        self.buffer = self.__empty__()
+        self.writer = None
+        self.spill = None
+        # Dictionaries of categories are shared by all batches, later batches only extend them
+        self.codes = {name: {} for name in CATEGORIES}
+        if self.format == "npz":
+            self.spill = Path(tempfile.mkdtemp(prefix=".export-", dir=self.path.parent))
+            self.offsets = dict.fromkeys(TEXTS, 0)
+
+    def __empty__(self):
+        """
+        Returns empty column buffers.
+        """
+        return {name: [] for name in ["group"] + list(NUMERIC) + CATEGORIES + TEXTS + ["extraction_failed"]}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_group(self, group):
+        """
+        Writes all images of one preloaded group, images of the group share group number.
+
+        Parameters
+        ----------
+        group : list of dicts
+            Preloaded group of processed images
+        """
+        for data in group:
+            self.write(data, self.groups)
+        self.groups += 1
+
+    def write(self, data, group=-1):
+        """
+        Writes one preloaded image.
+
+        Parameters
+        ----------
+        data : dict
+            Processed data of image
+        group : int, optional
+            Number of seed group of the image. Defaults to -1, unknown.
+        """
+        self.buffer["group"].append(group)
+        for name, value in row(data).items():
+            self.buffer[name].append(value)
+        self.records += 1
+        if len(self.buffer["group"]) >= self.batch:
+            self.__flush__()
+
+    def __flush__(self):
+        """
+        Writes buffered records.
+        """
+        if not self.buffer["group"]:
+            return
+        for name in CATEGORIES:
+            codes = self.codes[name]
+            self.buffer[name] = [None if value is None else codes.setdefault(value, len(codes)) for value in self.buffer[name]]
+        if self.format == "npz":
+            self.__spill__()
+        else:
+            self.__write_arrow__()
+        self.buffer = self.__empty__()
+
+    def __write_arrow__(self):
+        """
+        Writes buffered records as one Arrow record batch. Dictionary of batch extends dictionary of
+        previous one, IPC file stores only its new values (dictionary delta).
+        """
+        import pyarrow as pa
+        columns = {"group": pa.array(self.buffer["group"], pa.int32())}
+        for name in NUMERIC:
+            columns[name] = pa.array(self.buffer[name], pa.float64())
+        for name in CATEGORIES:
+            columns[name] = pa.DictionaryArray.from_arrays(pa.array(self.buffer[name], pa.int32()),
+                                                           pa.array(list(self.codes[name]), pa.string()))
+        for name in TEXTS:
+            columns[name] = pa.array(self.buffer[name], pa.string())
+        columns["extraction_failed"] = pa.array(self.buffer["extraction_failed"], pa.bool_())
+        batch = pa.RecordBatch.from_pydict(columns)
+        if self.writer is None:
+            if self.format == "parquet":
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.path, batch.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, batch.schema,
+                                              options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        if self.format == "parquet":
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def __spill__(self):
+        """
+        Appends buffered records to raw column files of npz export. Categories are stored as codes
+        (-1 is missing value), texts as utf-8 data with offsets.
+        """
+        import numpy as np
+        arrays = {"group": np.array(self.buffer["group"], np.int32),
+                  "extraction_failed": np.array(self.buffer["extraction_failed"], np.bool_)}
+        for name in NUMERIC:
+            arrays[name] = np.array([np.nan if value is None else value for value in self.buffer[name]], np.float64)
+        for name in CATEGORIES:
+            arrays[name + ".codes"] = np.array([-1 if code is None else code for code in self.buffer[name]], np.int32)
+        for name in TEXTS:
+            data = [(value or "").encode("utf-8") for value in self.buffer[name]]
+            lengths = np.fromiter((len(value) for value in data), np.int64, len(data))
+            # Offsets of the whole export, first 0 is written once on close
+            arrays[name + ".offsets"] = self.offsets[name] + np.cumsum(lengths)
+            self.offsets[name] = int(arrays[name + ".offsets"][-1])
+            with open(self.spill / (name + ".data"), "ab") as fout:
+                fout.write(b"".join(data))
+        for key, array in arrays.items():
+            with open(self.spill / key, "ab") as fout:
+                fout.write(array.tobytes())
+
+    def close(self):
+        """
+        Writes remaining records and finishes the export file.
+
+        Returns
+        -------
+        pathlib.Path
+            Path of written export
+        """
+        self.__flush__()
+        if self.format == "npz":
+            if self.spill is not None:
+                try:
+                    self.__pack__()
+                finally:
+                    shutil.rmtree(self.spill, ignore_errors=True)
+                    self.spill = None
+        elif self.writer is None:
+            # Export without records still gets its schema
+            self.buffer = self.__empty__()
+            self.__write_arrow__()
+            self.writer.close()
+            self.writer = False
+        elif self.writer:
+            self.writer.close()
+            self.writer = False
+        return self.path
+
+    def __pack__(self):
+        """
+        Packs column files into npz. Arrays are streamed into uncompressed zip, so np.load reads
+        them without decompression.
+        """
+        import numpy as np
+        dtypes = {"group": np.int32, "extraction_failed": np.bool_}
+        dtypes.update(dict.fromkeys(NUMERIC, np.float64))
+        dtypes.update({name + ".codes": np.int32 for name in CATEGORIES})
+        dtypes.update({name + ".offsets": np.int64 for name in TEXTS})
+        dtypes.update({name + ".data": np.uint8 for name in TEXTS})
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED, allowZip64=True) as zout:
+            for key, dtype in dtypes.items():
+                file = self.spill / key
+                size = file.stat().st_size if file.is_file() else 0
+                leading = b""
+                if key.endswith(".offsets"):
+                    leading = np.zeros(1, np.int64).tobytes()
+                header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                          "shape": ((size + len(leading)) // np.dtype(dtype).itemsize,)}
+                with zout.open(key + ".npy", "w", force_zip64=True) as entry:
+                    np.lib.format.write_array_header_2_0(entry, header)
+                    entry.write(leading)
+                    if size:
+                        with open(file, "rb") as fin:
+                            shutil.copyfileobj(fin, entry, 1 << 20)
+            for name in CATEGORIES:
+                with zout.open(name + ".values.npy", "w") as entry:
+                    np.lib.format.write_array(entry, np.array(list(self.codes[name]), dtype=str), allow_pickle=False)
+        tmp.replace(self.path)
+
+def export_groups(groups, path):
+    """
+    Exports preloaded groups into columnar file, see MeasurementExport.
+
+    Parameters
+    ----------
+    groups : iterable of lists of dicts
+        Preloaded groups, e.g. from preloadstore.load_groups
+    path : str or pathlib.Path
+        Path of export
+
+    Returns
+    -------
+    pathlib.Path
+        Path of written export
+    """
+    with MeasurementExport(path) as export:
+        for group in groups:
+            export.write_group(group)
+    return export.path
+
+def load_measurements(path):
+    """
+    Loads exported measurements as numpy arrays. Numeric columns, group and extraction_failed are
+    arrays. Categories are dictionaries {"codes": int32 array, "values": array of strings}, code -1
+    is missing value. Texts are dictionaries {"offsets": int64 array, "data": uint8 array of utf-8},
+    see texts.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to exported .npz, .parquet, .arrow or .feather file
+
+    Returns
+    -------
+    dict
+        Columns of the export
+    """
+    import numpy as np
+    path = Path(path)
+    if export_format(path) == "npz":
+        with np.load(path.with_suffix(".npz"), allow_pickle=False) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+        columns = {name: arrays[name] for name in ["group"] + list(NUMERIC) + ["extraction_failed"]}
+        for name in CATEGORIES:
+            columns[name] = {"codes": arrays[name + ".codes"], "values": arrays[name + ".values"]}
+        for name in TEXTS:
+            columns[name] = {"offsets": arrays[name + ".offsets"], "data": arrays[name + ".data"]}
+        return columns
+    import pyarrow as pa
+    if export_format(path) == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    columns = {}
+    for name in ["group"] + list(NUMERIC) + ["extraction_failed"]:
+        columns[name] = table.column(name).to_numpy()
+    table = table.unify_dictionaries()
+    for name in CATEGORIES:
+        column = table.column(name)
+        if not pa.types.is_dictionary(column.type):
+            column = column.dictionary_encode()
+        column = column.combine_chunks()
+        columns[name] = {"codes": column.indices.fill_null(-1).to_numpy().astype(np.int32),
+                         "values": column.dictionary.to_numpy(zero_copy_only=False).astype(str)}
+    for name in TEXTS:
+        column = table.column(name).cast(pa.large_string()).combine_chunks()
+        buffers = column.buffers()
+        offsets = np.frombuffer(buffers[1], np.int64)[column.offset:column.offset + len(column) + 1]
+        columns[name] = {"offsets": offsets - offsets[0],
+                         "data": np.frombuffer(buffers[2], np.uint8)[offsets[0]:offsets[-1]] if len(column) else
+                         np.zeros(0, np.uint8)}
+    return columns
+
+def texts(column, rows=None):
+    """
+    Decodes text column of loaded measurements.
+
+    Parameters
+    ----------
+    column : dict
+        Text column of load_measurements output
+    rows : iterable of int, optional
+        Rows to decode. Defaults to None, all rows.
+
+    Returns
+    -------
+    list of str
+        Decoded values
+    """
+    offsets, data = column["offsets"], column["data"].tobytes()
+    rows = range(len(offsets) - 1) if rows is None else rows
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in rows]
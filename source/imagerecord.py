@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+imagerecord.py: Compact record of one processed image. Behaves as dictionary of
+the preload json schema, but keeps known keys in slots, repeated strings interned
+and lists and nested dictionaries (scaling, pixeldistance, type) as tuples shared
+between records.
+
+__doc__ using Sphnix Style
+"""
+
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.1.1"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+
+# Import required libs
+import sys
+from collections.abc import MutableMapping
+
+# Keys of preload json schema in the order preload writes them
+FIELDS = ("focusmethod", "texturemethod", "topographymethod", "model", "adapter", "objective", "pixelaccuracy",
+          "pixeldistance", "totalmagnification", "scalingunit", "sdk", "scaling", "vendor", "timestamp", "x_length",
+          "y_length", "area", "bound_seed_ratio", "hex_color", "img_path", "meta_path", "species_name", "type",
+          "extraction_failure", "extraction_params")
+# String values repeated in many records (microscope meta data, species), interned
+CATEGORIES = frozenset(("focusmethod", "texturemethod", "topographymethod", "model", "adapter", "objective",
+                        "scalingunit", "sdk", "vendor", "hex_color", "species_name"))
+_FIELDS = frozenset(FIELDS)
+
+# Shared tuples of list and dictionary values, the same value is stored once for all records. Cache is emptied
+# once it holds SHARED_LIMIT values, so long running service and workers do not keep values of all past runs.
+SHARED_LIMIT = 4096
+_SHARED = {}
+
+class Items(tuple):
+    """
+    Items of dictionary value stored in record, returned as new dictionary.
+    """
+    __slots__ = ()
+
+def pack(key, value):
+    """
+    Returns compact form of value stored under given key.
+    """
+    if isinstance(value, str):
+        return sys.intern(value) if key in CATEGORIES else value
+    if isinstance(value, list):
+        value = tuple(value)
+    elif isinstance(value, dict):
+        value = Items(value.items())
+    else:
+        return value
+    try:
+        key = signature(value), value
+        if len(_SHARED) >= SHARED_LIMIT and key not in _SHARED:
+            _SHARED.clear()
+        return _SHARED.setdefault(key, value)
+    except TypeError:
+        # Unhashable content (nested lists) is kept per record
+        return value
+
+def signature(value):
+    """
+    Returns types of value and of its items. Equal values of other types ((1, 2) and (1.0, 2.0)) are not shared.
+    """
+    if isinstance(value, tuple):
+        return (type(value),) + tuple(signature(item) for item in value)
+    return type(value)
+
+def unpack(value):
+    """
+    Returns value of json schema from its compact form.
+    """
+    if isinstance(value, Items):
+        return dict(value)
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+class ImageRecord(MutableMapping):
+    """
+    Processed data of one image. Mapping with the same keys and values as dictionary of preload
+    json, known keys (FIELDS) are stored in slots, other keys (user, img_buffer) in extra
+    dictionary created on first use. Lists and dictionaries are returned as new objects, change
+    them by assigning the whole value (data['scaling'] = {...}).
+    """
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, data=None):
+        """
+        Constructor of ImageRecord class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        data : dict, optional
+            Processed data of image in preload json schema. Defaults to None, empty record.
+        """
+        self.extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    def __getitem__(self, key):
+        if key in _FIELDS:
+            try:
+                return unpack(getattr(self, key))
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _FIELDS:
+            setattr(self, key, pack(key, value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        if key in _FIELDS:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key in FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from list(self.extra)
+
+    def __len__(self):
+        return sum(1 for key in FIELDS if hasattr(self, key)) + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self):
+        return f"ImageRecord({self.to_dict()!r})"
+
+    def to_dict(self):
+        """
+        Returns record as dictionary of preload json schema.
+        """
+        return {key: self[key] for key in self}
+
+def plain(obj):
+    """
+    Default of json.dump and json.dumps which serializes ImageRecord as dictionary.
+
+    Raises
+    ------
+    TypeError
+        Raises for any other object, as json does.
+    """
+    if isinstance(obj, ImageRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
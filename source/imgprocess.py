@@ -32,7 +32,7 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Ondrej Budik", "Ivo Bukovsky"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.0.6"
+__version__ = "1.3.0"
 __maintainer__ = ["Vojtech Barnat", "Ondrej Budik"]
 __email__ = ["Vojtech.Barnat@fs.cvut.cz", "obudik@prf.jcu.cz"]
 __status__ = "Beta"
@@ -41,12 +41,57 @@ __python__ = "3.8.0"
 
 
 # Import libs for entire script
+import time
 import numpy as np
 import cv2 as cv2
 from scipy.spatial.distance import pdist, squareform
 from imutils import rotate
+from instrumentation import record
 from config import BORDER_SIZE, L_THRESH, H_THRESH, L_AREA, H_AREA, COLOR_SAMPLE_SIZE, THRESHOLD_PAD, KERNEL_SIZE, E_ITERS, D_ITERS, COLOR_CNT_PAD
 
+# Segmentation settings from config which can be overridden per image, see extraction_params
+PARAMS = {"BORDER_SIZE": BORDER_SIZE, "L_AREA": L_AREA, "H_AREA": H_AREA, "COLOR_SAMPLE_SIZE": COLOR_SAMPLE_SIZE,
+          "THRESHOLD_PAD": THRESHOLD_PAD, "KERNEL_SIZE": KERNEL_SIZE, "E_ITERS": E_ITERS, "D_ITERS": D_ITERS,
+          "COLOR_CNT_PAD": COLOR_CNT_PAD}
+
+class FailedExtraction(tuple):
+    """
+    Zero measures (0, 0, 0, "000000") of image whose feature extraction failed. Unpacks as
+    measures of successful extraction, stage ("decode", "segmentation" or "color") and error
+    tell what failed.
+    """
+    def __new__(cls, stage, error):
+        measures = super().__new__(cls, (0, 0, 0, "000000"))
+        measures.stage = stage
+        measures.error = error
+        return measures
+
+def extraction_params(overrides=None):
+    """
+    Returns segmentation settings of config with given overrides.
+
+    Parameters
+    ----------
+    overrides : dict, optional
+        {name of setting in PARAMS: value}, names are case insensitive. Defaults to None.
+
+    Returns
+    -------
+    dict
+        Settings keyed by names of PARAMS
+
+    Raises
+    ------
+    ValueError
+        Raises when override of unknown setting is given.
+    """
+    params = dict(PARAMS)
+    for name, value in (overrides or {}).items():
+        if name.upper() not in params:
+            raise ValueError(f"Unknown extraction setting {name}! Use one of {', '.join(PARAMS)}.")
+        params[name.upper()] = value
+    return params
+
 
 def rotate_point(origin, point, angle):
     """
@@ -152,7 +197,244 @@ def edge_detector_gray(src):
     return edges
 
 
-def preproces_seed_image(img_path, downscale=0.05, autoload=True):
+def load_image(img_path, buffer=None):
+    """
+    Loads image from given path in RGB channel order.
+
+    Parameters
+    ----------
+    img_path : str or pathlib.Path
+        Path to image which should be loaded
+    buffer : bytes, optional
+        Already read content of the image file, decoded instead of reading the file. Defaults to None.
+
+    Returns
+    -------
+    img : uint8 numpy array
+        Loaded RGB image
+    """
+    start = time.perf_counter()
+    if buffer is None:
+        img = cv2.imread(str(img_path))
+    else:
+        img = cv2.imdecode(np.frombuffer(buffer, np.uint8), cv2.IMREAD_COLOR)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    record("decode", time.perf_counter() - start)
+    return img
+
+
+def __channel_crop__(img, segmentation):
+    """
+    Pads, rotates and crops image the same way the segmented image was and downscales it
+    to the size of segmentation mask.
+    """
+    bs = segmentation["border"]
+    img = cv2.copyMakeBorder(img, top=bs, bottom=bs, left=bs, right=bs, borderType=cv2.BORDER_CONSTANT, value=[0,0,0])
+    img = rotate(img, segmentation["angle"], segmentation["origin"])
+    x, y, w, h = segmentation["box"]
+    cropped = img[y:y+h, x:x+w]
+    return cv2.resize(cropped, (0,0), fx=segmentation["downscale"], fy=segmentation["downscale"])
+
+
+def segment_seed_image(img, downscale=0.05, cancel=None, params=None):
+    """
+    Finds contour of seed on image and measures its Feret dimensions and area. Returned
+    segmentation holds everything needed to extract color of the seed from the image or
+    from other channel images of the same capture, see seed_color.
+
+    Parameters
+    ----------
+    img : uint8 numpy array
+        RGB image of seed, see load_image
+    downscale : float, optional
+        Modifier of downscaling for color extraction. Defaults to 0.05.
+    cancel : cancel.CancelToken, optional
+        Token checked between processing stages. Defaults to None.
+    params : dict, optional
+        Overrides of segmentation settings from config, see extraction_params. Defaults to None.
+
+    Returns
+    -------
+    segmentation : dict
+        Measured max_x_dist, max_y_dist and area of seed in pixels, shape of segmented image
+        and border, angle, origin, box, downscale, mask and crop used for color extraction.
+
+    Raises
+    ------
+    IndexError
+        Raises when no contour of seed size has been found.
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
+    """
+    start = time.perf_counter()
+    shape = img.shape[:2]
+    params = extraction_params(params)
+
+    # Convert image to HSV - (hue, saturation, value)
+    img_hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+
+    sample_hsv = [h, s, v] = [ int(np.mean(img_hsv[0:params["COLOR_SAMPLE_SIZE"], 0:params["COLOR_SAMPLE_SIZE"], i])) for i in range(3) ]
+
+    #make border
+    bs = int(params["BORDER_SIZE"] * img.shape[1])
+    img_hsv = cv2.copyMakeBorder(img_hsv, top=bs, bottom=bs, left=bs, right=bs, borderType=cv2.BORDER_CONSTANT, value=sample_hsv)
+
+    #take just H - hue
+    img_h = img_hsv[:,:,0]
+
+    #dynamic thresholding
+    l_thresh = h - params["THRESHOLD_PAD"]
+    h_thresh = h + params["THRESHOLD_PAD"]
+    img_bin = cv2.inRange(img_h, l_thresh, h_thresh)
+
+    img_bin = (255-img_bin)
+
+    kernel = np.ones((params["KERNEL_SIZE"],params["KERNEL_SIZE"]),np.uint8)
+    img_bin = cv2.erode(img_bin, kernel, iterations = params["E_ITERS"])
+    img_bin = cv2.dilate(img_bin, kernel, iterations = params["D_ITERS"])
+    if cancel:
+        cancel.check()
+
+    # #edge detection
+    img_edge = edge_detector_gray(img_bin)
+
+    #find contours
+    contours, hierarchy = cv2.findContours(img_edge, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    #sort contours acording to area
+    cntsSorted = sorted(contours, key=lambda x: cv2.contourArea(x), reverse=True)
+
+    #pick largest
+    large_contours = []
+    for contour in cntsSorted:
+        area = cv2.contourArea(contour)
+        if (area > params["L_AREA"]) & (area < params["H_AREA"]):
+            large_contours.append(contour)
+
+    picked_contour = large_contours[0]
+    area = cv2.contourArea(picked_contour)
+    contour = picked_contour[:,0,:]
+
+    #calculate distances between points in contour
+    dist = pdist(contour)
+    dist = squareform(dist)
+    if cancel:
+        cancel.check()
+    #find furthest apart points
+    max_x_dist, [i_1, i_2] = np.nanmax(dist), np.unravel_index(np.argmax(dist), dist.shape)
+    point1 = contour[i_1]
+    point2 = contour[i_2]
+    #calculate vector and its angle
+    vector = point2 - point1
+    angle = np.arctan(vector[1] / vector[0])
+    angle = angle * 360 / 2 / np.pi
+
+    #rotate contour points acording to found angle
+    #prepare array
+    rotated_contour = np.zeros((picked_contour.shape), dtype=np.int)
+
+    w = img_hsv.shape[1]
+    h = img_hsv.shape[0]
+
+    #origin of rotation = center if img
+    ox, oy = int(w/2), int(h/2)
+
+    #for each point rotate
+    for i, point in enumerate(picked_contour):
+        rotated_contour[i][0] = rotate_point([ox, oy], point[0], -np.radians(angle))
+
+    #rotate furthest apart points
+    rotated_point1 = rotate_point([ox, oy], point1, -np.radians(angle))
+    rotated_point2 = rotate_point([ox, oy], point2, -np.radians(angle))
+
+    #Find the maximum y distance between points in contour
+    max_y_index = np.argmax(rotated_contour[:,0,1])
+    min_y_index = np.argmin(rotated_contour[:,0,1])
+    max_y_dist_point1 = rotated_contour[max_y_index,0,:]
+    max_y_dist_point2 = rotated_contour[min_y_index,0,:]
+    max_y_dist = rotated_contour[max_y_index,0,1] - rotated_contour[min_y_index,0,1]
+    max_y_dist_point2[0] = max_y_dist_point1[0]
+
+    #bounding box from 4 points"
+    p1 = rotated_point1
+    p2 = rotated_point2
+    p3 = max_y_dist_point1
+    p4 = max_y_dist_point2
+
+    #crop box
+    x, y, w, h = cv2.boundingRect(np.array([[p1[0], p3[1]],[p2[0], p4[1]]]))
+
+    approx_contour = cv2.approxPolyDP(rotated_contour, epsilon=10, closed=True)
+
+    segmentation = {"max_x_dist": max_x_dist, "max_y_dist": max_y_dist, "area": area, "shape": shape,
+                    "border": bs, "angle": angle, "origin": [ox, oy], "box": (x, y, w, h), "downscale": downscale}
+
+    #downscale for speed
+    img = __channel_crop__(img, segmentation)
+    approx_contour[:, :, 0] = (approx_contour[:, :, 0] -  x) * downscale
+    approx_contour[:, :, 1] = (approx_contour[:, :,  1] - y) * downscale
+
+    #mask of pixels inside of contour, shared by all channels of the image
+    raw_dist = np.empty((img.shape[0], img.shape[1]), dtype=np.float32)
+    for i in range(img.shape[0]):
+        if cancel:
+            cancel.check()
+        for j in range(img.shape[1]):
+            raw_dist[i,j] = cv2.pointPolygonTest(approx_contour, (j,i), True)
+    segmentation["mask"] = raw_dist > params["COLOR_CNT_PAD"]
+    segmentation["crop"] = img
+
+    record("segmentation", time.perf_counter() - start)
+    return segmentation
+
+
+def seed_color(img, segmentation, cancel=None):
+    """
+    Calculates average color of seed inside of segmented contour. Image can be any channel image
+    of the same size as the segmented one, the contour is reused without new segmentation.
+
+    Parameters
+    ----------
+    img : uint8 numpy array or None
+        RGB image to take color from. None takes color from the segmented image itself.
+    segmentation : dict
+        Output of segment_seed_image
+    cancel : cancel.CancelToken, optional
+        Token checked before color extraction. Defaults to None.
+
+    Returns
+    -------
+    hex_color : str
+        average color of seed in hex format
+
+    Raises
+    ------
+    ValueError
+        Raises when image size differs from the segmented image.
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
+    """
+    if cancel:
+        cancel.check()
+    start = time.perf_counter()
+    if img is None:
+        img = segmentation["crop"]
+    elif img.shape[:2] != segmentation["shape"]:
+        raise ValueError(f"Image size {img.shape[:2]} differs from segmented image size {segmentation['shape']}.")
+    else:
+        img = __channel_crop__(img, segmentation)
+
+    #find average color inside of contour
+    total = np.count_nonzero(segmentation["mask"]) + 1
+    sum_color = img[segmentation["mask"]].astype(np.int64).sum(axis=0)
+    avg_color = [int(sum_color[i] / total) for i in range(3)]
+
+    hex_color = rgb_to_hex(avg_color[0], avg_color[1], avg_color[2])
+    record("color", time.perf_counter() - start)
+    return hex_color
+
+
+def preproces_seed_image(img_path, downscale=0.05, autoload=True, cancel=None, buffer=None, params=None):
     """
     Takes image of seed and finds its contour from which its size and average
     color are determined returns int values of size and area average color of
@@ -164,6 +446,12 @@ def preproces_seed_image(img_path, downscale=0.05, autoload=True):
         Path to image which should be loaded
     downscale : float, optional
         Modifier of downscaling for better performance. Defaults to 0.05.
+    cancel : cancel.CancelToken, optional
+        Token checked between processing stages. Defaults to None.
+    buffer : bytes, optional
+        Already read content of the image file, see load_image. Defaults to None.
+    params : dict, optional
+        Overrides of segmentation settings from config, see extraction_params. Defaults to None.
 
     Returns
     -------
@@ -175,143 +463,89 @@ def preproces_seed_image(img_path, downscale=0.05, autoload=True):
         area of found seed in pixels squared
     hex_color : str
         average color of found seed in hex format
+    If extraction fails, FailedExtraction with zero measures, failed stage and error is returned.
+
+    Raises
+    ------
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
     """
+    stage = "decode"
     try:
         # Load img from given img path
-        if autoload:
-            img = cv2.imread(str(img_path))
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        else:
-            img = img_path
-
-        # Convert image to HSV - (hue, saturation, value)
-        img_hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
-
-        sample_hsv = [h, s, v] = [ int(np.mean(img_hsv[0:COLOR_SAMPLE_SIZE, 0:COLOR_SAMPLE_SIZE, i])) for i in range(3) ]
-
-        #make border
-        bs = int(BORDER_SIZE * img.shape[1])
-        img_hsv = cv2.copyMakeBorder(img_hsv, top=bs, bottom=bs, left=bs, right=bs, borderType=cv2.BORDER_CONSTANT, value=sample_hsv)
-        img = cv2.copyMakeBorder(img, top=bs, bottom=bs, left=bs, right=bs, borderType=cv2.BORDER_CONSTANT, value=[0,0,0])
-
-        #take just H - hue
-        img_h = img_hsv[:,:,0]
-
-        #dynamic thresholding
-        l_thresh = h - THRESHOLD_PAD
-        h_thresh = h + THRESHOLD_PAD
-        img_bin = cv2.inRange(img_h, l_thresh, h_thresh)
-
-        img_bin = (255-img_bin)
-
-        kernel = np.ones((KERNEL_SIZE,KERNEL_SIZE),np.uint8)
-        img_bin = cv2.erode(img_bin, kernel, iterations = E_ITERS)
-        img_bin = cv2.dilate(img_bin, kernel, iterations = D_ITERS)
-
-        # #edge detection
-        img_edge = edge_detector_gray(img_bin)
-
-        #find contours
-        contours, hierarchy = cv2.findContours(img_edge, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        #sort contours acording to area
-        cntsSorted = sorted(contours, key=lambda x: cv2.contourArea(x), reverse=True)
-
-        #pick largest
-        large_contours = []
-        for contour in cntsSorted:
-            area = cv2.contourArea(contour)
-            if (area > L_AREA) & (area < H_AREA):
-                large_contours.append(contour)
-
-        picked_contour = large_contours[0]
-        area = cv2.contourArea(picked_contour)
-        contour = picked_contour[:,0,:]
-
-        #calculate distances between points in contour
-        dist = pdist(contour)
-        dist = squareform(dist)
-        #find furthest apart points
-        max_x_dist, [i_1, i_2] = np.nanmax(dist), np.unravel_index(np.argmax(dist), dist.shape)
-        point1 = contour[i_1]
-        point2 = contour[i_2]
-        #calculate vector and its angle
-        vector = point2 - point1
-        angle = np.arctan(vector[1] / vector[0])
-        angle = angle * 360 / 2 / np.pi
-
-        #rotate contour points acording to found angle
-        #prepare array
-        rotated_contour = np.zeros((picked_contour.shape), dtype=np.int)
-
-        w = img.shape[1]
-        h = img.shape[0]
-
-        #origin of rotation = center if img
-        ox, oy = int(w/2), int(h/2)
-
-        img = rotate(img, angle, [ox, oy])
-
-        #for each point rotate
-        for i, point in enumerate(picked_contour):
-            rotated_contour[i][0] = rotate_point([ox, oy], point[0], -np.radians(angle))
-
-        #rotate furthest apart points
-        rotated_point1 = rotate_point([ox, oy], point1, -np.radians(angle))
-        rotated_point2 = rotate_point([ox, oy], point2, -np.radians(angle))
-
-        #Find the maximum y distance between points in contour
-        max_y_index = np.argmax(rotated_contour[:,0,1])
-        min_y_index = np.argmin(rotated_contour[:,0,1])
-        max_y_dist_point1 = rotated_contour[max_y_index,0,:]
-        max_y_dist_point2 = rotated_contour[min_y_index,0,:]
-        max_y_dist = rotated_contour[max_y_index,0,1] - rotated_contour[min_y_index,0,1]
-        max_y_dist_point2[0] = max_y_dist_point1[0]
-
-        #bounding box from 4 points"
-        p1 = rotated_point1
-        p2 = rotated_point2
-        p3 = max_y_dist_point1
-        p4 = max_y_dist_point2
-
-        #crop
-        x, y, w, h = cv2.boundingRect(np.array([[p1[0], p3[1]],[p2[0], p4[1]]]))
-        cropped = img[y:y+h, x:x+w]
-
-        approx_contour = cv2.approxPolyDP(rotated_contour, epsilon=10, closed=True)
-
-        #downscale for speed
-        img = cv2.resize(cropped, (0,0), fx=downscale, fy=downscale)
-        approx_contour[:, :, 0] = (approx_contour[:, :, 0] -  x) * downscale
-        approx_contour[:, :, 1] = (approx_contour[:, :,  1] - y) * downscale
-
-        #find average color inside of contour
-        raw_dist = np.empty((img.shape[0], img.shape[1]), dtype=np.float32)
-        for i in range(img.shape[0]):
-            for j in range(img.shape[1]):
-                raw_dist[i,j] = cv2.pointPolygonTest(approx_contour, (j,i), True)
-
-        sum_color = [0, 0, 0]
-        avg_color = [0, 0, 0]
-        total = [1, 1, 1]
-        for i in range(img.shape[0]):
-            for j in range(img.shape[1]):
-                for k in range(img.shape[2]):
-                    if raw_dist[i,j] > COLOR_CNT_PAD:
-                        sum_color[k] += img[i,j,k]
-                        total[k] += 1
-
-        for i in range(3):
-            avg_color[i] = int(sum_color[i] / total[i])
-
-        hex_color = rgb_to_hex(avg_color[0], avg_color[1], avg_color[2])
+        img = load_image(img_path, buffer) if autoload else img_path
+        if cancel:
+            cancel.check()
+        stage = "segmentation"
+        segmentation = segment_seed_image(img, downscale, cancel, params)
+        stage = "color"
+        hex_color = seed_color(None, segmentation, cancel)
 
     except Exception as e:
         print("Automatic image feature extraction failed! No data values are provided. Analyze the seed in path: " + str(img_path) +" manually!")
         print(str(e.__class__.__name__) + ": " + str(e))
-        return 0, 0, 0, '#000000'
+        return FailedExtraction(stage, str(e.__class__.__name__) + ": " + str(e))
 
-    return int(max_x_dist), int(max_y_dist), int(area), hex_color
+    return int(segmentation["max_x_dist"]), int(segmentation["max_y_dist"]), int(segmentation["area"]), hex_color
+
+
+def preproces_channel_images(img_paths, reference=0, downscale=0.05, cancel=None, buffers=None):
+    """
+    Takes channel images of one capture (same seed, same meta data) and segments only the
+    reference channel. Its contour and dimensions are reused for all other channels, only the
+    average color is computed for each channel. If reference channel can not be segmented, or
+    other channel differs in size, channels are processed one by one with preproces_seed_image.
+
+    Parameters
+    ----------
+    img_paths : list of str or pathlib.Path
+        Paths to channel images of one capture
+    reference : int, optional
+        Index of reference channel in img_paths. Defaults to 0.
+    downscale : float, optional
+        Modifier of downscaling for better performance. Defaults to 0.05.
+    cancel : cancel.CancelToken, optional
+        Token checked between processing stages. Defaults to None.
+    buffers : list, optional
+        Already read content of image files in img_paths order, None for files which should be
+        read from disk. Defaults to None.
+
+    Returns
+    -------
+    list of tuples
+        (max_x_dist, max_y_dist, area, hex_color) for every image in img_paths order,
+        see preproces_seed_image.
+
+    Raises
+    ------
+    Cancelled
+        Raises when cancel token gets cancelled during processing.
+    """
+    if buffers is None:
+        buffers = [None] * len(img_paths)
+    try:
+        img = load_image(img_paths[reference], buffers[reference])
+        if cancel:
+            cancel.check()
+        segmentation = segment_seed_image(img, downscale, cancel)
+    except Exception as e:
+        print("Segmentation of reference channel " + str(img_paths[reference]) + " failed, channels are processed separately.")
+        print(str(e.__class__.__name__) + ": " + str(e))
+        return [preproces_seed_image(img_path, downscale, cancel=cancel, buffer=buffer)
+                for img_path, buffer in zip(img_paths, buffers)]
+
+    dims = int(segmentation["max_x_dist"]), int(segmentation["max_y_dist"]), int(segmentation["area"])
+    results = []
+    for pos, img_path in enumerate(img_paths):
+        try:
+            hex_color = seed_color(None if pos == reference else load_image(img_path, buffers[pos]), segmentation, cancel)
+        except Exception as e:
+            print("Shared contour can not be used for channel " + str(img_path) + ", channel is processed separately.")
+            print(str(e.__class__.__name__) + ": " + str(e))
+            results.append(preproces_seed_image(img_path, downscale, cancel=cancel, buffer=buffers[pos]))
+            continue
+        results.append(dims + (hex_color,))
+    return results
 
 
 if __name__ == "__main__":
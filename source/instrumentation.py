@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+instrumentation.py: Lightweight instrumentation hooks of processing and upload
+stages (decode, segmentation, color, metadata, finding, upload). Scripts record
+timed events, registered hooks receive them. RollingStats hook aggregates the
+events into rolling-window rates and per-stage time breakdown.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import threading
+import time
+from collections import deque
+
+# Registered hooks, replaced as whole on change so it can be iterated without lock
+HOOKS = ()
+_HOOKS_LOCK = threading.Lock()
+
+def add_hook(hook):
+    """
+    Registers hook which receives every recorded event.
+
+    Parameters
+    ----------
+    hook : method
+        Callable accepting one dictionary with keys stage, seconds, bytes, items and failed.
+    """
+    global HOOKS
+    with _HOOKS_LOCK:
+        if hook not in HOOKS:
+            HOOKS = HOOKS + (hook,)
+
+def remove_hook(hook):
+    """
+    Unregisters previously added hook. Unknown hooks are ignored.
+
+    Parameters
+    ----------
+    hook : method
+        Hook registered by add_hook
+    """
+    global HOOKS
+    with _HOOKS_LOCK:
+        HOOKS = tuple(h for h in HOOKS if h is not hook)
+
+def record(stage, seconds=0.0, nbytes=0, items=0, failed=False):
+    """
+    Records one event of given stage. Does nothing if no hook is registered.
+
+    Parameters
+    ----------
+    stage : str
+        Name of stage, e.g. "decode", "segmentation", "color", "metadata", "finding", "upload"
+        or "image" for finished image.
+    seconds : float, optional
+        Time spent in the stage. Defaults to 0.0.
+    nbytes : int, optional
+        Amount of bytes handled. Defaults to 0.
+    items : int, optional
+        Amount of finished items (images). Defaults to 0.
+    failed : Bool, optional
+        Flag of failed event. Defaults to False.
+    """
+    hooks = HOOKS
+    if not hooks:
+        return
+    event = {"stage": stage, "seconds": seconds, "bytes": nbytes, "items": items, "failed": failed}
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception as e:
+            # Broken dashboard must never stop processing
+            print("Instrumentation hook failed: " + str(e.__class__.__name__) + " " + str(e))
+
+class RollingStats():
+    """
+    Instrumentation hook aggregating recorded events. Rates are computed over rolling window
+    of last seconds, per-stage time breakdown and failures are counted for the whole run.
+    """
+    def __init__(self, window=30.0):
+        """
+        Constructor of RollingStats class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        window : float, optional
+            Length of rolling window of rates in seconds. Defaults to 30.0.
+        """
+        self.window = window
+        self.start = time.perf_counter()
+        # (timestamp, stage, bytes, items) of events inside of the window
+        self.events = deque()
+        self.stages = {}
+        self.images = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        now = time.perf_counter()
+        with self.lock:
+            self.events.append((now, event["stage"], event["bytes"], event["items"]))
+            stage = self.stages.setdefault(event["stage"], {"seconds": 0.0, "count": 0, "bytes": 0})
+            stage["seconds"] += event["seconds"]
+            stage["count"] += 1
+            stage["bytes"] += event["bytes"]
+            self.images += event["items"]
+            self.failures += int(event["failed"])
+            self.__prune__(now)
+
+    def snapshot(self):
+        """
+        Returns current statistics.
+
+        Returns
+        -------
+        dict
+            images_per_s and upload_mb_per_s over the rolling window, total images and failures
+            and per-stage breakdown {stage: {"seconds", "share", "count", "bytes"}} where share is
+            fraction of time spent in all timed stages.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            self.__prune__(now)
+            span = min(self.window, now - self.start)
+            images = sum(items for _, _, _, items in self.events)
+            uploaded = sum(nbytes for _, stage, nbytes, _ in self.events if stage == "upload")
+            timed = {name: dict(stage) for name, stage in self.stages.items() if stage["seconds"] > 0}
+            snapshot = {"images": self.images, "failures": self.failures}
+        total = sum(stage["seconds"] for stage in timed.values())
+        for stage in timed.values():
+            stage["share"] = stage["seconds"] / total
+        snapshot["images_per_s"] = images / span if span > 0 else 0.0
+        snapshot["upload_mb_per_s"] = uploaded / span / 1e6 if span > 0 else 0.0
+        snapshot["stages"] = timed
+        return snapshot
+
+    def __prune__(self, now):
+        """
+        Drops events older than window. Must be called with lock held.
+        """
+        while self.events and now - self.events[0][0] > self.window:
+            self.events.popleft()
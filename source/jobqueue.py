@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""
+jobqueue.py: Persistent queue of preload, upload and all-in-one jobs stored in
+SQLite. Worker processes claim jobs by priority with time limited leases which
+they renew while the job runs. Every finished group is checkpointed, so job of
+crashed or stopped worker is resumed from its last completed group.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.7"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+
+from cancel import CancelToken, Cancelled
+from imagerecord import plain
+from config import JOB_QUEUE, JOB_LEASE, JOB_POLL_INTERVAL, JOB_MAX_ATTEMPTS, MEASUREMENTS_EXPORT
+
+# Job kinds and their required parameters
+KINDS = {"preload": ["path", "origin"], "upload": ["path"], "all-in-one": ["path", "origin"]}
+# Interval in seconds in which running job checks for stop of its worker
+JOB_CANCEL_POLL = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    user TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority DESC, id);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    key TEXT NOT NULL,
+    data TEXT,
+    PRIMARY KEY (job_id, key)
+);
+"""
+
+class JobQueue():
+    """
+    SQLite job queue. Safe to use from more processes at once, every call opens its own
+    short transaction. Job states are queued, running, done, failed and cancelled.
+    """
+    def __init__(self, path=JOB_QUEUE):
+        """
+        Constructor of JobQueue class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path, optional
+            Path to SQLite database, created if it does not exist. Defaults to JOB_QUEUE from config.
+        """
+        self.path = str(path)
+        with self.__connect__() as db:
+            db.executescript(SCHEMA)
+
+    def __connect__(self):
+        """
+        Opens connection in autocommit mode, transactions are started explicitly.
+        """
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        return Connection(db)
+
+    def enqueue(self, kind, params, user, priority=0):
+        """
+        Adds new job to the queue.
+
+        Parameters
+        ----------
+        kind : str
+            One of "preload", "upload", "all-in-one"
+        params : dict
+            Parameters of the job. path (and origin for processing jobs) are required, optional are
+            output and relative for preload, report, server and recompress for upload jobs.
+        user : str
+            User who queued the job, stored with uploaded findings
+        priority : int, optional
+            Jobs with higher priority are claimed first. Defaults to 0.
+
+        Returns
+        -------
+        int
+            ID of the job
+
+        Raises
+        ------
+        ValueError
+            Raises when kind is unknown or required parameter is missing.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind {kind}! Use one of {', '.join(KINDS)}.")
+        missing = [name for name in KINDS[kind] if not params.get(name)]
+        if missing:
+            raise ValueError(f"Job {kind} is missing parameters {', '.join(missing)}.")
+        with self.__connect__() as db:
+            cursor = db.execute("INSERT INTO jobs (kind, params, user, priority, created) VALUES (?, ?, ?, ?, ?)",
+                                (kind, json.dumps(params), user, priority, time.time()))
+            return cursor.lastrowid
+
+    def claim(self, owner, lease=JOB_LEASE):
+        """
+        Claims queued job with the highest priority, or running job whose lease expired (its worker
+        died). Jobs which have been claimed JOB_MAX_ATTEMPTS times are failed instead.
+
+        Parameters
+        ----------
+        owner : str
+            Identification of claiming worker
+        lease : float, optional
+            Seconds for which the job belongs to the worker. Defaults to JOB_LEASE from config.
+
+        Returns
+        -------
+        dict or None
+            Claimed job, see get, or None if there is nothing to do
+        """
+        now = time.time()
+        with self.__connect__() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE jobs SET state = 'failed', finished = ?, error = 'Worker lost too many times', owner = NULL "
+                       "WHERE state = 'running' AND lease_until < ? AND attempts >= ?", (now, now, JOB_MAX_ATTEMPTS))
+            row = db.execute("SELECT id FROM jobs WHERE state = 'queued' OR (state = 'running' AND lease_until < ?) "
+                             "ORDER BY priority DESC, id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute("UPDATE jobs SET state = 'running', owner = ?, lease_until = ?, attempts = attempts + 1, "
+                       "started = COALESCE(started, ?) WHERE id = ?", (owner, now + lease, now, row["id"]))
+            db.execute("COMMIT")
+        return self.get(row["id"])
+
+    def renew(self, job_id, owner, lease=JOB_LEASE):
+        """
+        Extends lease of running job.
+
+        Returns
+        -------
+        Bool
+            False if the job does not belong to owner anymore or its cancellation was requested.
+        """
+        with self.__connect__() as db:
+            cursor = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                                (time.time() + lease, job_id, owner))
+            return cursor.rowcount == 1
+
+    def checkpoint(self, job_id, owner, key, data=None):
+        """
+        Stores finished group of running job. Ignored if the job does not belong to owner anymore.
+
+        Parameters
+        ----------
+        job_id : int
+            ID of the job
+        owner : str
+            Identification of worker
+        key : str
+            Key of finished group, see dataprocess.group_key
+        data : list, optional
+            Processed data of the group kept for the job result (preload). Defaults to None.
+        """
+        with self.__connect__() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("SELECT 1 FROM jobs WHERE id = ? AND owner = ?", (job_id, owner)).fetchone():
+                db.execute("INSERT OR REPLACE INTO checkpoints (job_id, key, data) VALUES (?, ?, ?)",
+                           (job_id, key, None if data is None else json.dumps(data, default=plain)))
+            db.execute("COMMIT")
+
+    def completed(self, job_id):
+        """
+        Returns keys of groups finished by the job so far.
+        """
+        with self.__connect__() as db:
+            return {row["key"] for row in db.execute("SELECT key FROM checkpoints WHERE job_id = ?", (job_id,))}
+
+    def checkpoint_data(self, job_id):
+        """
+        Returns stored data of finished groups in order of their checkpoints.
+        """
+        with self.__connect__() as db:
+            return [json.loads(row["data"]) for row in
+                    db.execute("SELECT data FROM checkpoints WHERE job_id = ? AND data IS NOT NULL ORDER BY rowid", (job_id,))]
+
+    def finish(self, job_id, owner, state, result=None, error=None):
+        """
+        Ends job of owner with one of states done, failed, cancelled or queued (released to be
+        resumed later).
+        """
+        with self.__connect__() as db:
+            db.execute("UPDATE jobs SET state = ?, finished = ?, result = ?, error = ?, owner = NULL, lease_until = NULL "
+                       "WHERE id = ? AND owner = ?",
+                       (state, None if state == "queued" else time.time(), None if result is None else json.dumps(result),
+                        error, job_id, owner))
+
+    def cancel(self, job_id):
+        """
+        Cancels queued job. Running job gets cancelled by its worker on next lease renewal.
+
+        Returns
+        -------
+        Bool
+            False if the job has already ended.
+        """
+        with self.__connect__() as db:
+            cursor = db.execute("UPDATE jobs SET state = 'cancelled', finished = ?, owner = NULL "
+                                "WHERE id = ? AND state IN ('queued', 'running')", (time.time(), job_id))
+            return cursor.rowcount == 1
+
+    def get(self, job_id):
+        """
+        Returns job as dictionary with decoded params and result.
+        """
+        with self.__connect__() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            groups = db.execute("SELECT COUNT(*) FROM checkpoints WHERE job_id = ?", (job_id,)).fetchone()[0]
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["groups_done"] = groups
+        return job
+
+    def jobs(self, states=None):
+        """
+        Returns all jobs, optionally only those in given states, in claim order.
+        """
+        with self.__connect__() as db:
+            ids = [row["id"] for row in db.execute("SELECT id, state FROM jobs ORDER BY priority DESC, id")
+                   if states is None or row["state"] in states]
+        return [self.get(job_id) for job_id in ids]
+
+class Connection():
+    """
+    Closing context manager of sqlite3 connection (sqlite3 connection as context manager
+    only ends transaction).
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *args):
+        self.db.close()
+
+def worker_name():
+    """
+    Returns identification of worker process unique on the network.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def apply_params(params):
+    """
+    Overrides config values by job parameters. Connector reads config on construction.
+    Returns overridden config values, see restore_params.
+    """
+    import config
+    previous = {"SERVER": config.SERVER, "RECOMPRESS": config.RECOMPRESS}
+    if params.get("server"):
+        config.SERVER = params["server"]
+    if params.get("recompress"):
+        config.RECOMPRESS = None if params["recompress"] == "none" else params["recompress"]
+    return previous
+
+def restore_params(previous):
+    """
+    Restores config values returned by apply_params, so the next job of worker starts from config.
+    """
+    import config
+    for name, value in previous.items():
+        setattr(config, name, value)
+
+def run_job(queue, job, owner, cancel, consolecall=False):
+    """
+    Runs one claimed job, skipping groups finished by its previous attempts.
+
+    Parameters
+    ----------
+    queue : JobQueue
+        Queue of the job
+    job : dict
+        Claimed job
+    owner : str
+        Identification of worker
+    cancel : cancel.CancelToken
+        Token which stops the job
+    consolecall : Bool, optional
+        Toggles console prints of processing. Defaults to False.
+
+    Returns
+    -------
+    dict
+        Result of the job, upload summary or amount of preloaded groups
+    """
+    previous = apply_params(job["params"])
+    try:
+        return __run_job__(queue, job, owner, cancel, consolecall)
+    finally:
+        restore_params(previous)
+
+def __run_job__(queue, job, owner, cancel, consolecall):
+    """
+    Runs one claimed job with job parameters applied, see run_job.
+    """
+    params = job["params"]
+    completed = queue.completed(job["id"])
+    def grouphandler(key, group):
+        queue.checkpoint(job["id"], owner, key, group if job["kind"] == "preload" else None)
+    def quiet_upload(msg, file_size, chunk=0, nr_chunks=0):
+        pass
+    if job["kind"] == "preload":
+        import dataprocess as dp
+        dp.preload_data(params["path"], params["origin"], relative=params.get("relative", False), consolecall=consolecall,
+                        cancel=cancel, completed=completed, grouphandler=grouphandler, export=False)
+        cancel.check()
+        # Groups of all attempts make the result, stored the same way as preload_data does
+        output = queue.checkpoint_data(job["id"])
+        output_path = dp.resolve_path(params.get("output", ""))
+        output_path.mkdir(parents=True, exist_ok=True)
+        from preloadstore import save_groups
+        saved = save_groups(output, output_path, base=dp.rcwd)
+        # Export covers groups of all attempts too
+        if MEASUREMENTS_EXPORT:
+            from export import export_groups
+            export_groups(output, output_path / MEASUREMENTS_EXPORT)
+        return {"groups": len(output), "output": saved.as_posix()}
+    if job["kind"] == "upload":
+        import uploader as up
+        summary = up.Connector().commit_all(params["path"], user=job["user"], consolecall=consolecall,
+                                            report_path=params.get("report"), uploaderhandler=quiet_upload,
+                                            cancel=cancel, completed=completed, grouphandler=grouphandler)
+    else:
+        import all_in_one as aio
+        summary = aio.all_in_one(params["path"], params["origin"], user=job["user"], consolecall=consolecall,
+                                 report_path=params.get("report"), uploaderhandler=quiet_upload, cancel=cancel,
+                                 completed=completed, grouphandler=grouphandler)
+    cancel.check()
+    # Upload which stopped on error fails the job instead of finishing it as done
+    if summary.get("aborted"):
+        raise RuntimeError("Upload stopped: " + summary["aborted"])
+    return summary
+
+def work(path=JOB_QUEUE, cancel=None, once=False, consolecall=False):
+    """
+    Worker loop. Claims jobs one by one and runs them, lease is renewed on background thread.
+    Stopped worker returns its job to the queue, it is resumed from last completed group.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to SQLite database. Defaults to JOB_QUEUE from config.
+    cancel : cancel.CancelToken, optional
+        Token which stops the worker. Defaults to None, SIGINT and SIGTERM stop the worker.
+    once : Bool, optional
+        Stops once the queue is empty. Defaults to False.
+    consolecall : Bool, optional
+        Toggles console prints. Defaults to False.
+    """
+    if cancel is None:
+        cancel = CancelToken()
+        signal.signal(signal.SIGINT, lambda signum, frame: cancel.cancel())
+        signal.signal(signal.SIGTERM, lambda signum, frame: cancel.cancel())
+    queue = JobQueue(path)
+    owner = worker_name()
+    while not cancel.cancelled:
+        job = queue.claim(owner)
+        if job is None:
+            if once:
+                break
+            cancel.wait(JOB_POLL_INTERVAL)
+            continue
+        if consolecall:
+            print(f"Worker {owner} runs job {job['id']} ({job['kind']} of {job['params']['path']} by {job['user']}).")
+        # Job token is cancelled by worker stop or by cancellation of the job in queue
+        job_cancel = CancelToken()
+        stop = threading.Event()
+        def heartbeat():
+            while not stop.wait(JOB_LEASE / 3):
+                if cancel.cancelled or not queue.renew(job["id"], owner):
+                    job_cancel.cancel()
+            if cancel.cancelled:
+                job_cancel.cancel()
+        def watch_worker():
+            # Ends with the job, long running worker does not keep one waiting thread per job
+            while not stop.is_set():
+                if cancel.wait(JOB_CANCEL_POLL):
+                    job_cancel.cancel()
+                    return
+        threading.Thread(target=heartbeat, daemon=True).start()
+        threading.Thread(target=watch_worker, daemon=True).start()
+        try:
+            result = run_job(queue, job, owner, job_cancel, consolecall)
+            queue.finish(job["id"], owner, "done", result=result)
+        except Cancelled:
+            # Worker stop releases the job, cancelled job in queue stays cancelled
+            queue.finish(job["id"], owner, "queued" if cancel.cancelled else "cancelled")
+        except Exception as e:
+            queue.finish(job["id"], owner, "failed", error=str(e.__class__.__name__) + " " + str(e))
+            print(f"Job {job['id']} failed: " + str(e.__class__.__name__) + " " + str(e))
+        finally:
+            stop.set()
+
+def start_workers(path=JOB_QUEUE, workers=2, once=False, consolecall=False):
+    """
+    Starts pool of worker processes and waits for them. SIGINT and SIGTERM stop all workers,
+    their jobs are returned to the queue.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to SQLite database. Defaults to JOB_QUEUE from config.
+    workers : int, optional
+        Number of worker processes. Defaults to 2.
+    once : Bool, optional
+        Workers stop once the queue is empty. Defaults to False.
+    consolecall : Bool, optional
+        Toggles console prints. Defaults to False.
+    """
+    import multiprocessing
+    JobQueue(path)
+    processes = [multiprocessing.Process(target=work, args=(str(path),), kwargs={"once": once, "consolecall": consolecall})
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    # Workers handle the signals themselves, parent only waits for them
+    signal.signal(signal.SIGINT, lambda signum, frame: None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: [process.terminate() for process in processes])
+    for process in processes:
+        process.join()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+ledger.py: Ledger of findings created by upload runs. Every run writes its own
+json lines file with created findings and marks them complete once all their
+files are uploaded. The file stays locked while the run is alive, ledger of
+finished or crashed run can be reconciled: findings which never received all
+their files are deleted from the database.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.1"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+def __try_lock__(handle):
+    """
+    Takes exclusive lock of open file without waiting. Returns False if other process holds it.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def __unlock__(handle):
+    """
+    Releases lock taken by __try_lock__.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+
+class FindingLedger():
+    """
+    Ledger of one upload run. File is created with the first finding and removed on close if
+    every finding got its files or was deleted.
+    """
+    def __init__(self, folder):
+        """
+        Constructor of FindingLedger class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        folder : str or pathlib.Path
+            Folder of ledgers, created if it does not exist
+        """
+        self.folder = Path(folder)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = self.folder / f"{socket.gethostname()}-{os.getpid()}-{stamp}-{id(self):x}.jsonl"
+        self.handle = None
+        # {finding id: entry} of findings without all files
+        self.open = {}
+        self.lock = threading.Lock()
+
+    def created(self, finding_id, key, workspace):
+        """
+        Records created finding of group with given key (see dataprocess.group_key).
+        """
+        with self.lock:
+            self.open[finding_id] = {"finding": finding_id, "group": key, "workspace": workspace}
+            self.__write__(dict(self.open[finding_id], state="created"))
+
+    def completed(self, finding_id):
+        """
+        Records finding whose files have all been uploaded.
+        """
+        with self.lock:
+            if self.open.pop(finding_id, None) is not None:
+                self.__write__({"finding": finding_id, "state": "complete"})
+
+    def deleted(self, finding_id):
+        """
+        Records finding removed from database.
+        """
+        with self.lock:
+            if self.open.pop(finding_id, None) is not None:
+                self.__write__({"finding": finding_id, "state": "deleted"})
+
+    def pending(self):
+        """
+        Returns {finding id: entry} of findings without all their files.
+        """
+        with self.lock:
+            return {finding_id: dict(entry) for finding_id, entry in self.open.items()}
+
+    def close(self):
+        """
+        Releases the ledger. File of ledger without pending findings is removed, the rest is
+        left for reconcile.
+        """
+        with self.lock:
+            if self.handle is None:
+                return
+            if not self.open:
+                self.handle.close()
+                self.path.unlink(missing_ok=True)
+            else:
+                __unlock__(self.handle)
+                self.handle.close()
+            self.handle = None
+
+    def __write__(self, entry):
+        """
+        Appends entry to ledger file and flushes it, so it survives crash of the run. Has to be called with lock.
+        """
+        if self.handle is None:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            self.handle = open(self.path, "a+")
+            __try_lock__(self.handle)
+            self.handle.seek(0, os.SEEK_END)
+        entry["time"] = time.time()
+        self.handle.write(json.dumps(entry) + "\n")
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+def read_ledger(path):
+    """
+    Returns pending findings of ledger file, {finding id: entry}. Torn last line of crashed run is ignored.
+    """
+    with open(path, "r") as fin:
+        return __pending__(fin)
+
+def __pending__(handle):
+    """
+    Returns pending findings of ledger read from open file, see read_ledger.
+    """
+    pending = {}
+    handle.seek(0)
+    for line in handle:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if entry.get("state") == "created":
+            pending[entry["finding"]] = entry
+        else:
+            pending.pop(entry.get("finding"), None)
+    return pending
+
+def reconcile(folder, deletehandler, dry_run=False, consolecall=False):
+    """
+    Deletes findings left without files by finished or crashed runs. Ledgers of running
+    uploads (locked files) are skipped, ledger is removed once all its findings are resolved.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        Folder of ledgers
+    deletehandler : method
+        Called as deletehandler(workspace, finding id), returns True if the finding was deleted
+        or does not exist anymore.
+    dry_run : Bool, optional
+        Only lists pending findings. Defaults to False.
+    consolecall : Bool, optional
+        Toggles console prints of deleted findings. Defaults to False.
+
+    Returns
+    -------
+    dict
+        Counts of pending, deleted and failed findings and skipped ledgers of running uploads
+    """
+    report = {"pending": 0, "deleted": 0, "failed": 0, "running": 0}
+    folder = Path(folder)
+    if not folder.is_dir():
+        return report
+    for path in sorted(folder.glob("*.jsonl")):
+        with open(path, "r+") as handle:
+            if not __try_lock__(handle):
+                report["running"] += 1
+                continue
+            # Windows lock blocks reads of other handles, entries are read through the locked one
+            pending = __pending__(handle)
+            report["pending"] += len(pending)
+            if dry_run:
+                if consolecall:
+                    for finding_id, entry in pending.items():
+                        print(f"Finding {finding_id} of {entry['group']} has not all files.")
+                __unlock__(handle)
+                continue
+            failed = 0
+            for finding_id, entry in pending.items():
+                if deletehandler(entry["workspace"], finding_id):
+                    report["deleted"] += 1
+                    handle.seek(0, os.SEEK_END)
+                    handle.write(json.dumps({"finding": finding_id, "state": "deleted", "time": time.time()}) + "\n")
+                    handle.flush()
+                    if consolecall:
+                        print(f"Deleted finding {finding_id} of {entry['group']} without all files.")
+                else:
+                    failed += 1
+            report["failed"] += failed
+            __unlock__(handle)
+        if not failed:
+            path.unlink(missing_ok=True)
+    return report
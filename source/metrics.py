@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py: Structured upload metrics for the Connector. Collects per-file
+transfer statistics, per-chunk latency histogram, retries and finding creation
+latency. Metrics are pushed to optional callback and can be stored as machine
+readable run report (json or csv).
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.1.1"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import csv
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Upper bounds of chunk latency histogram buckets in seconds. Last bucket catches everything slower.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Columns of csv run report, one row per uploaded file
+CSV_FIELDS = ["path", "finding_id", "bytes", "duration", "mb_per_s", "chunks", "retries", "sha256", "part_sha256", "chunk_checksum",
+              "error"]
+
+class UploadMetrics():
+    """
+    Collector of upload metrics for one run of the Connector. Every recorded event is forwarded
+    to metricshandler (if provided) as metricshandler(event, payload), where event is one of
+    "chunk", "file", "finding" or "run" and payload is dictionary describing the event.
+    """
+    def __init__(self, metricshandler=None):
+        """
+        Constructor of UploadMetrics class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        metricshandler : method, optional
+            Callback which receives every recorded event. Defaults to None.
+        """
+        self.metricshandler = metricshandler
+        self.started = datetime.now()
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.files = []
+        self.findings = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        # Additional named reports of upload stages (e.g. recompression) included in summary
+        self.sections = {}
+        # Uploads may run on more threads, keep the records consistent
+        self.lock = threading.Lock()
+
+    def start_file(self, path, file_size, finding_id=None, chunk_checksum=None):
+        """
+        Registers new file upload and returns its record which is later passed to chunk and end_file.
+
+        Parameters
+        ----------
+        path : str
+            Path to uploaded file
+        file_size : int
+            Size of uploaded file in bytes
+        finding_id : str, optional
+            ID of finding the file is attached to. Defaults to None.
+        chunk_checksum : str, optional
+            Algorithm of checksums sent with chunks, None if not sent. Defaults to None.
+
+        Returns
+        -------
+        dict
+            Record of file upload
+        """
+        record = {
+            "path": str(path),
+            "finding_id": finding_id,
+            "bytes": file_size,
+            "duration": 0.0,
+            "mb_per_s": 0.0,
+            "chunks": 0,
+            "retries": 0,
+            "sha256": None,
+            "part_sha256": None,
+            "chunk_checksum": chunk_checksum,
+            "error": None,
+            "start": time.perf_counter()
+        }
+        with self.lock:
+            self.files.append(record)
+        return record
+
+    def chunk(self, record, nbytes, seconds, retries=0):
+        """
+        Records one uploaded chunk of given file.
+
+        Parameters
+        ----------
+        record : dict
+            Record of file obtained from start_file
+        nbytes : int
+            Amount of bytes uploaded with this chunk
+        seconds : float
+            Latency of chunk request including retries
+        retries : int, optional
+            Number of retries needed for this chunk. Defaults to 0.
+        """
+        with self.lock:
+            record["chunks"] += 1
+            record["retries"] += retries
+            self.histogram[self.__bucket__(seconds)] += 1
+        self.__notify__("chunk", {"path": record["path"], "bytes": nbytes, "latency": seconds, "retries": retries})
+
+    def end_file(self, record, error=None, digest=None, part_digests=None):
+        """
+        Closes record of file upload and calculates its throughput.
+
+        Parameters
+        ----------
+        record : dict
+            Record of file obtained from start_file
+        error : Exception, optional
+            Exception which interrupted the upload. Defaults to None.
+        digest : str, optional
+            SHA-256 hex digest of uploaded file. Defaults to None.
+        part_digests : list, optional
+            (start, end, SHA-256 hex digest) of byte ranges of file uploaded in parallel parts, whose
+            whole file digest is not computed. Stored as "start-end:digest" separated by ";". Defaults to None.
+        """
+        with self.lock:
+            record["sha256"] = digest
+            if part_digests:
+                record["part_sha256"] = ";".join(f"{start}-{end}:{part}" for start, end, part in part_digests)
+            record["duration"] = time.perf_counter() - record.pop("start")
+            if record["duration"] > 0:
+                record["mb_per_s"] = record["bytes"] / record["duration"] / 1e6
+            if error is not None:
+                record["error"] = str(error.__class__.__name__) + " " + str(error)
+        self.__notify__("file", dict(record))
+
+    def finding(self, seconds, finding_id=None, error=None):
+        """
+        Records creation of one finding (api_findings_post round-trip).
+
+        Parameters
+        ----------
+        seconds : float
+            Latency of finding creation
+        finding_id : str, optional
+            ID of created finding. Defaults to None.
+        error : Exception, optional
+            Exception raised during creation. Defaults to None.
+        """
+        record = {
+            "finding_id": finding_id,
+            "latency": seconds,
+            "error": None if error is None else str(error.__class__.__name__) + " " + str(error)
+        }
+        with self.lock:
+            self.findings.append(record)
+        self.__notify__("finding", dict(record))
+
+    def section(self, name, report):
+        """
+        Adds named report of additional upload stage which is included in run summary.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage, used as key in summary
+        report : dict
+            Report of the stage
+        """
+        with self.lock:
+            self.sections[name] = report
+
+    def finish(self):
+        """
+        Marks end of the run and pushes summary to metricshandler.
+
+        Returns
+        -------
+        dict
+            Summary of the run, see summary method.
+        """
+        self.end_time = time.perf_counter()
+        summary = self.summary()
+        self.__notify__("run", summary)
+        return summary
+
+    def summary(self):
+        """
+        Aggregates collected metrics of the run.
+
+        Returns
+        -------
+        dict
+            Aggregated metrics. Contains amount of files, bytes, duration, aggregate MB/s, retries,
+            chunk latency histogram and finding creation latency.
+        """
+        with self.lock:
+            end = self.end_time if self.end_time is not None else time.perf_counter()
+            duration = end - self.start_time
+            files = [f for f in self.files if "start" not in f]
+            total_bytes = sum(f["bytes"] for f in files if f["error"] is None)
+            transfer_time = sum(f["duration"] for f in files)
+            finding_latency = [f["latency"] for f in self.findings]
+            histogram = {}
+            for pos, bound in enumerate(LATENCY_BUCKETS):
+                histogram[f"<={bound}s"] = self.histogram[pos]
+            histogram[f">{LATENCY_BUCKETS[-1]}s"] = self.histogram[-1]
+
+            summary = {
+                "started": self.started.isoformat(),
+                "duration": duration,
+                "files": len(files),
+                "failed_files": sum(1 for f in files if f["error"] is not None),
+                "bytes": total_bytes,
+                "mb_per_s": total_bytes / duration / 1e6 if duration > 0 else 0.0,
+                "transfer_mb_per_s": total_bytes / transfer_time / 1e6 if transfer_time > 0 else 0.0,
+                "chunks": sum(f["chunks"] for f in files),
+                "retries": sum(f["retries"] for f in files),
+                "chunk_latency_histogram": histogram,
+                "findings": len(self.findings),
+                "failed_findings": sum(1 for f in self.findings if f["error"] is not None),
+                "finding_latency_mean": sum(finding_latency) / len(finding_latency) if finding_latency else 0.0,
+                "finding_latency_max": max(finding_latency) if finding_latency else 0.0
+            }
+            summary.update(self.sections)
+        return summary
+
+    def save_report(self, path):
+        """
+        Saves run report to given path. Format is selected by file suffix, .csv stores one row
+        per uploaded file, anything else is stored as json with summary, files and findings.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to report file.
+        """
+        path = Path(path)
+        if path.suffix.lower() == ".csv":
+            with self.lock:
+                rows = [dict(f) for f in self.files if "start" not in f]
+            with open(path, "w", newline="") as fout:
+                writer = csv.DictWriter(fout, fieldnames=CSV_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            report = {"summary": self.summary()}
+            with self.lock:
+                report["files"] = [dict(f) for f in self.files if "start" not in f]
+                report["findings"] = [dict(f) for f in self.findings]
+            with open(path, "w") as fout:
+                json.dump(report, fout, indent=2)
+
+    def __bucket__(self, seconds):
+        """
+        Returns index of histogram bucket for given latency.
+        """
+        for pos, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                return pos
+        return len(LATENCY_BUCKETS)
+
+    def __notify__(self, event, payload):
+        """
+        Forwards event to metricshandler if one is registered.
+        """
+        if self.metricshandler:
+            self.metricshandler(event, payload)
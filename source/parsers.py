@@ -31,13 +31,14 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.0.4"
+__version__ = "1.1.0"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
 
 __python__ = "3.8.0"
 
+import io
 import struct
 from pathlib import Path
 import exifread as exr
@@ -117,7 +118,7 @@ def __zeiss_axiocam305c_parser__(meta_dict):
         parsed_meta["vendor"] = "Carl Zeiss"
     return parsed_meta
 
-def __keyence_parser__(path_to_tif):
+def __keyence_parser__(path_to_tif, buffer=None):
     """
     Processing of KEYENCE microscope meta data. Keyence does not use XML!
     They rather code the data inside of the tif file itself as binary.
@@ -127,10 +128,14 @@ def __keyence_parser__(path_to_tif):
     If this version does not match, parser will return nulled except the version,
     as the data would most likely be corrupted anyway.
 
+    File is read once, all tags are parsed from the same buffer.
+
     Parameters
     ----------
     path_to_tif : path or str
         Path to file which should be processed
+    buffer : bytes, optional
+        Content of the file if it has already been read. Defaults to None, which reads the file.
 
     Returns
     -------
@@ -141,17 +146,16 @@ def __keyence_parser__(path_to_tif):
     parsed_meta = __empty_dict__()
 
     try:
-        # Open file and get makernotes
-        tif_file = Path(path_to_tif).resolve()
+        # Read file once, image decode can share the same buffer
+        if buffer is None:
+            buffer = Path(path_to_tif).resolve().read_bytes()
+        tif_file = memoryview(buffer)
 
         # Get makernote position in file
-        with open(tif_file, "rb") as file:
-            makernote_offset = exr.process_file(file, details=True)['EXIF MakerNote'].field_offset
+        makernote_offset = exr.process_file(io.BytesIO(buffer), details=True)['EXIF MakerNote'].field_offset
 
-        # Read makernote on given offset
-        with open(tif_file, "rb") as file:
-            file.seek(makernote_offset)
-            maker_notes_data = file.read()
+        # Makernote on given offset
+        maker_notes_data = tif_file[makernote_offset:]
 
         # Compose KmsFile from 0:7 byte, if no KmsFile is present, probly no keyence data.
         kmsfile = ""
@@ -346,8 +350,8 @@ def __lens_tag_parser__(file, offset, number_of_elements):
 
     Parameters
     ----------
-    file : path, str
-        path to file from which should the data be retrieved
+    file : bytes or memoryview
+        content of file from which should the data be retrieved
     offset : hexstr
         offset where data are stored in given file
     number_of_elements : int
@@ -362,9 +366,8 @@ def __lens_tag_parser__(file, offset, number_of_elements):
     # Prepare holder
     lens = {}
     # Load data
-    with open(file, "rb") as file:
-        file.seek(int(f"0x{offset}", 16))
-        offset_data = file.read()[:number_of_elements]
+    offset = int(f"0x{offset}", 16)
+    offset_data = file[offset:offset + number_of_elements]
     # Parse offset data
     lens["crc32"] = swapEndianness(offset_data[0:4].hex())
     lens["vartype"] = int(swapEndianness(offset_data[4:6].hex()), 16)
@@ -382,8 +385,8 @@ def __lens_calibration_parser__(file, offset, number_of_elements):
 
     Parameters
     ----------
-    file : path, str
-        path to file from which should the data be retrieved
+    file : bytes or memoryview
+        content of file from which should the data be retrieved
     offset : hexstr
         offset where data are stored in given file
     number_of_elements : int
@@ -398,9 +401,8 @@ def __lens_calibration_parser__(file, offset, number_of_elements):
     # Prepare holder
     cali = {}
     # Load data
-    with open(file, "rb") as file:
-        file.seek(int(f"0x{offset}", 16))
-        offset_data = file.read()[:number_of_elements]
+    offset = int(f"0x{offset}", 16)
+    offset_data = file[offset:offset + number_of_elements]
     # Parse offset data
     cali["crc32"] = swapEndianness(offset_data[0:4].hex())
     cali["vartype"] = int(swapEndianness(offset_data[4:6].hex()), 16)
@@ -414,8 +416,8 @@ def __lens_calib_adj_parser__(file, offset, number_of_elements):
 
     Parameters
     ----------
-    file : path, str
-        path to file from which should the data be retrieved
+    file : bytes or memoryview
+        content of file from which should the data be retrieved
     offset : hexstr
         offset where data are stored in given file
     number_of_elements : int
@@ -430,9 +432,8 @@ def __lens_calib_adj_parser__(file, offset, number_of_elements):
     # Prepare holder
     magni = {}
     # Load data
-    with open(file, "rb") as file:
-        file.seek(int(f"0x{offset}", 16))
-        offset_data = file.read()[:number_of_elements]
+    offset = int(f"0x{offset}", 16)
+    offset_data = file[offset:offset + number_of_elements]
     # Parse offset data
     magni["crc32"] = swapEndianness(offset_data[0:4].hex())
     magni["vartype"] = int(swapEndianness(offset_data[4:6].hex()), 16)
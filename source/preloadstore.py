@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+preloadstore.py: SQLite store of preloaded data, alternative of preload_data.json
+for large campaigns. Images are stored with indexed species, type, vendor, upload
+status, extraction failure and file fingerprint, so selected images can be found
+and uploaded without loading the whole campaign.
+
+__doc__ using Sphnix Style
+"""
+
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.1.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+
+# Import required libs
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from config import PRELOAD_FORMAT
+from dedup import sampled_hash
+from imagerecord import ImageRecord, plain
+from jobqueue import Connection
+
+# Suffixes of preload store files, anything else is read as json
+STORE_SUFFIXES = (".sqlite", ".db")
+# Upload states of stored images
+STATES = ("pending", "uploaded", "failed")
+# Filters of stored images and their columns
+FILTERS = {"species": "species_name", "type": "type", "vendor": "vendor", "status": "status",
+           "failed": "extraction_failed", "fingerprint": "fingerprint"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL REFERENCES groups(id),
+    img_path TEXT NOT NULL UNIQUE,
+    species_name TEXT COLLATE NOCASE,
+    type TEXT COLLATE NOCASE,
+    vendor TEXT COLLATE NOCASE,
+    extraction_failed INTEGER NOT NULL DEFAULT 0,
+    fingerprint TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    finding_id TEXT,
+    sha256 TEXT,
+    error TEXT,
+    updated REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_group ON images (group_id, id);
+CREATE INDEX IF NOT EXISTS images_species ON images (species_name, type);
+CREATE INDEX IF NOT EXISTS images_type ON images (type);
+CREATE INDEX IF NOT EXISTS images_vendor ON images (vendor);
+CREATE INDEX IF NOT EXISTS images_status ON images (status);
+CREATE INDEX IF NOT EXISTS images_failed ON images (extraction_failed);
+CREATE INDEX IF NOT EXISTS images_fingerprint ON images (fingerprint);
+"""
+
+def is_store(path):
+    """
+    Returns True if given path is preload store, False for json.
+    """
+    return Path(path).suffix.lower() in STORE_SUFFIXES
+
+def indexed(data):
+    """
+    Returns indexed values of one preloaded image (without fingerprint).
+
+    Parameters
+    ----------
+    data : dict
+        Processed data of one image
+
+    Returns
+    -------
+    dict
+        Species, type, vendor and extraction failure keyed by filter names
+    """
+    kind = data.get("type")
+    return {"species": data.get("species_name"),
+            "type": kind[0] if isinstance(kind, list) and kind else kind,
+            "vendor": data.get("vendor"),
+            # Failed extraction is recorded with its stage, older preloads mark it by zero area only, see dataprocess.apply_measures
+            "failed": bool(data.get("extraction_failure")) or not data.get("area")}
+
+class PreloadStore():
+    """
+    SQLite store of preloaded groups. Every image is one row with its processed data stored as
+    json and filtered values in indexed columns. Group order of preload is kept.
+    """
+    def __init__(self, path):
+        """
+        Constructor of PreloadStore class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to SQLite database, created if it does not exist.
+        """
+        self.path = str(path)
+        with self.__connect__() as db:
+            db.executescript(SCHEMA)
+
+    def __connect__(self):
+        """
+        Opens connection in autocommit mode, transactions are started explicitly.
+        """
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        return Connection(db)
+
+    def add_groups(self, groups, base=None):
+        """
+        Adds preloaded groups in one transaction. Image which is already stored gets new data,
+        its upload status is kept while its fingerprint stays the same.
+
+        Parameters
+        ----------
+        groups : list of lists of dicts
+            Preloaded groups as returned by dataprocess.preload_data
+        base : str or pathlib.Path, optional
+            Folder relative image paths are resolved against for fingerprints. Defaults to None,
+            folder of the store.
+
+        Returns
+        -------
+        int
+            Amount of stored images
+        """
+        base = Path(base) if base else Path(self.path).parent
+        rows = []
+        for group in groups:
+            if not group:
+                continue
+            key = Path(group[0]["img_path"]).as_posix()
+            for data in group:
+                values = indexed(data)
+                rows.append((key, Path(data["img_path"]).as_posix(), values["species"], values["type"], values["vendor"],
+                             int(values["failed"]), fingerprint(base / data["img_path"]), json.dumps(data, default=plain)))
+        with self.__connect__() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany("INSERT OR IGNORE INTO groups (key) VALUES (?)", {(row[0],) for row in rows})
+                db.executemany("""
+                    INSERT INTO images (group_id, img_path, species_name, type, vendor, extraction_failed, fingerprint, data)
+                    VALUES ((SELECT id FROM groups WHERE key = ?), ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (img_path) DO UPDATE SET
+                        group_id = excluded.group_id, species_name = excluded.species_name, type = excluded.type,
+                        vendor = excluded.vendor, extraction_failed = excluded.extraction_failed, data = excluded.data,
+                        status = CASE WHEN fingerprint IS excluded.fingerprint THEN status ELSE 'pending' END,
+                        fingerprint = excluded.fingerprint""", rows)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def update(self, images):
+        """
+        Replaces processed data of stored images in one transaction, e.g. after retried feature
+        extraction. Upload status of the images is kept.
+
+        Parameters
+        ----------
+        images : list of dicts
+            Processed data of images with image paths as stored by preload
+
+        Returns
+        -------
+        int
+            Amount of given images
+        """
+        rows = [(int(indexed(data)["failed"]), json.dumps(data, default=plain), Path(data["img_path"]).as_posix())
+                for data in images]
+        with self.__connect__() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany("UPDATE images SET extraction_failed = ?, data = ? WHERE img_path = ?", rows)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def groups(self, **filters):
+        """
+        Returns stored groups in preload order. Filtered groups contain only matching images,
+        groups without any are left out.
+
+        Parameters
+        ----------
+        **filters
+            Values of species, type, vendor, status (one of STATES), failed (bool) or fingerprint.
+            None or missing filter matches everything.
+
+        Returns
+        -------
+        list of lists of imagerecord.ImageRecord
+            Groups of processed data as stored by preload
+        """
+        groups = []
+        last = None
+        for row in self.__select__("group_id, data", filters, "group_id, id"):
+            if row["group_id"] != last:
+                groups.append([])
+                last = row["group_id"]
+            groups[-1].append(json.loads(row["data"], object_hook=record))
+        return groups
+
+    def images(self, **filters):
+        """
+        Returns indexed columns and upload state of stored images, see groups for filters.
+
+        Returns
+        -------
+        list of dicts
+            Image path, species, type, vendor, extraction failure, fingerprint, status, finding ID,
+            SHA-256 digest and error of upload of every matching image
+        """
+        return [dict(row) for row in self.__select__(
+            "img_path, species_name, type, vendor, extraction_failed, fingerprint, status, finding_id, sha256, error",
+            filters, "group_id, id")]
+
+    def counts(self, **filters):
+        """
+        Returns amount of matching images in each upload status, see groups for filters.
+        """
+        counts = dict.fromkeys(STATES, 0)
+        for row in self.__select__("status, COUNT(*) AS images", filters, group="status"):
+            counts[row["status"]] = row["images"]
+        return counts
+
+    def mark(self, img_path, status, finding_id=None, sha256=None, error=None):
+        """
+        Sets upload status of stored image.
+
+        Parameters
+        ----------
+        img_path : str
+            Image path as stored by preload
+        status : str
+            One of STATES
+        finding_id : str, optional
+            ID of finding the image is attached to. Defaults to None.
+        sha256 : str, optional
+            Digest of uploaded image. Defaults to None.
+        error : str, optional
+            Error of failed upload. Defaults to None.
+        """
+        if status not in STATES:
+            raise ValueError(f"Unknown status {status}! Use one of {', '.join(STATES)}.")
+        with self.__connect__() as db:
+            db.execute("UPDATE images SET status = ?, finding_id = ?, sha256 = ?, error = ?, updated = ? WHERE img_path = ?",
+                       (status, finding_id, sha256, error, time.time(), Path(img_path).as_posix()))
+
+    def __select__(self, columns, filters, order=None, group=None):
+        """
+        Runs select of images matching filters, see groups.
+        """
+        where, params = [], []
+        for name, value in filters.items():
+            if name not in FILTERS:
+                raise ValueError(f"Unknown filter {name}! Use one of {', '.join(FILTERS)}.")
+            if value is not None:
+                where.append(f"{FILTERS[name]} = ?")
+                params.append(int(value) if name == "failed" else value)
+        sql = f"SELECT {columns} FROM images" + (" WHERE " + " AND ".join(where) if where else "")
+        sql += (f" GROUP BY {group}" if group else "") + (f" ORDER BY {order}" if order else "")
+        with self.__connect__() as db:
+            return db.execute(sql, params).fetchall()
+
+def record(data):
+    """
+    Object hook of json.loads which loads preloaded images as compact ImageRecord.
+    """
+    return ImageRecord(data) if "img_path" in data else data
+
+def fingerprint(path):
+    """
+    Returns sampled hash of file (see dedup.sampled_hash), None if file can not be read.
+    """
+    try:
+        return sampled_hash(path, os.stat(path).st_size)
+    except OSError:
+        return None
+
+def matches(data, filters):
+    """
+    Returns True if preloaded image from json matches filters of PreloadStore.groups. Images in
+    json are pending and have no fingerprint.
+    """
+    values = dict(indexed(data), status="pending", fingerprint=None)
+    for name, value in filters.items():
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter {name}! Use one of {', '.join(FILTERS)}.")
+        if value is None:
+            continue
+        if name in ("species", "type", "vendor"):
+            if str(values[name]).lower() != str(value).lower():
+                return False
+        elif values[name] != value:
+            return False
+    return True
+
+def save_groups(groups, folder, store=None, base=None):
+    """
+    Saves preloaded groups into folder as preload_data.json or preload_data.sqlite.
+
+    Parameters
+    ----------
+    groups : list of lists of dicts
+        Preloaded groups
+    folder : str or pathlib.Path
+        Output folder
+    store : bool, optional
+        Saves into preload store instead of json. Defaults to None, PRELOAD_FORMAT from config.
+    base : str or pathlib.Path, optional
+        Folder relative image paths are relative to, see PreloadStore.add_groups. Defaults to None.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of saved file
+    """
+    if store is None:
+        store = PRELOAD_FORMAT == "sqlite"
+    if store:
+        path = Path(folder) / "preload_data.sqlite"
+        PreloadStore(path).add_groups(groups, base)
+    else:
+        path = Path(folder) / "preload_data.json"
+        with open(path, 'w') as fout:
+            json.dump(groups, fout, indent=2, default=plain)
+    return path
+
+def load_groups(path, **filters):
+    """
+    Loads preloaded groups from json or preload store, see PreloadStore.groups for filters.
+    Store answers filters by its indexes, json is filtered while loaded.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to preload_data.json or preload store
+    **filters
+        Filters of images, see PreloadStore.groups
+
+    Returns
+    -------
+    list of lists of imagerecord.ImageRecord
+        Groups of processed data with paths as stored by preload
+    """
+    if is_store(path):
+        if not Path(path).is_file():
+            raise FileNotFoundError(f"Preload store {path} does not exist.")
+        return PreloadStore(path).groups(**filters)
+    with open(path, "r") as fin:
+        groups = json.loads(fin.read(), object_hook=record)
+    if any(value is not None for value in filters.values()):
+        groups = [[data for data in group if matches(data, filters)] for group in groups]
+        groups = [group for group in groups if group]
+    return groups
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+progress.py: Progress estimation weighted by bytes of processed files and by
+measured per-byte rate of each stage (processing, upload). Translates the
+estimate to progresshandler ticks used by GUI and provides ETA, current rate
+and remaining bytes for richer callbacks. Provides aggregator which coalesces
+progress updates of worker threads and renders them at fixed rate.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.1.1"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import threading
+
+# Number of progresshandler ticks for whole job. Handler receives ct in 0..TICKS and ct_max = TICKS + 1.
+TICKS = 1000
+
+# Weight of newest measurement in exponentially weighted per-byte rate
+SMOOTHING = 0.3
+
+class ByteProgress():
+    """
+    Progress of job made of stages (e.g. "process", "upload") where work of each stage is
+    measured in bytes. Time spent per byte is measured for every stage, so the stage which is
+    slower weights more in progress and ETA. Until a stage is measured, rates of other stages
+    are used for it.
+    """
+    def __init__(self, stages, progresshandler=None, etahandler=None):
+        """
+        Constructor of ByteProgress class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        stages : dict
+            Total amount of bytes for every stage, e.g. {"process": 1000, "upload": 1200}
+        progresshandler : method, optional
+            Handler with progresshandler(ct, ct_max=None, finished=False) contract. Defaults to None.
+        etahandler : method, optional
+            Handler receiving dictionary from state method on each update. Defaults to None.
+        """
+        self.total = dict(stages)
+        self.done = {stage: 0 for stage in stages}
+        # Seconds per byte for every stage, None until measured
+        self.rate = {stage: None for stage in stages}
+        self.current = None
+        self.progresshandler = progresshandler
+        self.etahandler = etahandler
+        self.lock = threading.Lock()
+
+    def advance(self, stage, nbytes, seconds):
+        """
+        Records finished work of given stage and notifies handlers.
+
+        Parameters
+        ----------
+        stage : str
+            Name of stage
+        nbytes : int
+            Amount of bytes finished
+        seconds : float
+            Time it took to finish them
+        """
+        with self.lock:
+            self.done[stage] += nbytes
+            self.current = stage
+            if nbytes > 0 and seconds > 0:
+                measured = seconds / nbytes
+                if self.rate[stage] is None:
+                    self.rate[stage] = measured
+                else:
+                    self.rate[stage] = SMOOTHING * measured + (1 - SMOOTHING) * self.rate[stage]
+        self.notify()
+
+    def notify(self, finished=False):
+        """
+        Pushes current progress to handlers.
+
+        Parameters
+        ----------
+        finished : Bool, optional
+            Flag of last update. The default is False.
+        """
+        if self.progresshandler:
+            self.progresshandler(self.ticks(), ct_max=TICKS + 1, finished=finished)
+        if self.etahandler:
+            state = self.state()
+            state["finished"] = finished
+            self.etahandler(state)
+
+    def ticks(self):
+        """
+        Returns progress as integer tick for progresshandler.
+
+        Returns
+        -------
+        int
+            Progress in range 0..TICKS
+        """
+        return min(TICKS, int(self.fraction() * TICKS))
+
+    def fraction(self):
+        """
+        Returns estimated fraction of job done, weighted by expected time of each stage.
+
+        Returns
+        -------
+        float
+            Fraction of job in range 0..1
+        """
+        with self.lock:
+            rates = self.__rates__()
+            total = sum(self.total[stage] * rates[stage] for stage in self.total)
+            done = sum(min(self.done[stage], self.total[stage]) * rates[stage] for stage in self.total)
+        if total <= 0:
+            return 0.0
+        return done / total
+
+    def state(self):
+        """
+        Returns full state of progress estimation.
+
+        Returns
+        -------
+        dict
+            fraction of job done, eta in seconds (None until any stage is measured), rate of
+            current stage in bytes per second, remaining bytes over all stages and per stage details.
+        """
+        fraction = self.fraction()
+        with self.lock:
+            measured = any(rate is not None for rate in self.rate.values())
+            rates = self.__rates__()
+            remaining = {stage: max(0, self.total[stage] - self.done[stage]) for stage in self.total}
+            eta = sum(remaining[stage] * rates[stage] for stage in self.total) if measured else None
+            current_rate = self.rate.get(self.current)
+            state = {
+                "fraction": fraction,
+                "eta": eta,
+                "rate": 1 / current_rate if current_rate else 0.0,
+                "stage": self.current,
+                "remaining_bytes": sum(remaining.values()),
+                "stages": {stage: {"total_bytes": self.total[stage],
+                                   "done_bytes": self.done[stage],
+                                   "rate": 1 / self.rate[stage] if self.rate[stage] else 0.0}
+                           for stage in self.total}
+            }
+        return state
+
+    def __rates__(self):
+        """
+        Returns seconds per byte of all stages, unmeasured stages use mean of measured ones.
+        Must be called with lock held.
+        """
+        known = [rate for rate in self.rate.values() if rate is not None]
+        fallback = sum(known) / len(known) if known else 1.0
+        return {stage: rate if rate is not None else fallback for stage, rate in self.rate.items()}
+
+class ProgressAggregator():
+    """
+    Coalesces progress updates from worker threads and renders them from one place at fixed rate.
+    Workers only store latest fraction of each bar, renderhandler(changed) is called at most rate
+    times per second with dictionary {bar: fraction} of bars changed since the last render.
+    """
+    def __init__(self, renderhandler, rate=10):
+        """
+        Constructor of ProgressAggregator class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        renderhandler : method
+            Method which draws changed bars, receives dictionary {bar: fraction}.
+        rate : float, optional
+            Maximal amount of renders per second. Defaults to 10.
+        """
+        self.renderhandler = renderhandler
+        self.interval = 1 / rate
+        self.values = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def update(self, bar, fraction):
+        """
+        Stores latest fraction of given bar. Cheap, can be called from any thread for every event.
+
+        Parameters
+        ----------
+        bar : str
+            Name of progress bar
+        fraction : float or None
+            Progress of the bar, clipped to 0..1. None marks indeterminate progress (total unknown).
+        """
+        with self.lock:
+            self.values[bar] = None if fraction is None else min(1.0, max(0.0, fraction))
+            self.dirty.add(bar)
+
+    def flush(self):
+        """
+        Renders all bars changed since the last render right away.
+        """
+        with self.lock:
+            changed = {bar: self.values[bar] for bar in self.dirty}
+            self.dirty.clear()
+        if changed:
+            self.renderhandler(changed)
+
+    def start(self):
+        """
+        Starts render thread if it is not running already.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__run__, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops render thread and renders pending updates.
+        """
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        self.flush()
+
+    def reset(self):
+        """
+        Forgets stored fractions and pending updates.
+        """
+        with self.lock:
+            self.values = {}
+            self.dirty.clear()
+
+    def __run__(self):
+        """
+        Render loop of aggregator thread.
+        """
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+def format_eta(seconds):
+    """
+    Formats ETA for humans.
+
+    Parameters
+    ----------
+    seconds : float or None
+        ETA in seconds
+
+    Returns
+    -------
+    str
+        ETA like "1h 02m 03s", "--" if unknown
+    """
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    return f"{minutes}m {seconds:02d}s"
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+ratelimit.py: Bandwidth limit of uploads. One token bucket is shared by all
+uploads of the process, its rate follows day time schedule from config and may
+be changed while running, either by override file (python -m archeoplant limit)
+or by set_override.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Longest single sleep of waiting upload, cancellation and limit changes are noticed within it
+MAX_WAIT = 0.5
+# Override file is checked for change at most once per this many seconds
+OVERRIDE_CHECK = 2.0
+# Marker of missing override, None override means unlimited
+NO_OVERRIDE = object()
+
+# Limiter of the process, shared by all uploads
+_LIMITER = None
+_LIMITER_LOCK = threading.Lock()
+
+def shared_limiter(limit=None, schedule=None, override_path=None):
+    """
+    Returns bandwidth limiter of the process. Limiter is created on first call, later calls
+    update its settings, so concurrent uploads always share one bucket.
+
+    Parameters
+    ----------
+    limit : numeric, optional
+        Limit in MB/s outside of schedule windows, None for unlimited. Defaults to None.
+    schedule : list of tuples, optional
+        Day time windows ("HH:MM", "HH:MM", MB/s or None). Defaults to None.
+    override_path : str or pathlib.Path, optional
+        Json file with runtime override, see write_override. Defaults to None.
+
+    Returns
+    -------
+    BandwidthLimiter
+        Shared limiter
+    """
+    global _LIMITER
+    with _LIMITER_LOCK:
+        if _LIMITER is None:
+            _LIMITER = BandwidthLimiter(limit, schedule, override_path)
+        else:
+            _LIMITER.configure(limit, schedule, override_path)
+    return _LIMITER
+
+def parse_schedule(schedule):
+    """
+    Converts schedule windows to minutes of day.
+
+    Parameters
+    ----------
+    schedule : list of tuples
+        Windows ("HH:MM", "HH:MM", MB/s or None). Window ending before its start crosses midnight.
+
+    Returns
+    -------
+    list of tuples
+        Windows (start minute, end minute, MB/s or None)
+
+    Raises
+    ------
+    ValueError
+        Raises on malformed window.
+    """
+    windows = []
+    for start, end, limit in schedule or []:
+        minutes = []
+        for moment in (start, end):
+            hours, _, mins = str(moment).partition(":")
+            minutes.append(int(hours) * 60 + int(mins or 0))
+            if not 0 <= minutes[-1] <= 24 * 60:
+                raise ValueError(f"Invalid time {moment} in upload limit schedule.")
+        windows.append((minutes[0], minutes[1], limit))
+    return windows
+
+def scheduled_limit(windows, default, now=None):
+    """
+    Returns limit in MB/s valid at given time, first matching window wins.
+
+    Parameters
+    ----------
+    windows : list of tuples
+        Output of parse_schedule
+    default : numeric or None
+        Limit outside of all windows
+    now : datetime, optional
+        Time of the question. Defaults to None, current local time.
+    """
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end, limit in windows:
+        inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+        if inside:
+            return limit
+    return default
+
+def write_override(path, limit=NO_OVERRIDE):
+    """
+    Sets runtime override of running uploads. Running limiters pick it up within few seconds.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Override file, UPLOAD_LIMIT_FILE in config
+    limit : numeric or None, optional
+        Limit in MB/s, None for unlimited. Defaults to NO_OVERRIDE, override is removed and
+        schedule applies again.
+    """
+    path = Path(path)
+    if limit is NO_OVERRIDE:
+        path.unlink(missing_ok=True)
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as fout:
+        json.dump({"limit": limit}, fout)
+    os.replace(tmp, path)
+
+class BandwidthLimiter():
+    """
+    Thread safe token bucket. Bucket holds at most one second of traffic (and at least one
+    request), so idle time does not allow long burst above the limit. Every upload takes tokens
+    for its request before sending it and waits while bucket is in debt.
+    """
+    def __init__(self, limit=None, schedule=None, override_path=None):
+        """
+        Constructor of BandwidthLimiter class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        limit : numeric, optional
+            Limit in MB/s outside of schedule windows, None for unlimited. Defaults to None.
+        schedule : list of tuples, optional
+            Day time windows ("HH:MM", "HH:MM", MB/s or None). Defaults to None.
+        override_path : str or pathlib.Path, optional
+            Json file with runtime override. Defaults to None.
+        """
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.override = NO_OVERRIDE
+        self.override_mtime = None
+        self.override_checked = 0.0
+        self.current = None
+        # Counters of traffic, waiting and integral of limit over time when limited
+        self.stats = {"bytes": 0, "throttled_seconds": 0.0, "limited_seconds": 0.0, "limit_integral": 0.0,
+                      "seconds": 0.0}
+        self.configure(limit, schedule, override_path)
+
+    def configure(self, limit=None, schedule=None, override_path=None):
+        """
+        Replaces configured limit, schedule and override file. Runtime override set by
+        set_override stays.
+        """
+        windows = parse_schedule(schedule)
+        with self.lock:
+            self.default = limit
+            self.windows = windows
+            self.override_path = Path(override_path) if override_path else None
+            self.override_checked = 0.0
+
+    def set_override(self, limit=NO_OVERRIDE):
+        """
+        Overrides schedule of this process by given limit in MB/s (None for unlimited), without
+        argument the schedule applies again.
+        """
+        with self.lock:
+            self.override = limit
+
+    def limit(self):
+        """
+        Returns limit in bytes per second valid now, None if unlimited.
+        """
+        with self.lock:
+            return self.__limit__(time.monotonic())
+
+    def acquire(self, nbytes, cancel=None):
+        """
+        Takes tokens for request of given size, waits until the bucket allows it.
+
+        Parameters
+        ----------
+        nbytes : int
+            Size of the request in bytes
+        cancel : cancel.CancelToken, optional
+            Token which stops waiting. Defaults to None.
+
+        Raises
+        ------
+        Cancelled
+            Raises when cancel token gets cancelled while waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                rate = self.__refill__(now)
+                if rate is None or self.tokens >= 0:
+                    self.tokens -= nbytes if rate is not None else 0
+                    self.stats["bytes"] += nbytes
+                    self.stats["throttled_seconds"] += waited
+                    return
+                wait = min(MAX_WAIT, -self.tokens / rate)
+            start = time.monotonic()
+            if cancel:
+                cancel.wait(wait)
+                if cancel.cancelled:
+                    with self.lock:
+                        self.stats["throttled_seconds"] += waited + time.monotonic() - start
+                    cancel.check()
+            else:
+                time.sleep(wait)
+            waited += time.monotonic() - start
+
+    def counters(self):
+        """
+        Returns copy of limiter counters, pass it to report to get statistics of one run.
+        """
+        with self.lock:
+            self.__refill__(time.monotonic())
+            return dict(self.stats)
+
+    def report(self, since=None):
+        """
+        Returns statistics of limited traffic.
+
+        Parameters
+        ----------
+        since : dict, optional
+            Output of counters, statistics are computed since then. Defaults to None, since limiter creation.
+
+        Returns
+        -------
+        dict
+            Bytes, achieved MB/s, current and mean configured limit in MB/s (None if unlimited), share of
+            time with limit, seconds uploads waited for the limiter and utilization of the limit.
+        """
+        counters = self.counters()
+        if since:
+            counters = {key: value - since.get(key, 0) for key, value in counters.items()}
+        current = self.limit()
+        seconds = counters["seconds"]
+        limited = counters["limited_seconds"]
+        achieved = counters["bytes"] / seconds / 1e6 if seconds > 0 else 0.0
+        mean_limit = counters["limit_integral"] / limited / 1e6 if limited > 0 else None
+        return {"bytes": counters["bytes"],
+                "achieved_mb_per_s": achieved,
+                "limit_mb_per_s": None if current is None else current / 1e6,
+                "mean_limit_mb_per_s": mean_limit,
+                "limited_fraction": limited / seconds if seconds > 0 else 0.0,
+                "throttled_seconds": counters["throttled_seconds"],
+                "utilization": achieved / mean_limit if mean_limit else None}
+
+    def __refill__(self, now):
+        """
+        Adds tokens for time since last refill and accounts limit over that time. Returns current
+        rate in bytes per second or None. Has to be called with lock.
+        """
+        rate = self.__limit__(now)
+        elapsed = now - self.updated
+        self.updated = now
+        self.stats["seconds"] += elapsed
+        if self.current is not None:
+            self.stats["limited_seconds"] += elapsed
+            self.stats["limit_integral"] += elapsed * self.current
+        self.current = rate
+        if rate is None:
+            self.tokens = 0.0
+            return None
+        self.tokens = min(self.tokens + elapsed * rate, rate)
+        return rate
+
+    def __limit__(self, now):
+        """
+        Returns limit in bytes per second from override or schedule. Has to be called with lock.
+        """
+        if self.override_path and now - self.override_checked >= OVERRIDE_CHECK:
+            self.override_checked = now
+            self.__read_override__()
+        limit = self.override if self.override is not NO_OVERRIDE else scheduled_limit(self.windows, self.default)
+        return None if limit is None or limit <= 0 else limit * 1e6
+
+    def __read_override__(self):
+        """
+        Reads override file if it changed. Removed file removes the override. Has to be called with lock.
+        """
+        try:
+            mtime = self.override_path.stat().st_mtime_ns
+        except OSError:
+            if self.override_mtime is not None:
+                self.override_mtime = None
+                self.override = NO_OVERRIDE
+            return
+        if mtime == self.override_mtime:
+            return
+        self.override_mtime = mtime
+        try:
+            with open(self.override_path, "r") as fin:
+                self.override = json.load(fin)["limit"]
+        except (ValueError, KeyError, OSError) as e:
+            print("Upload limit override could not be read, ignored: " + str(e.__class__.__name__) + " " + str(e))
+            self.override = NO_OVERRIDE
+
+def format_report(report):
+    """
+    Formats bandwidth statistics for console.
+
+    Parameters
+    ----------
+    report : dict
+        Output of BandwidthLimiter.report
+
+    Returns
+    -------
+    str
+        One line summary
+    """
+    if report["mean_limit_mb_per_s"] is None:
+        return f"Upload bandwidth: {report['achieved_mb_per_s']:.2f} MB/s, not limited."
+    return (f"Upload bandwidth: {report['achieved_mb_per_s']:.2f} MB/s of {report['mean_limit_mb_per_s']:.2f} MB/s limit "
+            f"({report['limited_fraction']*100:.0f} % of time limited), uploads waited {report['throttled_seconds']:.1f} s.")
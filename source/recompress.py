@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+recompress.py: Optional pre-upload stage which transcodes uncompressed TIFF
+images to losslessly compressed TIFF (Deflate, LZW or ZSTD). Images are
+recompressed in worker pool into temporary files, pixel equality is verified
+and only smaller files replace the originals in upload.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import cv2 as cv2
+
+# libtiff compression codes accepted by cv2.IMWRITE_TIFF_COMPRESSION
+COMPRESSIONS = {
+    "lzw": 5,
+    "deflate": 8,
+    "zstd": 50000
+}
+
+def recompress_tiff(path, tmp_dir, compression="deflate"):
+    """
+    Transcodes one TIFF into losslessly compressed TIFF stored in tmp_dir under the same file name.
+    Result is kept only if pixels are equal to the original and file got smaller.
+
+    Multipage TIFFs are skipped as OpenCV would write the first page only. Note that only pixel
+    data are preserved, vendor specific TIFF tags are not copied to the new file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to TIFF which should be recompressed
+    tmp_dir : str or pathlib.Path
+        Folder where recompressed file should be written
+    compression : str, optional
+        One of "deflate", "lzw", "zstd". Defaults to "deflate".
+
+    Returns
+    -------
+    pathlib.Path or None
+        Path to recompressed file or None if original should be uploaded instead.
+    """
+    path = Path(path)
+    if cv2.imcount(str(path)) != 1:
+        return None
+    original = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if original is None:
+        return None
+
+    # Every file gets its own folder so the name of uploaded file stays untouched
+    out_dir = Path(tempfile.mkdtemp(dir=tmp_dir))
+    out_path = out_dir / path.name
+    written = cv2.imwrite(str(out_path), original, [cv2.IMWRITE_TIFF_COMPRESSION, COMPRESSIONS[compression]])
+
+    # Verify that transcoding is really lossless and worth it
+    if written:
+        recompressed = cv2.imread(str(out_path), cv2.IMREAD_UNCHANGED)
+        if recompressed is not None and recompressed.dtype == original.dtype and np.array_equal(recompressed, original) \
+                and out_path.stat().st_size < path.stat().st_size:
+            return out_path
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return None
+
+class Recompressor():
+    """
+    Worker pool of lossless TIFF recompression. Groups are submitted ahead of their upload,
+    uploader then asks for the file to upload which is either the recompressed temporary file
+    or the original. Keyence TIFFs (image and meta data are the same file) are never
+    recompressed as their MakerNote offsets point to absolute positions inside the file.
+    """
+    def __init__(self, compression="deflate", workers=2, tmp_dir=None):
+        """
+        Constructor of Recompressor class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        compression : str, optional
+            One of "deflate", "lzw", "zstd". Defaults to "deflate".
+        workers : int, optional
+            Number of worker threads. OpenCV releases GIL while encoding. Defaults to 2.
+        tmp_dir : str, optional
+            Folder for temporary files. Defaults to None, system temp folder.
+
+        Raises
+        ------
+        ValueError
+            Raises when unknown compression is requested.
+        """
+        compression = compression.lower()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown TIFF compression {compression}! Use one of {', '.join(COMPRESSIONS)}.")
+        self.compression = compression
+        self.tmp_dir = tempfile.mkdtemp(prefix="recompress_", dir=tmp_dir)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.stats = {"files": 0, "recompressed": 0, "skipped": 0, "failed": 0, "original_bytes": 0, "uploaded_bytes": 0}
+
+    def submit(self, group):
+        """
+        Schedules recompression of all images in given group.
+
+        Parameters
+        ----------
+        group : list of dicts
+            Group of processed images with resolved img_path and meta_path.
+        """
+        for data in group:
+            path = data['img_path']
+            # Keyence keeps meta data inside of the tif, leave its bytes untouched
+            if path == data['meta_path'] or Path(path).suffix.lower() not in [".tif", ".tiff"]:
+                continue
+            with self.lock:
+                if path not in self.jobs:
+                    self.jobs[path] = self.pool.submit(recompress_tiff, path, self.tmp_dir, self.compression)
+
+    def get(self, path):
+        """
+        Returns path of file which should be uploaded instead of given path. Waits for running
+        recompression of that file.
+
+        Parameters
+        ----------
+        path : str
+            Original path of image
+
+        Returns
+        -------
+        str
+            Path to recompressed file or the original path
+        """
+        with self.lock:
+            job = self.jobs.get(path)
+        original_size = Path(path).stat().st_size
+        result = None
+        if job is not None:
+            try:
+                result = job.result()
+            except Exception as e:
+                print("Recompression failed for " + str(path) + ": " + str(e.__class__.__name__) + " " + str(e))
+                with self.lock:
+                    self.stats["failed"] += 1
+        with self.lock:
+            self.stats["files"] += 1
+            self.stats["original_bytes"] += original_size
+            if result is None:
+                self.stats["skipped"] += 1
+                self.stats["uploaded_bytes"] += original_size
+                return path
+            self.stats["recompressed"] += 1
+            self.stats["uploaded_bytes"] += result.stat().st_size
+        return result.as_posix()
+
+    def release(self, path):
+        """
+        Removes temporary file created for given original path.
+
+        Parameters
+        ----------
+        path : str
+            Original path of image
+        """
+        with self.lock:
+            job = self.jobs.pop(path, None)
+        if job is not None and job.done() and job.exception() is None and job.result() is not None:
+            shutil.rmtree(job.result().parent, ignore_errors=True)
+
+    def report(self):
+        """
+        Returns statistics of recompression for current run.
+
+        Returns
+        -------
+        dict
+            Counts of processed files and bytes saved on transfer.
+        """
+        with self.lock:
+            report = dict(self.stats)
+        report["compression"] = self.compression
+        report["bytes_saved"] = report["original_bytes"] - report["uploaded_bytes"]
+        return report
+
+    def close(self):
+        """
+        Stops worker pool and removes all temporary files.
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancel()
+        self.pool.shutdown(wait=True)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+"""
+service.py: Local upload service shared by lab computers. Clients submit
+preloaded groups (preload_data.json or json lines with one group per line) over
+HTTP, service skips groups and images it already has, schedules groups fairly
+among users by uploaded bytes and uploads them through one Connector, so all
+microscopes share one api.token and one upload session.
+
+API:
+    POST   /batches?user=<name>   submit batch, returns its id and skipped duplicates
+    GET    /batches/<id>          state of batch
+    DELETE /batches/<id>          drop groups of batch which were not uploaded yet
+    GET    /status                queues of users, throughput and upload totals
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.3"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+import threading
+import urllib.parse
+import urllib.request
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from cancel import Cancelled
+from config import SERVICE_HOST, SERVICE_PORT, SERVICE_STATS_WINDOW
+from dataprocess import resolve_path, group_key, group_size
+from dedup import Deduplicator
+from instrumentation import add_hook, remove_hook, RollingStats
+from preloadstore import is_store, load_groups
+from imagerecord import plain
+
+# Largest accepted batch in bytes of json
+MAX_BATCH = 256 * 1024 * 1024
+
+def parse_batch(text, parent=None):
+    """
+    Parses batch of groups. Accepts preload json (list of groups) or json lines, one group
+    (list of image dictionaries) or one image dictionary per line.
+
+    Parameters
+    ----------
+    text : str
+        Preload json or json lines
+    parent : pathlib.Path, optional
+        Folder against which relative paths are resolved. Defaults to None, relative paths are
+        refused as service does not know where the client json was.
+
+    Returns
+    -------
+    list of lists
+        Groups of image dictionaries
+
+    Raises
+    ------
+    ValueError
+        Raises when batch is not valid json or json lines, or path of image is relative.
+    """
+    try:
+        groups = json.loads(text)
+        if not isinstance(groups, list):
+            raise ValueError("Batch has to be list of groups.")
+    except json.JSONDecodeError:
+        groups = [json.loads(line) for line in text.splitlines() if line.strip()]
+    groups = [group if isinstance(group, list) else [group] for group in groups]
+    for group in groups:
+        for data in group:
+            if not isinstance(data, dict) or "img_path" not in data or "meta_path" not in data:
+                raise ValueError("Every image needs img_path and meta_path.")
+            for key in ("img_path", "meta_path"):
+                if Path(data[key]).is_absolute():
+                    continue
+                if parent is None:
+                    raise ValueError(f"Path {data[key]} is not absolute.")
+                data[key] = (parent / data[key]).as_posix()
+    return groups
+
+class UploadService():
+    """
+    HTTP service uploading batches of many clients through one Connector. Groups of each user
+    wait in their own queue, next group is taken from the user with the least bytes uploaded
+    (user joining later starts at the level of the others, so the newcomer does not take over
+    the service until catching up). Groups are uploaded one at a time by one worker thread.
+    """
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, consolecall=False):
+        """
+        Constructor of UploadService class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on. Defaults to SERVICE_HOST from config.
+        port : int, optional
+            Port to listen on. Defaults to SERVICE_PORT from config.
+        consolecall : Bool, optional
+            Toggles console prints of submitted batches and uploaded groups. Defaults to False.
+        """
+        self.consolecall = consolecall
+        # {user: deque of (batch id, group, size)}
+        self.queues = {}
+        # Bytes uploaded for every user, base of fair scheduling
+        self.served = {}
+        self.batches = {}
+        # Group keys of queued and uploaded groups, {key: batch id}
+        self.seen = {}
+        # Image paths of accepted groups, compared with images of new batches
+        self.paths = []
+        self.current = None
+        self.lock = threading.Condition()
+        self.uploader = None
+        self.deduplicator = None
+        # Batches are compared with accepted images one at a time, deduplicator and its store are not thread safe
+        self.dedup_lock = threading.Lock()
+        self.rolling = RollingStats(window=SERVICE_STATS_WINDOW)
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler__())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        Base url of the service.
+        """
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, groups, user):
+        """
+        Queues groups of new batch. Groups already queued or uploaded and images with the same
+        content as already accepted ones are skipped.
+
+        Parameters
+        ----------
+        groups : list of lists
+            Groups of image dictionaries with absolute paths, see parse_batch
+        user : str
+            User who submitted the batch, stored with findings
+
+        Returns
+        -------
+        dict
+            State of the batch, see batch
+        """
+        with self.lock:
+            batch_id = len(self.batches) + 1
+            batch = self.batches[batch_id] = {"id": batch_id, "user": user, "submitted": datetime.now().isoformat(),
+                                              "groups": 0, "bytes": 0, "done": 0, "failed": 0, "dropped": 0,
+                                              "skipped_groups": 0, "duplicate_images": {}}
+            fresh = []
+            for group in groups:
+                key = group_key(group) if group else None
+                if key is None or key in self.seen:
+                    batch["skipped_groups"] += 1
+                    continue
+                self.seen[key] = batch_id
+                fresh.append(group)
+        # Batches are compared one at a time, images accepted from concurrently submitted batch are known to the next one
+        with self.dedup_lock:
+            with self.lock:
+                known = list(self.paths)
+            # Content of new images is compared outside of queue lock, hashing may take a while
+            if self.deduplicator and fresh:
+                new = [data["img_path"] for group in fresh for data in group]
+                found = {duplicate: original for duplicate, original in self.deduplicator.duplicates(known + new).items()
+                         if duplicate in {Path(path).resolve().as_posix() for path in new}}
+                kept = [[data for data in group if Path(data["img_path"]).resolve().as_posix() not in found] for group in fresh]
+                batch["duplicate_images"] = found
+                batch["skipped_groups"] += sum(1 for group in kept if not group)
+                fresh = [group for group in kept if group]
+            with self.lock:
+                queue = self.queues.setdefault(user, deque())
+                if fresh and not queue and user != (self.current or {}).get("user"):
+                    # Idle user continues from the level of active users
+                    active = [self.served.get(other, 0) for other, waiting in self.queues.items() if waiting]
+                    self.served[user] = max(self.served.get(user, 0), min(active) if active else 0)
+                for group in fresh:
+                    for data in group:
+                        data["user"] = user
+                        self.paths.append(data["img_path"])
+                    size = group_size([[data["img_path"], data["meta_path"]] for data in group])
+                    queue.append((batch_id, group, size))
+                    batch["groups"] += 1
+                    batch["bytes"] += size
+                self.lock.notify_all()
+        if self.consolecall:
+            print(f"Batch {batch_id} of {user}: {batch['groups']} groups queued, {batch['skipped_groups']} skipped.")
+        return self.batch(batch_id)
+
+    def batch(self, batch_id):
+        """
+        Returns state of batch with amount of its queued, uploaded, failed and dropped groups, or None.
+        """
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            state = dict(batch)
+            state["queued"] = sum(1 for queued_id, _, _ in self.queues.get(batch["user"], ()) if queued_id == batch_id)
+            running = self.current is not None and self.current["batch"] == batch_id
+            state["state"] = "running" if running or state["queued"] else "finished"
+        return state
+
+    def drop(self, batch_id):
+        """
+        Removes groups of batch which have not been uploaded yet.
+
+        Returns
+        -------
+        int or None
+            Amount of removed groups, None for unknown batch
+        """
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            queue = self.queues.get(batch["user"], deque())
+            kept = deque(item for item in queue if item[0] != batch_id)
+            dropped = [item[1] for item in queue if item[0] == batch_id]
+            self.queues[batch["user"]] = kept
+            for group in dropped:
+                self.seen.pop(group_key(group), None)
+            batch["dropped"] += len(dropped)
+        return len(dropped)
+
+    def status(self):
+        """
+        Returns state of the service.
+
+        Returns
+        -------
+        dict
+            Queued groups and bytes of every user with bytes uploaded for him, current group,
+            throughput over last SERVICE_STATS_WINDOW seconds with bandwidth limit and upload totals of the service run.
+        """
+        with self.lock:
+            users = {user: {"queued_groups": len(queue), "queued_bytes": sum(size for _, _, size in queue),
+                            "uploaded_bytes": self.served.get(user, 0)}
+                     for user, queue in self.queues.items()}
+            current = dict(self.current) if self.current else None
+            batches = len(self.batches)
+        snapshot = self.rolling.snapshot()
+        totals = self.uploader.metrics.summary() if self.uploader else {}
+        limiter = self.uploader.limiter if self.uploader else None
+        limit = limiter.limit() if limiter else None
+        return {"users": users, "current": current, "batches": batches,
+                "throughput": {"upload_mb_per_s": snapshot["upload_mb_per_s"], "window": SERVICE_STATS_WINDOW,
+                               "limit_mb_per_s": None if limit is None else limit / 1e6},
+                "totals": {key: totals.get(key) for key in
+                           ("files", "failed_files", "bytes", "findings", "failed_findings", "mb_per_s")}}
+
+    def run(self, cancel, metricshandler=None, report_path=None):
+        """
+        Serves clients and uploads their batches until cancel token gets cancelled.
+
+        Parameters
+        ----------
+        cancel : cancel.CancelToken
+            Token which stops the service. Group in progress is stopped within one chunk.
+        metricshandler : method, optional
+            Callback receiving upload metrics events, see metrics.UploadMetrics. Defaults to None.
+        report_path : str, optional
+            Path where upload run report should be saved on stop (.json or .csv). Defaults to UPLOAD_REPORT from config.
+
+        Returns
+        -------
+        dict
+            Summary of upload metrics of the service run
+        """
+        import uploader as up
+        self.uploader = up.Connector()
+        if self.uploader.setup["dedup"]:
+            store = self.uploader.setup["dedup_store"]
+            self.deduplicator = Deduplicator(resolve_path(store) if store else None)
+        self.uploader.start_run(metricshandler, cancel)
+        add_hook(self.rolling)
+        server = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        server.start()
+        if self.consolecall:
+            print(f"Upload service listens on {self.url}.")
+        # Cancellation has to wake up idle worker
+        threading.Thread(target=lambda: (cancel.wait(), self.__wake__()), daemon=True).start()
+        try:
+            while not cancel.cancelled:
+                item = self.__next__()
+                if item is None:
+                    continue
+                self.__upload__(*item)
+        except Cancelled:
+            pass
+        finally:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            remove_hook(self.rolling)
+        return self.uploader.finish_run(report_path)
+
+    def __next__(self):
+        """
+        Waits for next group and takes it from the queue of user with the least uploaded bytes.
+        Returns None if woken up without work.
+        """
+        with self.lock:
+            waiting = [user for user, queue in self.queues.items() if queue]
+            if not waiting:
+                self.lock.wait(1.0)
+                return None
+            user = min(waiting, key=lambda name: self.served.get(name, 0))
+            batch_id, group, size = self.queues[user].popleft()
+            self.current = {"user": user, "batch": batch_id, "group": group_key(group), "bytes": size}
+        return user, batch_id, group, size
+
+    def __upload__(self, user, batch_id, group, size):
+        """
+        Uploads one group and accounts it to its batch and user.
+        """
+        metrics = self.uploader.metrics
+        files, findings = len(metrics.files), len(metrics.findings)
+        try:
+            self.uploader.prepare_group(group)
+            self.uploader.commit_one_group(group, self.__quiet__)
+        finally:
+            # Connector reports failures into metrics only, group failed if any of its records did
+            with metrics.lock:
+                records = metrics.files[files:] + metrics.findings[findings:]
+            failed = len(metrics.findings) == findings or any(record.get("error") for record in records)
+            with self.lock:
+                self.current = None
+                self.served[user] = self.served.get(user, 0) + size
+                self.batches[batch_id]["failed" if failed else "done"] += 1
+                if failed:
+                    # Failed group may be submitted again
+                    self.seen.pop(group_key(group), None)
+        if self.consolecall:
+            print(f"{'Failed' if failed else 'Uploaded'} group {group_key(group)} of {user}.")
+
+    def __wake__(self):
+        """
+        Wakes up worker waiting for groups.
+        """
+        with self.lock:
+            self.lock.notify_all()
+
+    def __quiet__(self, msg, file_size, chunk=0, nr_chunks=0):
+        """
+        Uploaderhandler of the service, chunk progress is published by status instead.
+        """
+
+    def __handler__(self):
+        """
+        Returns request handler class bound to this service.
+        """
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                url = urllib.parse.urlparse(self.path)
+                if url.path.rstrip("/") != "/batches":
+                    return self.__respond__(404, {"error": "Unknown endpoint."})
+                user = urllib.parse.parse_qs(url.query).get("user", [""])[0] or self.headers.get("X-User", "")
+                length = int(self.headers.get("Content-Length") or 0)
+                if not user:
+                    return self.__respond__(400, {"error": "User name is required."})
+                if length > MAX_BATCH:
+                    return self.__respond__(413, {"error": "Batch is too large, split it into more batches."})
+                try:
+                    groups = parse_batch(self.rfile.read(length).decode("utf-8"))
+                except (ValueError, UnicodeDecodeError) as e:
+                    return self.__respond__(400, {"error": str(e)})
+                self.__respond__(201, service.submit(groups, user))
+
+            def do_GET(self):
+                path = urllib.parse.urlparse(self.path).path.rstrip("/")
+                if path == "/status":
+                    return self.__respond__(200, service.status())
+                batch = service.batch(self.__batch_id__(path))
+                self.__respond__(200 if batch else 404, batch or {"error": "Unknown batch."})
+
+            def do_DELETE(self):
+                dropped = service.drop(self.__batch_id__(urllib.parse.urlparse(self.path).path.rstrip("/")))
+                self.__respond__(404 if dropped is None else 200,
+                                 {"error": "Unknown batch."} if dropped is None else {"dropped": dropped})
+
+            def __batch_id__(self, path):
+                """
+                Returns batch id from /batches/<id> path or None.
+                """
+                parts = path.split("/")
+                if len(parts) == 3 and parts[1] == "batches" and parts[2].isdigit():
+                    return int(parts[2])
+                return None
+
+            def __respond__(self, code, payload):
+                """
+                Sends json response.
+                """
+                body = json.dumps(payload, default=str).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+def submit_batch(path, user, url=None):
+    """
+    Submits preload json or json lines file to upload service. Relative paths are resolved
+    against folder of the file, same as commit_all does.
+
+    Parameters
+    ----------
+    path : str
+        Path to preload_data.json, .jsonl file or preload store
+    user : str
+        User name stored with uploaded findings
+    url : str, optional
+        Url of the service. Defaults to SERVICE_HOST and SERVICE_PORT from config.
+
+    Returns
+    -------
+    dict
+        State of submitted batch, see UploadService.batch
+
+    Raises
+    ------
+    urllib.error.HTTPError
+        Raises when service refuses the batch.
+    """
+    path = resolve_path(path).resolve()
+    if is_store(path):
+        # Only images which have not been uploaded from the store yet are submitted
+        text = json.dumps(load_groups(path, status="pending"), default=plain)
+    else:
+        with open(path, "r") as fin:
+            text = fin.read()
+    groups = parse_batch(text, path.parent)
+    body = "\n".join(json.dumps(group) for group in groups).encode("utf-8")
+    url = (url or f"http://{SERVICE_HOST}:{SERVICE_PORT}").rstrip("/")
+    request = urllib.request.Request(f"{url}/batches?" + urllib.parse.urlencode({"user": user}), data=body,
+                                     headers={"Content-Type": "application/x-ndjson"}, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def service_status(url=None):
+    """
+    Returns status of upload service, see UploadService.status.
+    """
+    url = (url or f"http://{SERVICE_HOST}:{SERVICE_PORT}").rstrip("/")
+    with urllib.request.urlopen(f"{url}/status") as response:
+        return json.loads(response.read())
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+staging.py: Local staging cache of images from network shares. Every image is
+copied once to local disk in one sequential transfer, processing and upload then
+read the local copy. Least recently used copies are evicted under disk quota.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+# Buffer of sequential copy from share to local disk
+COPY_BUFFER = 8 * 1024 * 1024
+# Name of cache index inside of staging folder
+INDEX_NAME = "index.json"
+
+# Opened caches, processing and upload of one run share the same cache
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+def open_cache(root, quota):
+    """
+    Returns staging cache for given folder. Cache is created on first call and shared by later calls.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path
+        Local folder of staging cache
+    quota : numeric
+        Disk quota of cache in MB
+
+    Returns
+    -------
+    StagingCache
+        Shared cache of given folder
+    """
+    root = Path(root).resolve()
+    with _CACHES_LOCK:
+        cache = _CACHES.get(root)
+        if cache is None:
+            cache = _CACHES[root] = StagingCache(root, quota)
+        else:
+            cache.quota = quota * 1000000
+    return cache
+
+class StagingCache():
+    """
+    Local copies of source files keyed by source path. Copy is reused while size and modification
+    time of the source stay the same, so only stat of the source goes over network on hit. Index
+    of copies is kept in the staging folder and reused by later runs.
+    """
+    def __init__(self, root, quota):
+        """
+        Constructor of StagingCache class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        root : str or pathlib.Path
+            Local folder of staging cache. Created if it does not exist.
+        quota : numeric
+            Disk quota of cache in MB. Files larger than quota are never staged.
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.quota = quota * 1000000
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pending = {}
+        self.used = 0
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "evicted": 0, "bytes_local": 0, "bytes_staged": 0}
+        index = self.root / INDEX_NAME
+        if index.is_file():
+            try:
+                with open(index, "r") as fin:
+                    self.entries = json.load(fin)["files"]
+            except (ValueError, KeyError, OSError) as e:
+                print("Staging cache index could not be loaded, starting empty: " + str(e.__class__.__name__) + " " + str(e))
+        # Keep only entries with their copy, remove copies without entry
+        self.entries = {source: entry for source, entry in self.entries.items() if (self.root / entry["file"]).is_file()}
+        known = {entry["file"] for entry in self.entries.values()} | {INDEX_NAME}
+        for file in self.root.iterdir():
+            if file.name not in known and file.is_file():
+                file.unlink()
+        self.used = sum(entry["size"] for entry in self.entries.values())
+
+    def stage(self, path):
+        """
+        Returns path of local copy of given file. File is copied on first request and after
+        its change, least recently used copies are evicted to fit quota.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to source file
+
+        Returns
+        -------
+        str
+            Path to local copy, or the source path if the file does not fit quota or can not be copied
+        """
+        source = Path(path).as_posix()
+        stat = os.stat(source)
+        with self.lock:
+            # Same file is being copied by another thread, use its copy
+            copying = self.pending.get(source)
+            if copying is None:
+                entry = self.entries.get(source)
+        if copying is not None:
+            copying.wait()
+            return self.stage(path)
+        with self.lock:
+            entry = self.entries.get(source)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                entry["used"] = time.time()
+                self.stats["hits"] += 1
+                self.stats["bytes_local"] += stat.st_size
+                return (self.root / entry["file"]).as_posix()
+            if stat.st_size > self.quota:
+                self.stats["bypassed"] += 1
+                return source
+            if entry is not None:
+                self.__remove__(source)
+            self.__evict__(stat.st_size)
+            # Space is reserved before copying, so parallel copies do not exceed quota
+            name = hashlib.blake2b(source.encode("utf-8"), digest_size=16).hexdigest() + Path(source).suffix.lower()
+            self.used += stat.st_size
+            copying = self.pending[source] = threading.Event()
+        local = self.root / name
+        tmp = self.root / (name + ".tmp")
+        try:
+            with open(source, "rb") as fin, open(tmp, "wb") as fout:
+                shutil.copyfileobj(fin, fout, COPY_BUFFER)
+            os.replace(tmp, local)
+        except OSError as e:
+            print("Staging of " + source + " failed, reading it from source: " + str(e.__class__.__name__) + " " + str(e))
+            with self.lock:
+                self.used -= stat.st_size
+                self.stats["bypassed"] += 1
+                del self.pending[source]
+            copying.set()
+            tmp.unlink(missing_ok=True)
+            return source
+        with self.lock:
+            self.entries[source] = {"file": name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "used": time.time()}
+            self.stats["misses"] += 1
+            self.stats["bytes_staged"] += stat.st_size
+            del self.pending[source]
+        copying.set()
+        return local.as_posix()
+
+    def __evict__(self, size):
+        """
+        Removes least recently used copies until size fits quota. Has to be called with lock.
+        """
+        for source in sorted(self.entries, key=lambda source: self.entries[source]["used"]):
+            if self.used + size <= self.quota:
+                break
+            # Copy opened by another reader stays for now (Windows can not remove it)
+            if self.__remove__(source):
+                self.stats["evicted"] += 1
+
+    def __remove__(self, source):
+        """
+        Removes copy of given source file. Has to be called with lock.
+        """
+        entry = self.entries[source]
+        try:
+            (self.root / entry["file"]).unlink(missing_ok=True)
+        except OSError:
+            return False
+        del self.entries[source]
+        self.used -= entry["size"]
+        return True
+
+    def counters(self):
+        """
+        Returns copy of cache counters, pass it to report to get statistics of one run.
+
+        Returns
+        -------
+        dict
+            Counts of hits, misses, bypassed and evicted files and bytes read locally and staged.
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def report(self, since=None):
+        """
+        Returns statistics of the cache.
+
+        Parameters
+        ----------
+        since : dict, optional
+            Output of counters, statistics are computed since then. Defaults to None, since cache opening.
+
+        Returns
+        -------
+        dict
+            Counters, hit rate, bytes saved on network and current usage of cache.
+        """
+        report = self.counters()
+        if since:
+            report = {key: value - since.get(key, 0) for key, value in report.items()}
+        requests = report["hits"] + report["misses"] + report["bypassed"]
+        report["hit_rate"] = report["hits"] / requests if requests else 0.0
+        # Every hit is one read of the file which did not go over network
+        report["bytes_saved"] = report["bytes_local"]
+        with self.lock:
+            report["used_bytes"] = self.used
+            report["quota_bytes"] = self.quota
+            report["files"] = len(self.entries)
+        return report
+
+    def save(self):
+        """
+        Writes cache index. File is replaced atomically.
+        """
+        with self.lock:
+            files = dict(self.entries)
+        index = self.root / INDEX_NAME
+        tmp = index.with_name(INDEX_NAME + ".tmp")
+        with open(tmp, "w") as fout:
+            json.dump({"version": 1, "files": files}, fout)
+        os.replace(tmp, index)
+
+def format_report(report):
+    """
+    Formats cache statistics for console.
+
+    Parameters
+    ----------
+    report : dict
+        Output of StagingCache.report
+
+    Returns
+    -------
+    str
+        One line summary
+    """
+    return (f"Staging cache: {report['hits']} hits, {report['misses']} copied, {report['bypassed']} read from source, "
+            f"hit rate {report['hit_rate']*100:.0f} %, {report['bytes_saved']/1e6:.1f} MB network reads saved, "
+            f"{report['evicted']} evicted, {report['used_bytes']/1e6:.1f} of {report['quota_bytes']/1e6:.0f} MB used.")
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+standin.py: Stand-in UniCatDB server for offline tests of uploads. Serves the
+parts of UniCatDB API used by the uploader: creation, lookup and removal of
+findings and TUS upload of their attachments with creation, checksum and
+concatenation extensions. Everything is kept in memory.
+
+Run with SERVER = "local" in config:
+    python standin.py [port]
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.1.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import base64
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port of unicatdb.Servers.LOCALHOST
+DEFAULT_PORT = 5100
+
+# TUS extensions and checksum algorithms advertised by the stand-in
+TUS_EXTENSIONS = "creation,checksum,concatenation,termination"
+CHECKSUM_ALGORITHMS = {"sha1": hashlib.sha1, "sha256": hashlib.sha256, "md5": hashlib.md5}
+
+FINDINGS = re.compile(r"^/(?P<workspace>[^/]+)/findings/?$")
+FINDING = re.compile(r"^/(?P<workspace>[^/]+)/findings/(?P<finding>[^/]+)/?$")
+TUS = re.compile(r"^/(?P<workspace>[^/]+)/findings/(?P<finding>[^/]+)/attachments/tus/?(?P<upload>[^/]*)$")
+
+class StandinServer():
+    """
+    In memory stand-in of UniCatDB server running on background thread. Requests without bearer
+    token are refused as by the real server. Optional latency is added to every request to
+    mimic remote server.
+    """
+    def __init__(self, host="localhost", port=DEFAULT_PORT, latency=0.0):
+        """
+        Constructor of StandinServer class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on. Defaults to "localhost".
+        port : int, optional
+            Port to listen on, 0 picks free port. Defaults to DEFAULT_PORT (unicatdb.Servers.LOCALHOST).
+        latency : float, optional
+            Seconds added to every request. Defaults to 0.0.
+        """
+        self.latency = latency
+        # {finding id: {"workspace", "attributes", "created"}}
+        self.findings = {}
+        # {upload id: {"finding", "length", "metadata", "data", "concat"}}
+        self.uploads = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler__())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        Base url of running server.
+        """
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts serving on background thread.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes listening socket.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def attachments(self, finding_id):
+        """
+        Returns finished uploads of given finding as {file name: content}. Partial uploads of
+        concatenation are not attachments.
+        """
+        with self.lock:
+            return {upload["metadata"].get("fileName", upload_id): bytes(upload["data"])
+                    for upload_id, upload in self.uploads.items()
+                    if upload["finding"] == finding_id and upload["concat"] != "partial"
+                    and len(upload["data"]) == upload["length"]}
+
+    def summary(self):
+        """
+        Returns counts of stored findings, uploads and received requests.
+        """
+        with self.lock:
+            return {"findings": len(self.findings),
+                    "uploads": sum(1 for upload in self.uploads.values() if upload["concat"] != "partial"),
+                    "bytes": sum(len(upload["data"]) for upload in self.uploads.values() if upload["concat"] != "partial"),
+                    "requests": self.requests}
+
+    def __handler__(self):
+        """
+        Returns request handler class bound to this server.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_OPTIONS(self):
+                self.__respond__(204, {"Tus-Resumable": "1.0.0", "Tus-Version": "1.0.0", "Tus-Extension": TUS_EXTENSIONS,
+                                       "Tus-Checksum-Algorithm": ",".join(CHECKSUM_ALGORITHMS)})
+
+            def do_POST(self):
+                body = self.__begin__()
+                if body is None:
+                    return
+                match = FINDINGS.match(self.path)
+                if match:
+                    data = json.loads(body)["data"]
+                    finding_id = uuid.uuid4().hex[:24]
+                    with server.lock:
+                        server.findings[finding_id] = {"workspace": match["workspace"], "attributes": data.get("attributes"),
+                                                       "created": time.time()}
+                    self.__respond__(201, {"Content-Type": "application/vnd.api+json"},
+                                     json.dumps({"data": dict(data, id=finding_id)}).encode())
+                    return
+                match = TUS.match(self.path)
+                if not match or match["upload"]:
+                    return self.__respond__(404)
+                with server.lock:
+                    if match["finding"] not in server.findings:
+                        return self.__respond__(404)
+                concat = self.headers.get("Upload-Concat")
+                upload = {"finding": match["finding"], "metadata": self.__metadata__(), "data": bytearray(),
+                          "concat": concat.split(";")[0] if concat else None}
+                if concat and concat.startswith("final;"):
+                    # Final upload is assembled from finished partial uploads in given order
+                    with server.lock:
+                        parts = [server.uploads.get(url.rstrip("/").rsplit("/", 1)[-1]) for url in concat[6:].split()]
+                        if any(part is None or len(part["data"]) != part["length"] for part in parts):
+                            return self.__respond__(400)
+                        for part in parts:
+                            upload["data"] += part["data"]
+                    upload["length"] = len(upload["data"])
+                else:
+                    upload["length"] = int(self.headers.get("Upload-Length", 0))
+                upload_id = uuid.uuid4().hex
+                with server.lock:
+                    server.uploads[upload_id] = upload
+                host = self.headers.get("Host") or "{}:{}".format(*server.httpd.server_address[:2])
+                self.__respond__(201, {"Location": f"http://{host}{self.path.rstrip('/')}/{upload_id}", "Tus-Resumable": "1.0.0"})
+
+            def do_HEAD(self):
+                if self.__begin__() is None:
+                    return
+                upload = self.__upload__()
+                if upload is None:
+                    return self.__respond__(404)
+                self.__respond__(200, {"Upload-Offset": str(len(upload["data"])), "Upload-Length": str(upload["length"]),
+                                       "Tus-Resumable": "1.0.0", "Cache-Control": "no-store"})
+
+            def do_PATCH(self):
+                body = self.__begin__()
+                if body is None:
+                    return
+                upload = self.__upload__()
+                if upload is None:
+                    return self.__respond__(404)
+                if int(self.headers.get("Upload-Offset", -1)) != len(upload["data"]):
+                    return self.__respond__(409)
+                checksum = self.headers.get("Upload-Checksum")
+                if checksum:
+                    algorithm, _, expected = checksum.partition(" ")
+                    if algorithm not in CHECKSUM_ALGORITHMS:
+                        return self.__respond__(400)
+                    if base64.b64encode(CHECKSUM_ALGORITHMS[algorithm](body).digest()).decode() != expected:
+                        return self.__respond__(460)
+                with server.lock:
+                    upload["data"] += body
+                self.__respond__(204, {"Upload-Offset": str(len(upload["data"])), "Tus-Resumable": "1.0.0"})
+
+            def do_GET(self):
+                if self.__begin__() is None:
+                    return
+                match = FINDING.match(self.path)
+                with server.lock:
+                    finding = server.findings.get(match["finding"]) if match else None
+                    if finding is None:
+                        return self.__respond__(404)
+                    data = {"type": "findings", "id": match["finding"], "attributes": finding["attributes"]}
+                self.__respond__(200, {"Content-Type": "application/vnd.api+json"}, json.dumps({"data": data}).encode())
+
+            def do_DELETE(self):
+                if self.__begin__() is None:
+                    return
+                match = FINDING.match(self.path)
+                if match:
+                    with server.lock:
+                        found = server.findings.pop(match["finding"], None)
+                        for upload_id in [key for key, upload in server.uploads.items() if upload["finding"] == match["finding"]]:
+                            del server.uploads[upload_id]
+                    return self.__respond__(204 if found else 404)
+                match = TUS.match(self.path)
+                with server.lock:
+                    found = server.uploads.pop(match["upload"], None) if match and match["upload"] else None
+                self.__respond__(204 if found else 404, {"Tus-Resumable": "1.0.0"})
+
+            def __begin__(self):
+                """
+                Reads request body, adds latency and checks authorization. Returns None if refused.
+                """
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    self.__respond__(401)
+                    return None
+                return body
+
+            def __upload__(self):
+                """
+                Returns upload addressed by request path or None.
+                """
+                match = TUS.match(self.path)
+                with server.lock:
+                    return server.uploads.get(match["upload"]) if match and match["upload"] else None
+
+            def __metadata__(self):
+                """
+                Decodes Upload-Metadata header.
+                """
+                metadata = {}
+                for item in filter(None, (self.headers.get("Upload-Metadata") or "").split(",")):
+                    key, _, value = item.strip().partition(" ")
+                    metadata[key] = base64.b64decode(value).decode() if value else ""
+                return metadata
+
+            def __respond__(self, code, headers=None, body=b""):
+                """
+                Sends response with given headers and body.
+                """
+                self.send_response(code)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body and self.command != "HEAD":
+                    self.wfile.write(body)
+
+        return Handler
+
+if __name__ == "__main__":
+    standin = StandinServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT)
+    print(f"Stand-in UniCatDB server listens on {standin.url}, stop with Ctrl+C.")
+    try:
+        standin.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(standin.summary())
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+tus_extensions.py: Support of optional TUS protocol extensions used by the
+uploader. Discovers extensions advertised by the server and provides uploader
+sending chunk checksums (TUS checksum extension) together with file stream
+which computes file digest in the same read which feeds the upload. Retry
+delays of the uploader wake up on job cancellation.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky", "Jakub Geyer"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.2.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import base64
+import hashlib
+import io
+import time
+from urllib.parse import urljoin
+
+import requests
+from tusclient.exceptions import TusCommunicationError
+from tusclient.uploader import Uploader
+
+from cancel import Cancelled
+
+# Checksum algorithms of TUS checksum extension in order of preference
+CHECKSUM_ALGORITHMS = {
+    "sha256": hashlib.sha256,
+    "sha1": hashlib.sha1
+}
+
+def server_capabilities(tus_client):
+    """
+    Asks TUS server for supported extensions with OPTIONS request.
+
+    Parameters
+    ----------
+    tus_client : tusclient.client.TusClient
+        TUS client pointing at the server
+
+    Returns
+    -------
+    dict
+        "extensions" set of advertised extensions and "checksum_algorithms" set of supported
+        checksum algorithms. Both are empty if server does not answer.
+    """
+    capabilities = {"extensions": set(), "checksum_algorithms": set()}
+    try:
+        resp = requests.options(tus_client.url, headers=dict(Uploader.DEFAULT_HEADERS, **tus_client.headers), timeout=30)
+    except requests.exceptions.RequestException as e:
+        print("Could not obtain TUS server capabilities: " + str(e.__class__.__name__) + " " + str(e))
+        return capabilities
+    extensions = resp.headers.get("Tus-Extension", "")
+    algorithms = resp.headers.get("Tus-Checksum-Algorithm", "")
+    capabilities["extensions"] = {e.strip().lower() for e in extensions.split(",") if e.strip()}
+    capabilities["checksum_algorithms"] = {a.strip().lower() for a in algorithms.split(",") if a.strip()}
+    return capabilities
+
+def pick_checksum_algorithm(capabilities):
+    """
+    Selects checksum algorithm for chunk checksums supported by both sides.
+
+    Parameters
+    ----------
+    capabilities : dict
+        Output of server_capabilities
+
+    Returns
+    -------
+    str or None
+        Name of algorithm or None if server does not support checksum extension.
+    """
+    if "checksum" not in capabilities["extensions"]:
+        return None
+    for name in CHECKSUM_ALGORITHMS:
+        if name in capabilities["checksum_algorithms"]:
+            return name
+    return None
+
+class CancellableUploader(Uploader):
+    """
+    TUS uploader which waits between retries of failed chunk on cancel token instead of plain
+    sleep, so cancelled job does not hang for whole retry_delay * retries.
+    """
+    # Token of running job, None keeps original behavior
+    cancel = None
+
+    def _retry_or_cry(self, error):
+        if self.retries > self._retried:
+            if self.cancel is None:
+                time.sleep(self.retry_delay)
+            elif self.cancel.wait(self.retry_delay):
+                raise Cancelled()
+
+            self._retried += 1
+            try:
+                self.offset = self.get_offset()
+            except TusCommunicationError as err:
+                self._retry_or_cry(err)
+            else:
+                self._do_request()
+        else:
+            raise error
+
+class PartialUploader(CancellableUploader):
+    """
+    Uploader of one part of file (TUS concatenation extension). Server keeps partial uploads
+    until they are joined by concatenate.
+    """
+    def get_url_creation_headers(self):
+        headers = super(PartialUploader, self).get_url_creation_headers()
+        headers["upload-concat"] = "partial"
+        return headers
+
+def checksum_uploader(tus_client, file_stream, algorithm=None, cancel=None, partial=False, **kwargs):
+    """
+    Creates TUS uploader which sends Upload-Checksum header with every chunk.
+
+    Parameters
+    ----------
+    tus_client : tusclient.client.TusClient
+        TUS client prepared for target finding
+    file_stream : file-like
+        Stream of uploaded file, usually HashingReader
+    algorithm : str, optional
+        Checksum algorithm from CHECKSUM_ALGORITHMS, None disables chunk checksums. Defaults to None.
+    cancel : cancel.CancelToken, optional
+        Token which interrupts waiting between retries. Defaults to None.
+    partial : Bool, optional
+        Creates partial upload of concatenation extension, see concatenate. Defaults to False.
+    **kwargs
+        Remaining arguments of tusclient Uploader (metadata, chunk_size, retries, ...)
+
+    Returns
+    -------
+    tusclient.uploader.Uploader
+        Uploader instance
+    """
+    base = PartialUploader if partial else CancellableUploader
+    if algorithm is None:
+        uploader = base(file_stream=file_stream, client=tus_client, **kwargs)
+    else:
+        # Uploader takes checksum algorithm from class attribute
+        class ChecksumUploader(base):
+            CHECKSUM_ALGORITHM_PAIR = (algorithm, CHECKSUM_ALGORITHMS[algorithm])
+
+        uploader = ChecksumUploader(file_stream=file_stream, client=tus_client, upload_checksum=True, **kwargs)
+    uploader.cancel = cancel
+    return uploader
+
+def part_bounds(file_size, parts, chunk):
+    """
+    Splits file into given number of parts aligned to chunk size.
+
+    Parameters
+    ----------
+    file_size : int
+        Size of the file in bytes
+    parts : int
+        Requested number of parts
+    chunk : int
+        Chunk size in bytes
+
+    Returns
+    -------
+    list of tuples
+        (start, end) byte ranges of parts, fewer than requested if file has fewer chunks
+    """
+    chunks = -(-file_size // chunk)
+    parts = max(1, min(parts, chunks))
+    bounds = []
+    for part in range(parts):
+        start = chunks * part // parts * chunk
+        end = min(file_size, chunks * (part + 1) // parts * chunk)
+        bounds.append((start, end))
+    return bounds
+
+def concatenate(tus_client, urls, metadata):
+    """
+    Joins finished partial uploads into final upload (TUS concatenation extension).
+
+    Parameters
+    ----------
+    tus_client : tusclient.client.TusClient
+        TUS client of the finding
+    urls : list of str
+        Urls of partial uploads in order of their content
+    metadata : dict
+        TUS metadata of the final file (fileName, contentType)
+
+    Returns
+    -------
+    str
+        Url of final upload
+
+    Raises
+    ------
+    TusCommunicationError
+        Raises when server refuses the concatenation.
+    """
+    headers = dict(Uploader.DEFAULT_HEADERS, **tus_client.headers)
+    headers["upload-concat"] = "final;" + " ".join(urls)
+    headers["upload-metadata"] = ",".join(f"{key} " + base64.b64encode(str(value).encode("utf-8")).decode("ascii")
+                                          for key, value in metadata.items())
+    try:
+        resp = requests.post(tus_client.url, headers=headers, timeout=60)
+    except requests.exceptions.RequestException as e:
+        raise TusCommunicationError(str(e))
+    url = resp.headers.get("location")
+    if resp.status_code >= 300 or url is None:
+        raise TusCommunicationError(f"Concatenation of partial uploads failed with status {resp.status_code}",
+                                    resp.status_code, resp.content)
+    return urljoin(tus_client.url, url)
+
+class SliceReader(io.RawIOBase):
+    """
+    Read only view of byte range of seekable stream, positions are relative to start of the range.
+    Every part of parallel upload reads through its own stream.
+    """
+    def __init__(self, stream, start, end):
+        """
+        Constructor of SliceReader class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        stream : file-like
+            Seekable binary stream of whole file
+        start : int
+            First byte of the range
+        end : int
+            End of the range (exclusive)
+        """
+        super(SliceReader, self).__init__()
+        self.stream = stream
+        self.start = start
+        self.end = end
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            offset += self.end - self.start
+        elif whence == io.SEEK_CUR:
+            offset += self.position
+        self.position = max(0, min(offset, self.end - self.start))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        remaining = self.end - self.start - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        self.stream.seek(self.start + self.position)
+        data = self.stream.read(size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+class HashingReader(io.RawIOBase):
+    """
+    Read only file stream which feeds digest of the whole file with bytes read by uploader.
+    Chunks read again (on retries) are not hashed twice, so digest is complete after single
+    pass over the file without any extra reading.
+    """
+    def __init__(self, stream, algorithm="sha256"):
+        """
+        Constructor of HashingReader class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        stream : file-like
+            Seekable binary stream of uploaded file
+        algorithm : str, optional
+            Name of hashlib algorithm used for file digest. Defaults to "sha256".
+        """
+        super(HashingReader, self).__init__()
+        self.stream = stream
+        self.algorithm = algorithm
+        self.hash = hashlib.new(algorithm)
+        # Position up to which the file has been hashed
+        self.hashed = 0
+        # Set when reading skipped part of the file, digest would be wrong
+        self.broken = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.stream.seek(offset, whence)
+
+    def tell(self):
+        return self.stream.tell()
+
+    def read(self, size=-1):
+        position = self.stream.tell()
+        data = self.stream.read(size)
+        end = position + len(data)
+        if position > self.hashed:
+            self.broken = True
+        elif end > self.hashed:
+            self.hash.update(memoryview(data)[self.hashed - position:])
+            self.hashed = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self, size):
+        """
+        Returns digest of the file if it was read completely.
+
+        Parameters
+        ----------
+        size : int
+            Size of the file in bytes
+
+        Returns
+        -------
+        str or None
+            Hex digest of file or None if file was not read completely in one pass.
+        """
+        if self.broken or self.hashed != size:
+            return None
+        return self.hash.hexdigest()
@@ -31,7 +31,7 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky", "Jakub Geyer"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.1.2"
+__version__ = "1.16.3"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
@@ -40,26 +40,45 @@ __python__ = "3.8.0"
 
 # Import required libs
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from pathlib import Path
-import numpy as np
+import io
 import json
+import threading
+import time
 
 from uploader_frame import ConnectorFrame, dtformating
-from dataprocess import resolve_path
+from cancel import Cancelled
+from dedup import Deduplicator, report_duplicates
+from instrumentation import record
+from dataprocess import resolve_path, group_size, group_key
+from progress import ByteProgress
+from staging import open_cache, format_report
+from ratelimit import shared_limiter, format_report as format_bandwidth
+from metrics import UploadMetrics
+from ledger import FindingLedger, reconcile
+from preloadstore import PreloadStore, is_store, load_groups
+from tus_extensions import server_capabilities, pick_checksum_algorithm, checksum_uploader, HashingReader, SliceReader, \
+    part_bounds, concatenate
 
 import unicatdb
 from unicatdb.openapi_client import FindingSingleResponse, FindingResourceObject, \
     NewFindingRequestBody, RelationshipResourceIdentifier, ResponseRelationshipOneToOne, \
     FindingResourceObjectRelationships, TaxonomyName, Finding
+from unicatdb.openapi_client.exceptions import ApiException
 from pprint import pprint
 
 # Check if uploader frame has correct version
 from uploader_frame import __version__ as __upv__
 from version_check import check_version
-check_version(__upv__, [1, 0, 2], "uploader_frame.py")
+check_version(__upv__, [1, 0, 10], "uploader_frame.py")
+from tus_extensions import __version__ as __tusv__
+check_version(__tusv__, [1, 2, 0], "tus_extensions.py")
 
-# Global for interupting the script
-BREAK = False
+# workspace ID
+WORKSPACE_ID = "62435c37272ae85863de4758"
+# ID of schema 'Seed'
+SCHEMA_ID = "62d1defa50d7c51fb431dba0"
 
 # Connector class
 class Connector(ConnectorFrame):
@@ -74,11 +93,30 @@ class Connector(ConnectorFrame):
         """
         # init parent
         super(Connector, self).__init__()
+        # Metrics of uploads done by this connector, reset on each commit_all
+        self.metrics = UploadMetrics()
+        # Optional lossless recompression stage, active only during run
+        self.recompressor = None
+        # Optional local staging cache of images on network share and its counters at run start
+        self.staging = None
+        self.staging_since = None
+        # Bandwidth limiter shared by all uploads and its counters at run start
+        self.limiter = None
+        self.limiter_since = None
+        # Findings of upcoming groups created ahead {group key: future}, pool creating them and ledger of the run
+        self.findings_ahead = {}
+        self.finding_pool = None
+        self.ledger = None
+        # TUS extensions advertised by server, asked once on first upload
+        self.tus_capabilities = None
+        # Cancel token of current run, checked before each finding and chunk
+        self.cancel = None
 
     def commit_one_group(self, group, uploaderhandler=None, consolecall=False, chunk=unicatdb.Constants.DEFAULT_CHUNK_SIZE):
         """
         Commits one finding for given json data. List of findings should use
-        commit_all method, here it will end in an exception.
+        commit_all method, here it will end in an exception. Finding created ahead by
+        prepare_group is used if there is one.
 
         Parameters
         ----------
@@ -95,131 +133,382 @@ class Connector(ConnectorFrame):
 
         Returns
         -------
-        None.
+        Bool
+            True if finding of the group was created and all its files were uploaded. Errors are
+            printed and recorded in metrics of the run, group which failed is not complete.
+
+        Raises
+        ------
+        Cancelled
+            Raises when cancel token of current run gets cancelled.
 
         """
         # Check if uploadhandler has been specified
         if not uploaderhandler:
             uploaderhandler = self.__dummy_uploadhandler__
+        # If by some reason empty group gets here, it gets skipped instead of killing process!
+        if not group:
+            return True
+        try:
+            ahead = self.findings_ahead.pop(group_key(group), None)
+            finding_id = ahead.result() if ahead else self.create_finding(group, consolecall)
+        except Exception as e:
+            # add custom error handling code her
+            print("Error occured when insering new finding: " + str(e.__class__.__name__) + " " + e.__str__())
+            return False
+
+        # Upload image and meta data
+        try:
+            with unicatdb.Client(self.config) as client:
+                # get prepared TUS protocol for uplading files
+                tus_client = client.get_tus_client_for_finding(WORKSPACE_ID, finding_id)
+                for data in group:
+                    # Recompressed copy of image is uploaded under the original file name if available
+                    source = self.recompressor.get(data['img_path']) if self.recompressor else data['img_path']
+                    # Image already read by data processing (Keyence in All-in-One) is uploaded from memory
+                    buffer = data.pop('img_buffer', None)
+                    # Image from network share is read from local staging cache
+                    if self.staging and buffer is None and source == data['img_path']:
+                        source = self.staging.stage(source)
+                    # Uploads the entire image file chunk by chunk, progress is reported to uploaderhandler
+                    try:
+                        self.upload_file(tus_client, source,
+                                         metadata={
+                                             "fileName": data['img_path'].split('/')[-1],
+                                             "contentType": "image/"+data['img_path'].split(".")[-1]
+                                         },
+                                         chunk=chunk, finding_id=finding_id, uploaderhandler=uploaderhandler,
+                                         origin_path=data['img_path'],
+                                         buffer=buffer if source == data['img_path'] else None)
+                    finally:
+                        if self.recompressor:
+                            self.recompressor.release(data['img_path'])
+                    # Check if img and meta are the same - keyence method, in that case dont upload tif twice.
+                    if data["img_path"] != data['meta_path']:
+                        tus_client = client.get_tus_client_for_finding(WORKSPACE_ID, finding_id)
+                        self.upload_file(tus_client, data['meta_path'],
+                                         metadata={
+                                             "fileName": data['meta_path'].split('/')[-1],
+                                             "contentType": "text/"+data['meta_path'].split(".")[-1]
+                                         },
+                                         chunk=chunk, finding_id=finding_id)
+            if self.ledger:
+                self.ledger.completed(finding_id)
+
+        except Exception as e:
+            print("Error occured when uploading: " + str(e.__class__.__name__) + " " + e.__str__())
+            return False
+        return True
+
+    def create_finding(self, group, consolecall=False):
+        """
+        Creates finding of given group in Seed schema and records it in finding ledger of the run.
+
+        Parameters
+        ----------
+        group : list of dicts
+            Group of processed images with resolved paths.
+        consolecall : Bool, optional
+            Toggles print of created finding. Defaults to False.
+
+        Returns
+        -------
+        str
+            ID of created finding
+
+        Raises
+        ------
+        Cancelled
+            Raises when cancel token of current run gets cancelled.
+        """
         # Get common data from group for entire upload
+        data = group[0]
+        # Create a new finding in defined schema'
+        new_finding = Finding(
+            document_name=data["species_name"],
+            amount=len(group),
+            document_set=self.setup["document_set"],
+            date=self.setup['date'].split("T")[0],
+            person=data["user"] if "user" in data.keys() else "Raw Script",
+            location_description=self.setup["loc_desc"],
+            location_gps_point=None,
+            location_gps_area=None,
+            note=self.setup["note"] if self.setup["note"] != None else "Automatic script upload",
+            tags=self.setup["tags"] if self.setup["tags"] != None else data["species_name"].split(" "),
+            taxonomy_human_readable=data["species_name"],
+            taxonomy_name=(TaxonomyName(
+                kingdom=None,
+                phylum=None,
+                _class=None,
+                order=None,
+                family=None,
+                genus=None,
+                species=None,
+                authorship=None
+            )),
+            attachment_note="Automatic script upload",
+            dynamic_data=({
+                "number-1657784374772-average-max-lenght-m": self.get_average_length(group),
+                "select-1658738801093-type": self.setup['type'],
+                "text-1657785026284-collection-organization": self.setup['organization'],
+                "text-1657784892422-internal-number": self.get_internal_number(data['species_name']),
+                "number-1657784595002-shape-number-by": -1,
+                "nested-1657785596588-imagemetadata": self.create_dynamic_group(group)
+            })
+        )
+        # assign to schema
+        new_finding_relationships = FindingResourceObjectRelationships(
+            schema=(ResponseRelationshipOneToOne(
+                data=(RelationshipResourceIdentifier(
+                    type="schemas",
+                    id=SCHEMA_ID
+                ))
+            ))
+        )
+        # construct request payload
+        create_finding_request = NewFindingRequestBody(data=(
+            FindingResourceObject(
+                type="findings",
+                attributes=new_finding,
+                relationships=new_finding_relationships
+            )
+        ))
+
+        # Do not create new finding for cancelled job
+        if self.cancel:
+            self.cancel.check()
+        start = time.perf_counter()
         try:
-            data = group[0]
-            # Create a new finding in defined schema'
+            # insert new finding (make POST API call with request payload)
             with unicatdb.Client(self.config) as client:
-                new_finding = Finding(
-                    document_name=data["species_name"],
-                    amount=len(group),
-                    document_set=self.setup["document_set"],
-                    date=self.setup['date'].split("T")[0],
-                    person=data["user"] if "user" in data.keys() else "Raw Script",
-                    location_description=self.setup["loc_desc"],
-                    location_gps_point=None,
-                    location_gps_area=None,
-                    note=self.setup["note"] if self.setup["note"] != None else "Automatic script upload",
-                    tags=self.setup["tags"] if self.setup["tags"] != None else data["species_name"].split(" "),
-                    taxonomy_human_readable=data["species_name"],
-                    taxonomy_name=(TaxonomyName(
-                        kingdom=None,
-                        phylum=None,
-                        _class=None,
-                        order=None,
-                        family=None,
-                        genus=None,
-                        species=None,
-                        authorship=None
-                    )),
-                    attachment_note="Automatic script upload",
-                    dynamic_data=({
-                        "number-1657784374772-average-max-lenght-m": self.get_average_length(group),
-                        "select-1658738801093-type": self.setup['type'],
-                        "text-1657785026284-collection-organization": self.setup['organization'],
-                        "text-1657784892422-internal-number": self.get_internal_number(data['species_name']),
-                        "number-1657784595002-shape-number-by": -1,
-                        "nested-1657785596588-imagemetadata": self.create_dynamic_group(group)
-                    })
-                )
-                # assign to schema
-                new_finding_relationships = FindingResourceObjectRelationships(
-                    schema=(ResponseRelationshipOneToOne(
-                        data=(RelationshipResourceIdentifier(
-                            type="schemas",
-                            id="62d1defa50d7c51fb431dba0"     # ID of schema 'Seed'
-                        ))
-                    ))
+                insert_result: FindingSingleResponse = client.findings.api_findings_post(
+                    WORKSPACE_ID,
+                    new_finding_request_body=create_finding_request
                 )
-                # construct request payload
-                create_finding_request = NewFindingRequestBody(data=(
-                    FindingResourceObject(
-                        type="findings",
-                        attributes=new_finding,
-                        relationships=new_finding_relationships
-                    )
-                ))
-                #print(create_finding_request)
-                # workspace ID
-                workspace_id = "62435c37272ae85863de4758"
+        except Exception as e:
+            self.metrics.finding(time.perf_counter() - start, error=e)
+            record("finding", time.perf_counter() - start, failed=True)
+            raise
+        finding_id = insert_result.data.id
+        self.metrics.finding(time.perf_counter() - start, finding_id=finding_id)
+        record("finding", time.perf_counter() - start)
+        if self.ledger:
+            self.ledger.created(finding_id, group_key(group), WORKSPACE_ID)
+        # pretty-print inserterted finding
+        if consolecall:
+            pprint(insert_result)
+        return finding_id
+
+    def delete_finding(self, workspace_id, finding_id):
+        """
+        Deletes finding from database, used to clean up findings which did not get their files.
 
-                # Commit finding
-                try:
-                    # insert new finding (make POST API call with request payload)
-                    insert_result: FindingSingleResponse = client.findings.api_findings_post(
-                        workspace_id,
-                        new_finding_request_body=create_finding_request
-                    )
+        Parameters
+        ----------
+        workspace_id : str
+            Workspace of the finding
+        finding_id : str
+            ID of the finding
 
-                    # pretty-print inserterted finding
-                    if consolecall:
-                        pprint(insert_result)
+        Returns
+        -------
+        Bool
+            True if the finding was deleted or does not exist anymore.
+        """
+        try:
+            with unicatdb.Client(self.config) as client:
+                client.findings.api_findings_delete_by_id(workspace_id, finding_id)
+        except ApiException as e:
+            if e.status != 404:
+                print(f"Finding {finding_id} could not be deleted: " + str(e.__class__.__name__) + " " + str(e).strip())
+                return False
+        except Exception as e:
+            print(f"Finding {finding_id} could not be deleted: " + str(e.__class__.__name__) + " " + str(e))
+            return False
+        if self.ledger:
+            self.ledger.deleted(finding_id)
+        return True
+
+    def reconcile_findings(self, dry_run=False, consolecall=False):
+        """
+        Deletes findings which interrupted or failed runs left without all their files, see ledger.reconcile.
 
-                except Exception as e:
-                    # add custom error handling code her
-                    print("Error occured when insering new finding: " + str(e.__class__.__name__) + " " + e.__str__())
+        Parameters
+        ----------
+        dry_run : Bool, optional
+            Only counts pending findings. Defaults to False.
+        consolecall : Bool, optional
+            Toggles console prints of deleted findings. Defaults to False.
 
-                # Upload image and meta data
-                try:
-                    finding_id = insert_result.data.id
-
-                    # get prepared TUS protocol for uplading files
-                    tus_client = client.get_tus_client_for_finding(workspace_id, finding_id)
-                    # File size
-                    for data in group:
-                        file_size = Path(data['img_path']).stat().st_size
-                        #data['meta_path'] = data['meta_path'].as_posix()
-                        # Number of chunks
-                        nr_chunks = -(-file_size // chunk)
-                        # create uploader for our file, don't forget to provide required metadata
-                        uploader = tus_client.uploader(
-                            data['img_path'],
-                            metadata={
-                                "fileName": data['img_path'].split('/')[-1],
-                                "contentType": "image/"+data['img_path'].split(".")[-1]
-                            },
-                            chunk_size=chunk,   # set chunk size in Bytes (1MB is the default)
-                            log_func= lambda msg: uploaderhandler(msg, file_size, chunk=chunk, nr_chunks=nr_chunks) ## print the progress to console or to GUI upload handler
-                        )
-                        # Uploads the entire image file and meta data
-                        # This uploads chunk by chunk.
-                        uploader.upload()
-                        # create uploader for our file, don't forget to provide required metadata
-                        # Check if img and meta are the same - keyence method, in that case dont upload tif twice.
-                        if data["img_path"] != data['meta_path']:
-                            tus_client = client.get_tus_client_for_finding(workspace_id, finding_id)
-                            uploader = tus_client.uploader(
-                                data['meta_path'],
-                                metadata={
-                                    "fileName": data['meta_path'].split('/')[-1],
-                                    "contentType": "text/"+data['meta_path'].split(".")[-1]
-                                },
-                                chunk_size=chunk   # set chunk size in Bytes (1MB is the default)
-                                )
-                            # Uploads the entire image file and meta data
-                            # This uploads chunk by chunk.
-                            uploader.upload()
+        Returns
+        -------
+        dict
+            Counts of pending, deleted and failed findings and skipped ledgers of running uploads
+        """
+        if not self.setup["finding_ledger"]:
+            return {"pending": 0, "deleted": 0, "failed": 0, "running": 0}
+        return reconcile(resolve_path(self.setup["finding_ledger"]), self.delete_finding, dry_run=dry_run,
+                         consolecall=consolecall)
 
-                except Exception as e:
-                    print("Error occured when uploading: " + str(e.__class__.__name__) + " " + e.__str__())
-        except IndexError:
-            pass # If by some reason empty group gets here, it gets skipped instead of killing process!
+    def upload_file(self, tus_client, path, metadata, chunk=unicatdb.Constants.DEFAULT_CHUNK_SIZE, finding_id=None, uploaderhandler=None,
+                    origin_path=None, buffer=None):
+        """
+        Uploads one file with TUS protocol chunk by chunk. Each chunk is timed and recorded in
+        upload metrics together with its retries. Progress is reported to uploaderhandler with
+        the same messages as TUS log does. SHA-256 digest of the file is computed while uploading
+        and stored in metrics, chunks carry checksum header when server supports it. Large files
+        are sent as parallel partial uploads joined by server if enabled in config and supported
+        by server (TUS concatenation extension).
+
+        Parameters
+        ----------
+        tus_client : tusclient.client.TusClient
+            TUS client prepared for target finding
+        path : str
+            Path to file which should be uploaded
+        metadata : dict
+            TUS metadata of the file (fileName, contentType)
+        chunk : int, optional
+            Size of chunks which should be uploaded. Defaults to 1MB
+        finding_id : str, optional
+            ID of finding the file belongs to, used in metrics. Defaults to None.
+        uploaderhandler : method, optional
+            Method of uploader progress report. Defaults to None
+        origin_path : str, optional
+            Original path of the file if path points to its replacement (e.g. recompressed copy).
+            Used in metrics. Defaults to None.
+        buffer : bytes, optional
+            Content of the file if it has already been read. Uploaded instead of reading path again.
+            Defaults to None.
+
+        Returns
+        -------
+        None.
+        """
+        try:
+            file_size = Path(path).stat().st_size if buffer is None else len(buffer)
+        except OSError as e:
+            # File missing at upload is failed file of the run as well
+            self.metrics.end_file(self.metrics.start_file(origin_path or path, 0, finding_id=finding_id), error=e)
+            record("upload", failed=True)
+            raise
+        # Number of chunks
+        nr_chunks = -(-file_size // chunk)
+        # Send chunk checksums only if server advertises checksum extension
+        if self.tus_capabilities is None:
+            self.tus_capabilities = server_capabilities(tus_client)
+        algorithm = pick_checksum_algorithm(self.tus_capabilities) if self.setup["upload_checksum"] else None
+        file_record = self.metrics.start_file(origin_path or path, file_size, finding_id=finding_id, chunk_checksum=algorithm)
+        # Parts of parallel upload report progress of the whole file
+        progress = {"sent": 0, "lock": threading.Lock()}
+        def report(nbytes):
+            if uploaderhandler:
+                with progress["lock"]:
+                    progress["sent"] += nbytes
+                    uploaderhandler(f"{progress['sent']} bytes uploaded ...", file_size, chunk=chunk, nr_chunks=nr_chunks)
+        try:
+            bounds = self.__parts__(file_size, chunk)
+            part_digests = None
+            if len(bounds) > 1:
+                # Parts are read at once, whole file digest would need another pass, digests of parts are recorded instead
+                digest = None
+                part_digests = self.__upload_parts__(tus_client, path, buffer, metadata, chunk, bounds, algorithm,
+                                                     file_record, report)
+            else:
+                with (open(path, "rb") if buffer is None else io.BytesIO(buffer)) as stream:
+                    # File digest is computed from the same reads which feed the upload
+                    reader = HashingReader(stream)
+                    # create uploader for our file, don't forget to provide required metadata
+                    uploader = checksum_uploader(
+                        tus_client,
+                        reader,
+                        algorithm,
+                        metadata=metadata,
+                        chunk_size=chunk,   # set chunk size in Bytes (1MB is the default)
+                        retries=self.setup["upload_retries"],
+                        retry_delay=self.setup["upload_retry_delay"],
+                        cancel=self.cancel
+                    )
+                    # Upload url has to exist even for empty files
+                    if not uploader.url:
+                        uploader.set_url(uploader.create_url())
+                        uploader.offset = 0
+                    self.__send__(uploader, file_size, chunk, file_record, report)
+                digest = reader.hexdigest(file_size)
+            if uploaderhandler:
+                uploaderhandler(f"maximum upload specified({file_size} bytes) has been reached", file_size, chunk=chunk, nr_chunks=nr_chunks)
+        except (Exception, Cancelled) as e:
+            self.metrics.end_file(file_record, error=e)
+            if not isinstance(e, Cancelled):
+                record("upload", failed=True)
+            raise
+        self.metrics.end_file(file_record, digest=digest, part_digests=part_digests)
+
+    def __send__(self, uploader, size, chunk, file_record, report, stop=None):
+        """
+        Uploads chunks of prepared TUS uploader until size is reached, or stop event is set by
+        failure of other part of the same file.
+        """
+        while uploader.offset < size:
+            if self.cancel:
+                self.cancel.check()
+            if stop is not None and stop.is_set():
+                return
+            offset = uploader.offset
+            # Waiting for bandwidth limit is not part of chunk latency
+            if self.limiter:
+                self.limiter.acquire(min(chunk, size - offset), self.cancel)
+            start = time.perf_counter()
+            uploader.upload_chunk()
+            # Uploader counts retries of the last chunk
+            seconds = time.perf_counter() - start
+            self.metrics.chunk(file_record, uploader.offset - offset, seconds, retries=uploader._retried)
+            record("upload", seconds, nbytes=uploader.offset - offset)
+            report(uploader.offset - offset)
+
+    def __parts__(self, file_size, chunk):
+        """
+        Returns byte ranges of parallel parts of file, single range if file is uploaded sequentially.
+        """
+        parts = self.setup["parallel_upload_parts"]
+        if parts <= 1 or file_size < self.setup["parallel_upload_min"] * 1000000:
+            return [(0, file_size)]
+        # Server without concatenation extension gets sequential upload
+        if "concatenation" not in self.tus_capabilities["extensions"]:
+            return [(0, file_size)]
+        return part_bounds(file_size, parts, chunk)
+
+    def __upload_parts__(self, tus_client, path, buffer, metadata, chunk, bounds, algorithm, file_record, report):
+        """
+        Uploads byte ranges of file as parallel partial uploads and joins them into final upload
+        with given metadata. Every part is hashed from the same reads which feed its upload.
+
+        Returns
+        -------
+        list
+            (start, end, SHA-256 hex digest) of every part, digest is None if part was not read in one pass
+        """
+        stop = threading.Event()
+        def part(start, end):
+            with (open(path, "rb") if buffer is None else io.BytesIO(memoryview(buffer)[start:end])) as stream:
+                reader = HashingReader(SliceReader(stream, start, end) if buffer is None else SliceReader(stream, 0, end - start))
+                # Partial uploads carry no metadata, they are not attachments until joined
+                uploader = checksum_uploader(tus_client, reader, algorithm, partial=True, chunk_size=chunk,
+                                             retries=self.setup["upload_retries"],
+                                             retry_delay=self.setup["upload_retry_delay"], cancel=self.cancel)
+                uploader.set_url(uploader.create_url())
+                uploader.offset = 0
+                self.__send__(uploader, end - start, chunk, file_record, report, stop)
+                return uploader.url, reader.hexdigest(end - start)
+        with ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+            parts = [pool.submit(part, start, end) for start, end in bounds]
+            # Failure of one part stops the others
+            wait(parts, return_when=FIRST_EXCEPTION)
+            if any(future.done() and future.exception() is not None for future in parts):
+                stop.set()
+            results = [future.result() for future in parts]
+        concatenate(tus_client, [url for url, _ in results], metadata)
+        return [(start, end, digest) for (start, end), (_, digest) in zip(bounds, results)]
 
     def get_internal_number(self, species):
         """Gets internal number from setup (config) for given seed. If no internal number is known,
@@ -312,79 +601,257 @@ class Connector(ConnectorFrame):
             y_length.append(data['y_length'])
 
         # Always get the highest value
-        length_out = np.max([np.mean(x_length), np.mean(y_length)])
+        length_out = max(sum(x_length) / len(x_length), sum(y_length) / len(y_length))
         return length_out
 
-    def commit_all(self, PATH_TO_JSON, user="Test Script in uploader", progresshandler=None, uploaderhandler=None, consolecall=None):
+    def commit_all(self, PATH_TO_JSON, user="Test Script in uploader", progresshandler=None, uploaderhandler=None, consolecall=None,
+                   metricshandler=None, report_path=None, etahandler=None, cancel=None, completed=None, grouphandler=None,
+                   select=None):
         """
         Commits all files preloaded in given json to database. Commits uploads group by group.
-        Tries to finish running upload even on interrupt.
+        Cancellation stops before next finding or chunk, interrupted file is recorded in metrics.
+        Upload status of every image is recorded if data are read from preload store.
 
         Parameters
         ----------
         PATH_TO_JSON : str
-            String path to json with preprocessed data. Will be translated to Pathlib.Path.
+            String path to json or preload store (.sqlite) with preprocessed data. Will be translated to Pathlib.Path.
         user : str, optional
             User name who commits current batch to DB for easy fail detection and rollbacks.
             Defaults to "Test Script".
         progresshandler : method, optional
-            Handler for attached GUI of its progressbar. Defaults to None.
+            Handler for attached GUI of its progressbar. Progress is weighted by uploaded bytes.
+            First call comes with ct_max None while paths are resolved. Defaults to None.
         uploaderhandler : method, optional
             Handler for attached GUI of its uploadbar. Defaults to None.
         consolecall : bool, optional
             Bool trigger for console prints for easier debugging. Defaults to False
+        metricshandler : method, optional
+            Callback receiving upload metrics events, see metrics.UploadMetrics. Defaults to None.
+        report_path : str, optional
+            Path where run report should be saved (.json or .csv). Defaults to UPLOAD_REPORT from config.
+        etahandler : method, optional
+            Handler receiving progress state with ETA, current rate and remaining bytes.
+            See progress.ByteProgress.state. Defaults to None.
+        cancel : cancel.CancelToken, optional
+            Token which stops the upload. Defaults to None.
+        completed : set, optional
+            Keys of groups uploaded by interrupted run which should be skipped, see dataprocess.group_key.
+            Defaults to None.
+        grouphandler : method, optional
+            Handler called with key and data of every completely uploaded group. Defaults to None.
+        select : dict, optional
+            Uploads only images matching filters of preloadstore.PreloadStore.groups, e.g.
+            {"species": "Ajuga reptans", "status": "pending"}. Defaults to None, all images.
 
         Returns
         -------
-        None.
+        dict
+            Summary of upload metrics for this run. Contains aborted with the error if upload stopped
+            on unexpected error.
 
         """
-        # Global for interrupts
-        global BREAK
-
-        # Resolve paths for uploads
-        PATH = resolve_path(PATH_TO_JSON).resolve()
-        PARENT = PATH.parent
-
-        # Load preprocessed data stored in JSON
-        with open(PATH, "r") as f:
-            file = json.loads(f.read())
-
-        # Get amount of files to process for progression bar vizualization
-        progress_counter_max = sum([len(listElem) for listElem in file])+1
-        progress_counter = 0
-
-        if progresshandler:
-            progresshandler(progress_counter, ct_max=progress_counter_max)
-
-        for group in file:
-            if BREAK:
-                break
-            try:
+        # Fresh metrics and upload stages for this run
+        self.start_run(metricshandler, cancel)
+        # Run report, ledger and stages are closed even if preload data can not be loaded or the loop fails
+        try:
+            # Total is not known until all files are resolved, let GUI show indeterminate progress
+            if progresshandler:
+                progresshandler(0)
+
+            # Resolve paths for uploads
+            PATH = resolve_path(PATH_TO_JSON).resolve()
+            PARENT = PATH.parent
+
+            # Load preprocessed data stored in JSON or preload store, store selects images by its indexes
+            file = load_groups(PATH, **(select or {}))
+            store = PreloadStore(PATH) if is_store(PATH) else None
+            # Image paths as stored, upload status is recorded under them
+            stored = {}
+
+            # Resolve path for payload
+            for group in file:
                 for pair in group:
-                    # Resolve path for payload
+                    stored_path = pair['img_path']
                     if not Path(pair['img_path']).is_absolute():
                         abspath = PARENT / Path(pair['img_path'])
                         pair['img_path'] = abspath.as_posix()
                     if not Path(pair['meta_path']).is_absolute():
                         abspath = PARENT / Path(pair['meta_path'])
                         pair['meta_path'] = abspath.as_posix()
+                    stored[pair['img_path']] = stored_path
 
                     pair['user'] = user
-                # Upload all elements one by one
-                self.commit_one_group(group, uploaderhandler)
-                # increment loop and progress bar
-                progress_counter += len(group)
-                if progresshandler:
-                    progresshandler(progress_counter, ct_max=progress_counter_max)
-
-            except Exception as e:
-                print("Undefined Error in commit all occured:" + str(e.__class__.__name__) + " " + e.__str__())
-                break
-        print("All data have been uploaded.")
-        BREAK = False
-        if progresshandler:
-            progresshandler(progress_counter, ct_max=progress_counter_max, finished=True)
+
+            # Same image may be preloaded more times (e.g. copied species folder), upload it only once
+            if self.setup["dedup"]:
+                dedup_path = resolve_path(self.setup["dedup_store"]) if self.setup["dedup_store"] else None
+                file, found = Deduplicator(dedup_path).filter_groups(file, key=lambda pair: pair['img_path'])
+                report_duplicates(found)
+                file = [group for group in file if group]
+
+            # Groups uploaded by interrupted run are skipped
+            if completed:
+                file = [group for group in file if not group or group_key(group) not in completed]
+
+            # Get amount of bytes to upload for progression bar vizualization
+            sizes = [group_size([[pair['img_path'], pair['meta_path']] for pair in group]) for group in file]
+            progress = ByteProgress({"upload": sum(sizes)}, progresshandler=progresshandler, etahandler=etahandler)
+            progress.notify()
+
+            # Groups are prepared (findings created, recompressed) up to FINDING_WINDOW groups ahead while current one is uploading
+            window = max(1, self.setup["finding_window"])
+            prepared = 0
+            for pos, group in enumerate(file):
+                try:
+                    while prepared < min(len(file), pos + 1 + window):
+                        self.prepare_group(file[prepared])
+                        prepared += 1
+                    # Upload all elements one by one
+                    start = time.perf_counter()
+                    uploaded = self.commit_one_group(group, uploaderhandler)
+                    if isinstance(store, PreloadStore):
+                        self.__mark_stored__(store, group, stored)
+                    # Only complete group is checkpointed, resumed run uploads failed one again
+                    if grouphandler and group and uploaded:
+                        grouphandler(group_key(group), group)
+                    # increment progress bar
+                    progress.advance("upload", sizes[pos], time.perf_counter() - start)
+
+                except Cancelled:
+                    print("Upload has been stopped.")
+                    break
+                except Exception as e:
+                    print("Undefined Error in commit all occured:" + str(e.__class__.__name__) + " " + e.__str__())
+                    # Run broke off before all groups were uploaded, callers find the error in summary and report
+                    self.metrics.section("aborted", str(e.__class__.__name__) + " " + e.__str__())
+                    break
+            else:
+                print("All data have been uploaded.")
+            if self.staging:
+                print(format_report(self.staging.report(self.staging_since)))
+            if self.limiter:
+                print(format_bandwidth(self.limiter.report(self.limiter_since)))
+        finally:
+            summary = self.finish_run(report_path)
+        progress.notify(finished=True)
+        return summary
+
+    def __mark_stored__(self, store, group, stored):
+        """
+        Records upload status of images of uploaded group in preload store. Image failed if it
+        was not uploaded (e.g. its finding was not created) or upload of image or its meta data failed.
+        """
+        with self.metrics.lock:
+            records = {record["path"]: record for record in self.metrics.files}
+        for data in group:
+            img = records.get(data['img_path'])
+            meta = records.get(data['meta_path']) if data['meta_path'] != data['img_path'] else None
+            error = "Not uploaded" if img is None else img["error"] or (meta and meta["error"])
+            if error:
+                store.mark(stored[data['img_path']], "failed", finding_id=img and img["finding_id"], error=error)
+            else:
+                store.mark(stored[data['img_path']], "uploaded", finding_id=img["finding_id"], sha256=img["sha256"])
+
+    def start_run(self, metricshandler=None, cancel=None):
+        """
+        Starts fresh upload metrics for new run, pre-upload stages enabled in config and
+        accounting of bandwidth limit.
+
+        Parameters
+        ----------
+        metricshandler : method, optional
+            Callback receiving upload metrics events, see metrics.UploadMetrics. Defaults to None.
+        cancel : cancel.CancelToken, optional
+            Token checked before each finding and chunk of this run. Defaults to None.
+        """
+        self.metrics = UploadMetrics(metricshandler)
+        self.cancel = cancel
+        if self.setup["recompress"]:
+            # OpenCV is needed only for recompression
+            from recompress import Recompressor
+            self.recompressor = Recompressor(self.setup["recompress"], workers=self.setup["recompress_workers"])
+        if self.setup["staging_dir"]:
+            self.staging = open_cache(self.setup["staging_dir"], self.setup["staging_quota"])
+            self.staging_since = self.staging.counters()
+        self.limiter = shared_limiter(self.setup["upload_limit"], self.setup["upload_limit_schedule"],
+                                      resolve_path(self.setup["upload_limit_file"]) if self.setup["upload_limit_file"] else None)
+        self.limiter_since = self.limiter.counters()
+        if self.setup["finding_ledger"]:
+            # Findings left without files by interrupted runs are removed before new ones get created
+            if self.setup["reconcile_findings"]:
+                reconciled = self.reconcile_findings()
+                if reconciled["deleted"] or reconciled["failed"]:
+                    print(f"Deleted {reconciled['deleted']} findings left without files by interrupted runs, "
+                          f"{reconciled['failed']} could not be deleted.")
+            self.ledger = FindingLedger(resolve_path(self.setup["finding_ledger"]))
+        if self.setup["finding_window"] > 0:
+            self.finding_pool = ThreadPoolExecutor(max_workers=self.setup["finding_window"])
+
+    def prepare_group(self, group):
+        """
+        Starts pre-upload stages for given group in background so they are ready once
+        the group gets uploaded.
+
+        Parameters
+        ----------
+        group : list of dicts
+            Group of processed images with resolved paths.
+        """
+        if self.recompressor:
+            self.recompressor.submit(group)
+        # Finding is created while previous groups upload, creation errors surface in commit_one_group
+        if self.finding_pool and group and group_key(group) not in self.findings_ahead:
+            self.findings_ahead[group_key(group)] = self.finding_pool.submit(self.create_finding, group)
+
+    def finish_run(self, report_path=None):
+        """
+        Closes pre-upload stages and metrics of current run and saves run report if requested.
+
+        Parameters
+        ----------
+        report_path : str, optional
+            Path where run report should be saved (.json or .csv). Defaults to UPLOAD_REPORT from config.
+
+        Returns
+        -------
+        dict
+            Summary of upload metrics for this run.
+        """
+        self.__discard_ahead__()
+        if self.ledger:
+            self.ledger.close()
+            self.ledger = None
+        if self.recompressor:
+            self.metrics.section("recompression", self.recompressor.report())
+            self.recompressor.close()
+            self.recompressor = None
+        if self.staging:
+            self.metrics.section("staging", self.staging.report(self.staging_since))
+            self.staging.save()
+            self.staging = None
+        if self.limiter:
+            self.metrics.section("bandwidth", self.limiter.report(self.limiter_since))
+            self.limiter = None
+        self.cancel = None
+        summary = self.metrics.finish()
+        if report_path is None:
+            report_path = self.setup["upload_report"]
+        if report_path:
+            self.metrics.save_report(resolve_path(report_path))
+        return summary
+
+    def __discard_ahead__(self):
+        """
+        Deletes findings created ahead for groups which have not been uploaded (stopped run).
+        """
+        ahead, self.findings_ahead = self.findings_ahead, {}
+        if self.finding_pool:
+            self.finding_pool.shutdown(wait=True)
+            self.finding_pool = None
+        for future in ahead.values():
+            if future.exception() is None:
+                self.delete_finding(WORKSPACE_ID, future.result())
 
     def __dummy_uploadhandler__(self, msg, file_size, chunk=0, nr_chunks=0):
         """
@@ -31,7 +31,7 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky", "Jakub Geyer"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.0.2"
+__version__ = "1.0.11"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
@@ -103,8 +103,10 @@ class ConnectorFrame:
             self.config = unicatdb.Configuration(access_token=token,
                                                  server=unicatdb.Servers.LOCALHOST)
         else:
+            # Configuration takes only predefined servers, other address replaces the host of one of them
             self.config = unicatdb.Configuration(access_token=token,
-                                                 server=self.setup['server'])
+                                                 server=unicatdb.Servers.LOCALHOST)
+            self.config.host = self.setup['server'].rstrip("/")
 
     def load_setup(self):
         """
@@ -116,6 +118,10 @@ class ConnectorFrame:
         None.
         """
         from config import DOCUMENT_SET, LOCATION_DESCRIPTION, TYPE, NOTE, TAGS, COLLECTION_ORGANIZATION, INTERNAL_NUMBER, SERVER
+        from config import CHUNK_SIZE, UPLOAD_RETRIES, UPLOAD_RETRY_DELAY, UPLOAD_CHECKSUM, UPLOAD_REPORT, RECOMPRESS, RECOMPRESS_WORKERS
+        from config import DEDUP, DEDUP_STORE, STAGING_DIR, STAGING_QUOTA
+        from config import UPLOAD_LIMIT, UPLOAD_LIMIT_SCHEDULE, UPLOAD_LIMIT_FILE
+        from config import FINDING_WINDOW, FINDING_LEDGER, RECONCILE_FINDINGS, PARALLEL_UPLOAD_PARTS, PARALLEL_UPLOAD_MIN
         self.setup["document_set"] = DOCUMENT_SET
         self.setup["date"] = dtformating(datetime.now())
         self.setup["loc_desc"] = LOCATION_DESCRIPTION
@@ -125,6 +131,25 @@ class ConnectorFrame:
         self.setup["organization"] = COLLECTION_ORGANIZATION
         self.setup["internal_number"] = INTERNAL_NUMBER
         self.setup["server"] = SERVER
+        self.setup["chunk_size"] = CHUNK_SIZE
+        self.setup["upload_retries"] = UPLOAD_RETRIES
+        self.setup["upload_retry_delay"] = UPLOAD_RETRY_DELAY
+        self.setup["upload_checksum"] = UPLOAD_CHECKSUM
+        self.setup["upload_report"] = UPLOAD_REPORT
+        self.setup["recompress"] = RECOMPRESS
+        self.setup["recompress_workers"] = RECOMPRESS_WORKERS
+        self.setup["dedup"] = DEDUP
+        self.setup["dedup_store"] = DEDUP_STORE
+        self.setup["staging_dir"] = STAGING_DIR
+        self.setup["staging_quota"] = STAGING_QUOTA
+        self.setup["upload_limit"] = UPLOAD_LIMIT
+        self.setup["upload_limit_schedule"] = UPLOAD_LIMIT_SCHEDULE
+        self.setup["upload_limit_file"] = UPLOAD_LIMIT_FILE
+        self.setup["finding_window"] = FINDING_WINDOW
+        self.setup["finding_ledger"] = FINDING_LEDGER
+        self.setup["reconcile_findings"] = RECONCILE_FINDINGS
+        self.setup["parallel_upload_parts"] = PARALLEL_UPLOAD_PARTS
+        self.setup["parallel_upload_min"] = PARALLEL_UPLOAD_MIN
 
     def commit_one_group(self, group):
         """
@@ -32,7 +32,7 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.1.0"
+__version__ = "1.6.4"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
@@ -42,18 +42,25 @@ __python__ = "3.8.0"
 # Import required libs
 try:
     import threading
-    import numpy as np
-    from ipywidgets import Button, Dropdown, Text, HBox, VBox, HTML, FloatProgress, Layout
+    import importlib.util
+    from importlib.metadata import version
+    from ipywidgets import Button, Dropdown, Text, HBox, VBox, HTML, FloatProgress, Layout, Accordion
     from IPython.display import display, clear_output
     from ipyfilechooser import FileChooser
 
     # Import custom scripts
     import dataprocess as dp
-    import uploader as up
-    import all_in_one as aio
+    # Uploader and All-in-One (UniCatDB client, OpenCV) are imported when their mode starts,
+    # only check that their libraries are installed
+    for lib in ["cv2", "scipy", "imutils", "unicatdb"]:
+        if importlib.util.find_spec(lib) is None:
+            raise ModuleNotFoundError(f"No module named '{lib}'")
+    from progress import ProgressAggregator, format_eta
+    from cancel import CancelToken
+    from instrumentation import add_hook, remove_hook, RollingStats
 
     # Import setting from config
-    from config import MIN_USERNAME_LENGTH
+    from config import MIN_USERNAME_LENGTH, GUI_REFRESH_RATE, GUI_STATS_WINDOW, GUI_STATS_INTERVAL
 
 except ModuleNotFoundError:
     # If there are missing libraries, install those.
@@ -73,24 +80,31 @@ except ModuleNotFoundError:
     print("Instalation finished.")
 
     import threading
-    import numpy as np
-    from ipywidgets import Button, Dropdown, Text, HBox, VBox, HTML, FloatProgress, Layout
+    import importlib.util
+    from importlib.metadata import version
+    from ipywidgets import Button, Dropdown, Text, HBox, VBox, HTML, FloatProgress, Layout, Accordion
     from IPython.display import display, clear_output
     from ipyfilechooser import FileChooser
 
     # Import custom scripts
     import dataprocess as dp
-    import uploader as up
-    import all_in_one as aio
+    # Uploader and All-in-One (UniCatDB client, OpenCV) are imported when their mode starts,
+    # only check that their libraries are installed
+    for lib in ["cv2", "scipy", "imutils", "unicatdb"]:
+        if importlib.util.find_spec(lib) is None:
+            raise ModuleNotFoundError(f"No module named '{lib}'")
+    from progress import ProgressAggregator, format_eta
+    from cancel import CancelToken
+    from instrumentation import add_hook, remove_hook, RollingStats
 
     # Import setting from config
-    from config import MIN_USERNAME_LENGTH
+    from config import MIN_USERNAME_LENGTH, GUI_REFRESH_RATE, GUI_STATS_WINDOW, GUI_STATS_INTERVAL
 
 # Check if custom scripts have correct version
-from version_check import check_version
-check_version(dp.__version__, [1, 1, 3], "dataprocess.py")
-check_version(up.__version__, [1, 1, 0], "uploader.py")
-check_version(aio.__version__, [1, 0, 2], "all_in_one.py")
+from version_check import check_version, module_version
+check_version(dp.__version__, [1, 5, 0], "dataprocess.py")
+check_version(module_version("uploader"), [1, 8, 0], "uploader.py")
+check_version(module_version("all_in_one"), [1, 3, 0], "all_in_one.py")
 
 class GUI():
     """
@@ -116,19 +130,30 @@ class GUI():
         self.uplo = None
         self.bothtml = None
         self.bot_html = None
+        self.stats = None
+        self.stats_html = None
         # File chooser
         self.fc = None
         # Create gui
         self.construct_gui()
         self.link_gui()
         self.running = False
-        # Class holders for progress bars
-        self.pb_ar = np.zeros((0,))
-        self.pb_up = np.zeros((0,))
+        # Progress bars are drawn at fixed rate from one place, workers only report fractions
+        self.bars = ProgressAggregator(self.__render__, rate=GUI_REFRESH_RATE)
+        # Amount of steps of current job reported by progresshandler
+        self.ticks = 0
+        # Total progress bar shows unknown total
+        self.indeterminate = False
         # Class shared path variable
         self.PATH = ""
         # Multithreaded processing management
         self.thread = None
+        # Cancel token of running job
+        self.cancel = CancelToken()
+        # Statistics of running job fed by instrumentation hooks
+        self.rolling = None
+        self.eta_state = None
+        self.stats_stop = threading.Event()
 
     def construct_gui(self):
         """
@@ -170,8 +195,14 @@ class GUI():
         # Upload bar - shown only when in uploader or AiO mode
         self.uplo = FloatProgress(value=0, min=0, max=10, description="Upload: ", barstyle="info", style={"bar_color":'#32A718'}, orientation="horizontal", layout=Layout(width="95%", visibility="hidden"))
 
+        # Collapsible statistics panel, refreshed only when opened
+        self.stats_html = HTML(value="No job is running.")
+        self.stats = Accordion(children=[self.stats_html], layout=Layout(width="100%"))
+        self.stats.set_title(0, "Statistics")
+        self.stats.selected_index = None
+
         # Html GUI bottom
-        self.bothtml = f"<br>GUI version: {__version__} | Data processing version: {dp.__version__} | Image processing version: {dp.ip.__version__} <br> Uploader version: {up.__version__} | All-in-One version: {aio.__version__} | UniCatDB version: {up.unicatdb.openapi_client.__version__}"
+        self.bothtml = f"<br>GUI version: {__version__} | Data processing version: {dp.__version__} | Image processing version: {module_version('imgprocess')} <br> Uploader version: {module_version('uploader')} | All-in-One version: {module_version('all_in_one')} | UniCatDB version: {version('unicatdb')}"
         self.bot_html = HTML(value=self.bothtml)
 
         # Layout setting
@@ -179,7 +210,7 @@ class GUI():
         middle = HBox([self.origin, self.mode])
         bars = VBox([self.prog, self.uplo], layout=Layout(width='90%', overflow='hidden'))
         bottom = HBox([self.butt, bars])
-        self.layout = VBox([self.top_html, top, middle, bottom, self.bot_html],  layout=Layout(width='80%', border='solid'))
+        self.layout = VBox([self.top_html, top, middle, bottom, self.stats, self.bot_html],  layout=Layout(width='80%', border='solid'))
         # Show layout
         display(self.layout)
 
@@ -203,42 +234,28 @@ class GUI():
         if self.running:
             # Lock button during safe exit
             self.butt.disabled = True
-            # Change global for another thread to stop
-            dp.BREAK = True
-            up.BREAK = True
-            aio.BREAK = True
+            # Change running state, so stopped job does not report itself as finished
+            self.running = False
+            # Ask worker thread to stop, it stops within one image stage or upload chunk
+            self.cancel.cancel()
             # Let user know something is going on
             self.bot_html.value = "<b style='color:orange;'>Stopping...</b>" + self.bothtml
-            # Prepare progress bar array for another start
-            self.pb_ar = np.zeros((0,))
-            # Wait for thread to finish and exit safely
-            self.thread.join()
-            # Change running state
-            self.running = False
-            # Change button and update text
-            self.bot_html.value = "<b style='color:red;'>Processing stopped</b>" + self.bothtml
-            self.butt.description = 'Start'
-            self.butt.icon = 'check'
-            self.butt.tooltip = "Start task in given mode"
-            # Unlock UI
-            self.butt.disabled = False
-            self.mode.disabled = False
-            self.user.disabled = False
-            self.path.disabled = False
-            self.finder.disabled = False
-            self.origin.disabled = False
+            # Wait for worker in background, so the notebook does not freeze
+            threading.Thread(target=self.__wait_for_stop__, daemon=True).start()
 
         else:
-            # Make sure all modes are ready to work
-            dp.BREAK = False
-            up.BREAK = False
-            aio.BREAK = False
+            # Fresh cancel token for every job
+            self.cancel = CancelToken()
             # Extract settings from GUI
             self.PATH = self.path.value
             origin = self.origin.value
             mode = self.mode.value
             # Change state to running
             self.running = True
+            self.ticks = 0
+            self.bars.reset()
+            self.bars.start()
+            self.__start_stats__()
             # Change button and update text
             self.bot_html.value = "<b style='color:green;'>Processing started</b>" + self.bothtml
             self.butt.description = "Stop"
@@ -255,28 +272,36 @@ class GUI():
                 # Start in UPLOADER mode
                 if mode == "Uploader":
                     # Check if target path leads to json (file chooser should allow only propper )
-                    if not self.PATH.lower().endswith((".txt",".json")):
+                    if not self.PATH.lower().endswith((".txt",".json",".sqlite",".db")):
                         self.bot_html.value("<b style='color:green;'> Expected path has to lead to json. Change path and try again.</b>" + self.bothtml)
                     else:
                         self.bot_html.value = "<b style='color:green;'>Processing started</b>" + self.bothtml
+                    import uploader as up
                     self.thread = threading.Thread(target=up.Connector().commit_all, args=(self.PATH,),
                                                    kwargs={'progresshandler':self.__progressbar__,
                                                            'uploaderhandler':self.__uploadbar__,
-                                                           'user':self.user.value})
+                                                           'user':self.user.value,
+                                                           'etahandler':self.__etabar__,
+                                                           'cancel':self.cancel})
                     self.thread.start()
                 # Start in PRE LOADER mode
                 elif mode == "Pre Loader":
                     self.thread = threading.Thread(target=dp.preload_data, args=(self.PATH, origin,),
                                                    kwargs={'progresshandler':self.__progressbar__,
                                                            'relative':True,
-                                                           'save':True})
+                                                           'save':True,
+                                                           'etahandler':self.__etabar__,
+                                                           'cancel':self.cancel})
                     self.thread.start()
                 # Start in All-in-One mode
                 elif mode == "All-in-One":
+                    import all_in_one as aio
                     self.thread = threading.Thread(target=aio.all_in_one, args=(self.PATH, origin,),
                                                    kwargs={'progresshandler':self.__progressbar__,
                                                            'uploaderhandler':self.__uploadbar__,
-                                                           'user':self.user.value})
+                                                           'user':self.user.value,
+                                                           'etahandler':self.__etabar__,
+                                                           'cancel':self.cancel})
                     self.thread.start()
                 else:
                     raise NotImplementedError("Desired mode is not implemented. How did you even get here?")
@@ -284,17 +309,49 @@ class GUI():
                 self.bot_html.value = "<b style='color:red;'>Exception - "+str(e.__class__.__name__)+"</b>: "+ str(e) + self.bothtml
                 self.__reseter__(exception=True)
 
+    def __wait_for_stop__(self):
+        """
+        Waits on background thread until stopped job exits and unlocks UI for another start.
+
+        Returns
+        -------
+        None.
+
+        """
+        # Wait for thread to finish and exit safely
+        if self.thread is not None:
+            self.thread.join()
+        self.bars.stop()
+        self.__stop_stats__()
+        # Prepare progress bar for another start
+        self.ticks = 0
+        # Change button and update text
+        self.bot_html.value = "<b style='color:red;'>Processing stopped</b>" + self.bothtml
+        self.butt.description = 'Start'
+        self.butt.icon = 'check'
+        self.butt.tooltip = "Start task in given mode"
+        # Unlock UI
+        self.butt.disabled = False
+        self.mode.disabled = False
+        self.user.disabled = False
+        self.path.disabled = False
+        self.finder.disabled = False
+        self.origin.disabled = False
+
     def __progressbar__(self, ct, ct_max=None, finished=False):
         """
-        Progressbar update callback from processing scripts. If not finished ct updates index of
-        prepared steps. If finished, move progress to last position and let user know that all
-        is done.
+        Progressbar update callback from processing scripts. If not finished, fraction ct / (ct_max - 1)
+        is handed to progress aggregator which draws it on next refresh. Until ct_max is known, bar
+        shows indeterminate state. If finished, move progress to last position and let user know that
+        all is done. Runs on worker thread, so it never touches the filesystem.
 
         Parameters
         ----------
         ct : int
-            Integer value used as index to iterate over prepared progression bar steps.
-            Ct increases after each image which get successfuly processed.
+            Number of finished steps of current job.
+        ct_max : int, optional
+            Number of steps of current job including the start. None while processing scripts are
+            still scanning the job. Defaults to None.
         finished : Bool, optional
             Trigger for last tread task update. The default is False.
 
@@ -304,28 +361,29 @@ class GUI():
 
         """
         if not finished:
-            # Dynamically determine steps for progress bar (Uploader, Preloader work slightly different).
-            if self.pb_ar.shape[0] < 1:
-                if ct_max == None:
-                    nr = dp.get_amount_of_files(self.PATH)+1
-                else:
-                    nr = ct_max
-                self.pb_ar = np.linspace(self.prog.min, self.prog.max, nr)
-                self.prog.value = self.pb_ar[ct]
+            # Steps of the job come from the scan processing scripts already do
+            if ct_max is not None:
+                self.ticks = ct_max
+            if self.ticks < 1:
+                self.bars.update("total", None)
+                return
+            # Check if processing has been compromised and interrupt current job
+            if ct >= self.ticks:
+                print("Files have been modified since start! Corruption might occure. Stopping...")
+                self.cancel.cancel()
+                self.bars.update("total", 1.0)
             else:
-                # Check if processing has been compromised and interrupt current job
-                if self.pb_ar.shape[0] < ct:
-                    print("Files have been modified since start! Corruption might occure. Stopping...")
-                    dp.BREAK = True
-                    self.prog.value = self.prog.max
-                else:
-                    # Move progress bar
-                    self.prog.value = self.pb_ar[ct]
+                # Move progress bar
+                self.bars.update("total", ct / max(1, self.ticks - 1))
         # On completed job reset attributes and let user know everything is done.
         elif finished and self.running:
-            self.prog.value = self.prog.max
+            self.bars.update("total", 1.0)
+            self.bars.stop()
+            # Last ETA update comes after render thread stopped
+            self.prog.description = "Total: "
+            self.__stop_stats__()
             self.bot_html.value = "<b style='color:blue;'>Processing FINISHED</b>" + self.bothtml
-            self.pb_ar = np.zeros((0,))
+            self.ticks = 0
             self.mode.disabled = False
             self.user.disabled = False
             self.path.disabled = False
@@ -338,22 +396,41 @@ class GUI():
         else:
             self.prog.value = self.prog.min
 
+    def __etabar__(self, state):
+        """
+        ETA update callback from processing scripts. Runs on worker thread, it only records the state,
+        estimated remaining time of the job is drawn into description of total progress bar on next refresh.
+
+        Parameters
+        ----------
+        state : dict
+            Progress state, see progress.ByteProgress.state
+
+        Returns
+        -------
+        None.
+
+        """
+        self.eta_state = state
+        self.bars.update("eta", state["fraction"])
+
     def __uploadbar__(self, msg, bitmax, chunk, nr_chunks):
         """
-        Uploadbar update callback from uploader scripts. If not finished, ct updates index of
-        prepared steps. If finished, move progress to last position. Global notification is
-        done by progress bar, as this uploader vizualizes every single image and text could be
-        extensive.
+        Uploadbar update callback from uploader scripts. If not finished, uploaded fraction of
+        current file is handed to progress aggregator. If finished, move progress to last position.
+        Global notification is done by progress bar, as this uploader vizualizes every single image
+        and text could be extensive.
 
         Parameters
         ----------
-        ct : int
-            Integer value used as index to iterate over prepared progression bar steps.
-            Ct increases after each image which get successfuly processed.
+        msg : str
+            Progress message of uploader, starts with amount of uploaded bytes or "maximum" at the end.
         bitmax: int
-            Size of image to be uploaded for progression array preparation. Each image gets its own. (Depraceted! Direct file access is used)
-        finished : Bool, optional
-            Trigger for last tread task update. The default is False.
+            Size of uploaded file in bytes.
+        chunk : int
+            Size of upload chunk in bytes.
+        nr_chunks : int
+            Number of chunks of uploaded file.
 
         Returns
         -------
@@ -364,27 +441,134 @@ class GUI():
         step = msg.split(" ")[0]
         # Last callback recapts upload, we dont need that for progress bar
         if step != "maximum":
-            # Calculate step based on chunk size and current upload
-            ct = -(-int(step) // chunk)
-            # Create progress bar steps dynamically for each file
-            if self.pb_up.shape[0] < 1:
-                self.pb_up = np.linspace(self.uplo.min, self.uplo.max, nr_chunks)
-                self.uplo.value = self.pb_up[0]
+            uploaded = int(step)
             # Check if data is not corrupted
-            if self.pb_up.shape[0] < ct:
+            if uploaded > bitmax:
                 print("Upload has been compromised. Please restarat current file")
-                self.uplo.value = self.uplo.min
-                up.BREAK = True
+                self.bars.update("upload", 0.0)
+                self.cancel.cancel()
             else:
                 # Move progress bar
-                self.uplo.value = self.pb_up[ct-1]
-        # Use last callback as end marker and reset attributes for next progress
+                self.bars.update("upload", uploaded / bitmax if bitmax else 1.0)
+        # Use last callback as end marker
         elif step == "maximum" and self.running:
-            self.uplo.value = self.uplo.max
-            self.pb_up = np.zeros((0,))
+            self.bars.update("upload", 1.0)
         else:
             raise IOError("Callback of upload has been changed! Update __uploadbar__")
 
+    def __render__(self, changed):
+        """
+        Draws progress bars changed since last refresh. Called by progress aggregator at most
+        GUI_REFRESH_RATE times per second, so the frontend is not flooded by every chunk.
+
+        Parameters
+        ----------
+        changed : dict
+            Fractions of changed bars {"total": float, "upload": float, "eta": float}. None is
+            indeterminate state. Text of changed ETA is taken from eta_state.
+
+        Returns
+        -------
+        None.
+
+        """
+        if "total" in changed:
+            if changed["total"] is None:
+                # Total is not known yet, show full pale bar instead of fake progress
+                self.indeterminate = True
+                self.prog.style.bar_color = "#b9b5e8"
+                self.prog.description = "Scanning: "
+                self.prog.value = self.prog.max
+            else:
+                if self.indeterminate:
+                    self.indeterminate = False
+                    # Description is taken over by ETA updates
+                    self.prog.style.bar_color = "#180cb3"
+                self.prog.value = self.prog.min + changed["total"] * (self.prog.max - self.prog.min)
+        if "upload" in changed:
+            self.uplo.value = self.uplo.min + changed["upload"] * (self.uplo.max - self.uplo.min)
+        if "eta" in changed and self.eta_state is not None:
+            if self.eta_state["finished"]:
+                self.prog.description = "Total: "
+            else:
+                self.prog.description = "ETA " + format_eta(self.eta_state["eta"])
+
+    def __start_stats__(self):
+        """
+        Registers fresh statistics hook for new job and starts periodic refresh of statistics panel.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.__stop_stats__()
+        self.rolling = RollingStats(window=GUI_STATS_WINDOW)
+        self.eta_state = None
+        add_hook(self.rolling)
+        self.stats_stop = threading.Event()
+        threading.Thread(target=self.__stats_loop__, args=(self.stats_stop,), daemon=True).start()
+
+    def __stop_stats__(self):
+        """
+        Stops refresh of statistics panel and unregisters statistics hook. Last state stays shown.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.stats_stop.set()
+        if self.rolling is not None:
+            remove_hook(self.rolling)
+            self.__render_stats__(force=True)
+
+    def __stats_loop__(self, stop):
+        """
+        Refreshes statistics panel every GUI_STATS_INTERVAL seconds until stop is set. Rates keep
+        decaying even when no event comes, so stalled disk or server is visible.
+
+        Parameters
+        ----------
+        stop : threading.Event
+            Stop flag of this loop
+
+        Returns
+        -------
+        None.
+
+        """
+        while not stop.wait(GUI_STATS_INTERVAL):
+            self.__render_stats__()
+
+    def __render_stats__(self, force=False):
+        """
+        Renders current statistics into statistics panel. Skipped while panel is collapsed.
+
+        Parameters
+        ----------
+        force : Bool, optional
+            Render even if panel is collapsed. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.rolling is None or (self.stats.selected_index is None and not force):
+            return
+        snap = self.rolling.snapshot()
+        eta = self.eta_state["eta"] if self.eta_state else None
+        rows = "".join(
+            f"<tr><td>{name}</td><td>{stage['seconds']:.1f} s</td><td>{stage['share'] * 100:.0f} %</td><td>{stage['count']}</td></tr>"
+            for name, stage in sorted(snap["stages"].items(), key=lambda item: -item[1]["seconds"]))
+        self.stats_html.value = (
+            f"<b>Images/s:</b> {snap['images_per_s']:.2f} | <b>Upload:</b> {snap['upload_mb_per_s']:.2f} MB/s | "
+            f"<b>ETA:</b> {format_eta(eta)} | <b>Images:</b> {snap['images']} | "
+            f"<b style='color:{'red' if snap['failures'] else 'inherit'};'>Failures:</b> {snap['failures']}"
+            f"<br><i>Rates over last {GUI_STATS_WINDOW} s</i>"
+            f"<table><tr><th>Stage</th><th>Time</th><th>Share</th><th>Events</th></tr>{rows}</table>")
+
     def __reseter__(self, exception=False):
         """
         Resets UI elements and some class attributes for clean start of next
@@ -395,10 +579,15 @@ class GUI():
         None.
 
         """
+        self.bars.stop()
+        self.bars.reset()
+        self.__stop_stats__()
+        self.ticks = 0
+        self.indeterminate = False
+        self.prog.style.bar_color = "#180cb3"
         self.prog.value = self.prog.min
+        self.prog.description = "Total: "
         self.uplo.value = self.uplo.min
-        self.pb_ar = np.zeros((0,))
-        self.pb_up = np.zeros((0,))
         self.running = False
         self.mode.disabled = False
         self.user.disabled = False
@@ -435,7 +624,7 @@ class GUI():
             # Set up file chooser for selected more
             if self.mode.value == "Uploader":
                 self.fc.title = '<b>Select preprocessed json file</b>'
-                self.fc.filter_pattern = ['*.txt', '*.TXT', '*.json', '*.JSON']
+                self.fc.filter_pattern = ['*.txt', '*.TXT', '*.json', '*.JSON', '*.sqlite', '*.db']
             else:
                 self.fc.title = '<b>Select folder with images</b>'
                 self.fc.show_only_dirs = True
@@ -30,13 +30,48 @@ __copyright__ = "<2022> <University Southern Bohemia>"
 __credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
 
 __license__ = "MIT (X11)"
-__version__ = "1.0.0"
+__version__ = "1.1.0"
 __maintainer__ = ["Ondrej Budik"]
 __email__ = ["obudik@prf.jcu.cz"]
 __status__ = "Beta"
 
 __python__ = "3.8.0"
 
+# Import required libs
+import importlib.util
+import re
+import sys
+
+def module_version(module_name):
+    """Reads __version__ of custom script without importing it, so version can be checked before
+    heavy libraries of the script get loaded. Already imported scripts are asked directly.
+
+    Parameters
+    ----------
+    module_name : str
+        Name of custom script module, e.g. "imgprocess"
+
+    Returns
+    -------
+    str
+        Version of the script in a form of: "1.0.1"
+
+    Raises
+    ------
+    ImportError
+        Raises when script or its version can not be found.
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name].__version__
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or spec.origin is None:
+        raise ImportError(f"{module_name}.py is missing! Update your software from github or ask admin to do that.")
+    with open(spec.origin, "r", encoding="utf-8") as fin:
+        match = re.search(r'^__version__\s*=\s*["\']([0-9.]+)["\']', fin.read(), re.MULTILINE)
+    if match is None:
+        raise ImportError(f"{module_name}.py has no version! Update your software from github or ask admin to do that.")
+    return match.group(1)
+
 def check_version(lib_version, min_version, lib_name):
     """Checks versions of custom scripts if they are up to date with current UI
 
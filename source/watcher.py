@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+watcher.py: Watch mode for near real time ingest from microscope. New seed
+groups in watched folder are processed and uploaded as soon as all their images
+and meta data are completely written. Uses filesystem notifications of watchdog
+library if it is installed, otherwise folder is polled.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.1"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import dataprocess as dp
+from cancel import Cancelled
+from config import IMAGE_SUFFIX_NAMES, WATCH_SETTLE, WATCH_GROUP_SETTLE, WATCH_POLL_INTERVAL, WATCH_STATE
+
+# Filesystem notifications are optional, folder is polled without them
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+# Image types processed by dataprocess.get_groups
+IMAGE_TYPES = [".tif", ".tiff"]
+
+class FolderWatcher():
+    """
+    Watches root folder with species folders (same layout as Pre Loader and All-in-One expect).
+    Image or meta data file is complete once its size and modification time did not change for
+    settle seconds. Seed group is committed once all its images and meta data are complete and
+    either the group did not change for group_settle seconds or next seed has been started
+    in the same folder. Committed images are stored in state file and never uploaded twice,
+    image added to already committed seed later is uploaded as new finding.
+    """
+    def __init__(self, root, origin, user="Watch mode", uploaderhandler=None, settle=WATCH_SETTLE,
+                 group_settle=WATCH_GROUP_SETTLE, poll=WATCH_POLL_INTERVAL, state_path=WATCH_STATE, polling=False,
+                 consolecall=False):
+        """
+        Constructor of FolderWatcher class. For full documentation do see class doc.
+
+        Parameters
+        ----------
+        root : str
+            Folder with species folders which should be watched
+        origin : str
+            Origin of images. Important to say, which microscope took the pictures
+        user : str, optional
+            User name who commits watched data. Defaults to "Watch mode".
+        uploaderhandler : method, optional
+            Handler of uploader progress, see uploader.Connector.commit_one_group. Defaults to None.
+        settle : float, optional
+            Seconds without change after which file is complete. Defaults to WATCH_SETTLE from config.
+        group_settle : float, optional
+            Seconds without change after which seed group is complete. Defaults to WATCH_GROUP_SETTLE from config.
+        poll : float, optional
+            Interval of folder polling in seconds if notifications are not used. Defaults to WATCH_POLL_INTERVAL.
+        state_path : str, optional
+            Json file of committed images. Defaults to WATCH_STATE from config, None keeps it in memory only.
+        polling : Bool, optional
+            Forces polling even if watchdog is installed. Defaults to False.
+        consolecall : Bool, optional
+            Toggles console prints about committed groups. Defaults to False.
+        """
+        self.root = dp.resolve_path(root)
+        self.origin = origin
+        self.user = user
+        self.uploaderhandler = uploaderhandler
+        self.settle = settle
+        self.group_settle = group_settle
+        self.poll = poll
+        self.polling = polling or Observer is None
+        self.consolecall = consolecall
+        self.keyence = origin.lower() == "keyence"
+        # Files seen and not committed yet, path -> [size, mtime_ns, last change, first seen]
+        self.files = {}
+        # Folders changed since last scan filled by notifications, folder -> scan recursively
+        self.dirty = {}
+        self.last_scan = 0.0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.state_path = dp.resolve_path(state_path) if state_path else None
+        self.committed = {}
+        # Files of groups which failed, skipped until they change
+        self.failed = {}
+        if self.state_path and self.state_path.is_file():
+            try:
+                with open(self.state_path, "r") as fin:
+                    self.committed = json.load(fin)["files"]
+            except (ValueError, KeyError, OSError) as e:
+                print("Watch state could not be loaded, starting empty: " + str(e.__class__.__name__) + " " + str(e))
+        self.stats = {"groups": 0, "images": 0, "latency_max": 0.0}
+
+    def run(self, cancel, metricshandler=None, report_path=None):
+        """
+        Watches folder until cancel token gets cancelled. Files which appeared while watch mode
+        was not running are committed too.
+
+        Parameters
+        ----------
+        cancel : cancel.CancelToken
+            Token which stops watching. Group in progress is stopped within one image or chunk.
+        metricshandler : method, optional
+            Callback receiving upload metrics events, see metrics.UploadMetrics. Defaults to None.
+        report_path : str, optional
+            Path where upload run report should be saved on stop (.json or .csv). Defaults to UPLOAD_REPORT from config.
+
+        Returns
+        -------
+        dict
+            Summary of upload metrics of watch run extended by watch statistics.
+        """
+        import uploader as up
+        self.uploader = up.Connector()
+        self.uploader.start_run(metricshandler, cancel)
+        observer = None if self.polling else self.__observe__()
+        if self.consolecall:
+            print(f"Watching {self.root} " + ("by polling." if observer is None else "with filesystem notifications."))
+        self.__scan__(self.root, recursive=True)
+        try:
+            while not cancel.cancelled:
+                self.__commit_ready__()
+                # Sleep until notification or settle check, cancellation is checked at least every second
+                self.wake.wait(min(self.settle / 2, 1.0))
+                self.wake.clear()
+                if observer is None and time.monotonic() - self.last_scan >= self.poll:
+                    self.__scan__(self.root, recursive=True)
+                    continue
+                with self.lock:
+                    dirty, self.dirty = self.dirty, {}
+                # Pending files are checked for stability even without notification
+                for path in self.files:
+                    dirty.setdefault(Path(path).parent, False)
+                for folder, recursive in dirty.items():
+                    self.__scan__(folder, recursive)
+        except Cancelled:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        summary = self.uploader.finish_run(report_path)
+        summary["watch"] = dict(self.stats)
+        return summary
+
+    def __observe__(self):
+        """
+        Starts watchdog observer which marks changed folders and wakes up the watch loop.
+        """
+        watcher = self
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path] + ([event.dest_path] if getattr(event, "dest_path", None) else [])
+                with watcher.lock:
+                    for path in paths:
+                        # Folder moved in may come without events of its content
+                        if event.is_directory:
+                            watcher.dirty[Path(path)] = True
+                        else:
+                            watcher.dirty.setdefault(Path(path).parent, False)
+                watcher.wake.set()
+        observer = Observer()
+        observer.schedule(Handler(), str(self.root), recursive=True)
+        observer.start()
+        return observer
+
+    def __scan__(self, folder, recursive=False):
+        """
+        Updates size and modification time of candidate files in folder.
+        """
+        folder = Path(folder)
+        now = time.monotonic()
+        if recursive and folder == self.root:
+            self.last_scan = now
+        seen = set()
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        stack.append(Path(entry.path))
+                    continue
+                if not self.__candidate__(entry.name):
+                    continue
+                path = Path(entry.path).as_posix()
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                seen.add(path)
+                if [stat.st_size, stat.st_mtime_ns] in (self.committed.get(path), self.failed.get(path)):
+                    continue
+                known = self.files.get(path)
+                if known is None or known[0] != stat.st_size or known[1] != stat.st_mtime_ns:
+                    self.files[path] = [stat.st_size, stat.st_mtime_ns, now, known[3] if known else now]
+        # Forget removed files
+        for path in [path for path in self.files if Path(path).parent == folder or recursive and folder in Path(path).parents]:
+            if path not in seen:
+                del self.files[path]
+
+    def __candidate__(self, name):
+        """
+        Returns True for image and meta data files.
+        """
+        lower = name.lower()
+        return Path(lower).suffix in IMAGE_TYPES or (not self.keyence and lower.endswith("_meta.xml"))
+
+    def __meta_of__(self, img):
+        """
+        Returns path of meta data file of image, same rules as dataprocess.img_meta_pair.
+        """
+        if self.keyence:
+            return img
+        img = Path(img)
+        stem = img.stem[:-3] if img.stem[-3:] in IMAGE_SUFFIX_NAMES else img.stem
+        return (img.parent / (stem + "_meta.xml")).as_posix()
+
+    def __groups__(self):
+        """
+        Returns pending images grouped by folder and seed number.
+        """
+        groups = {}
+        for path in sorted(self.files):
+            if Path(path).suffix.lower() not in IMAGE_TYPES:
+                continue
+            seed_nr, _ = dp.parse_file_name_for_seed_image_relations(Path(path), "_", "--")
+            key = (Path(path).parent.as_posix(), path if seed_nr == "none" else seed_nr)
+            groups.setdefault(key, []).append(path)
+        return groups
+
+    def __commit_ready__(self):
+        """
+        Commits all seed groups which are complete.
+        """
+        now = time.monotonic()
+        groups = self.__groups__()
+        for (folder, seed), images in groups.items():
+            files = set(images) | {self.__meta_of__(img) for img in images}
+            # Every image needs its meta data and all files have to be stable
+            if any(path not in self.files and self.committed.get(path) is None for path in files):
+                continue
+            pending = [self.files[path] for path in files if path in self.files]
+            if any(now - info[2] < self.settle for info in pending):
+                continue
+            changed = max(info[2] for info in pending)
+            # Next seed started in the same folder means this one is finished. Groups handled earlier in this
+            # pass are not pending anymore.
+            next_started = any(other_folder == folder and other_seed != seed and
+                               min((self.files[path][3] for path in other if path in self.files), default=0) > changed
+                               for (other_folder, other_seed), other in groups.items())
+            if now - changed < self.group_settle and not next_started:
+                continue
+            try:
+                self.__commit__(folder, images, min(info[3] for info in pending))
+            except Exception as e:
+                # Group is retried only after its files change
+                print("Watched group in " + folder + " could not be committed: " + str(e.__class__.__name__) + " " + str(e))
+                for path in files:
+                    info = self.files.pop(path, None)
+                    if info is not None:
+                        self.failed[path] = info[:2]
+
+    def __commit__(self, folder, images, first_seen):
+        """
+        Processes and uploads one seed group and stores its files as committed.
+        """
+        folder = Path(folder)
+        if folder.name.lower() == "diaspore":
+            species, nr = folder.parent.name.title(), 0
+        else:
+            species, nr = folder.name.title(), 1
+        pairs = [[Path(img), Path(self.__meta_of__(img))] for img in images]
+        if self.consolecall:
+            print(f"Committing {species} seed group of {len(pairs)} images.")
+        for group in dp.main(self.root, self.origin, generator=True, jobs=[(species, nr, pairs)],
+                             cancel=self.uploader.cancel, keep_buffers=True):
+            for data in group:
+                data['img_path'] = data['img_path'].as_posix()
+                data['meta_path'] = data['meta_path'].as_posix()
+                data['user'] = self.user
+            self.uploader.prepare_group(group)
+            # Files of group which did not upload completely are failed, not committed
+            if not self.uploader.commit_one_group(group, self.uploaderhandler):
+                raise IOError(f"Upload of {species} seed group failed.")
+        latency = time.monotonic() - first_seen
+        self.stats["groups"] += 1
+        self.stats["images"] += len(images)
+        self.stats["latency_max"] = max(self.stats["latency_max"], latency)
+        for path in set(images) | {self.__meta_of__(img) for img in images}:
+            info = self.files.pop(path, None)
+            if info is not None:
+                self.committed[path] = info[:2]
+        self.__save__()
+        if self.consolecall:
+            print(f"{species} seed group committed {latency:.1f} s after its first file appeared.")
+
+    def __save__(self):
+        """
+        Writes state of committed files. File is replaced atomically.
+        """
+        if not self.state_path:
+            return
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp, "w") as fout:
+            json.dump({"version": 1, "files": self.committed}, fout)
+        os.replace(tmp, self.state_path)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+conftest.py: Shared fixtures of offline tests. Uploads go to in-memory stand-in
+UniCatDB server (standin.py) on free port, seed images are generated next to meta
+data of test folder.
+
+Run from repository root:
+    python -m pytest -q
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import hashlib
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+# Modules are imported flat from source, as when run from there
+sys.path.insert(0, (ROOT / "source").as_posix())
+
+import config
+
+# Microscope of meta data in test folder
+ORIGIN = "Zeiss Axiocam 305c"
+
+@pytest.fixture
+def standin(tmp_path, monkeypatch):
+    """
+    Stand-in server which receives uploads of the test. Working directory is temporary folder
+    with api.token, ledger and reports stay in it.
+    """
+    from standin import StandinServer
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "api.token").write_text("standin")
+    server = StandinServer(port=0).start()
+    monkeypatch.setattr(config, "SERVER", server.url)
+    monkeypatch.setattr(config, "DEDUP", False)
+    monkeypatch.setattr(config, "FINDING_LEDGER", (tmp_path / "findings_ledger").as_posix())
+    monkeypatch.setattr(config, "UPLOAD_RETRY_DELAY", 0)
+    monkeypatch.setattr(config, "UPLOAD_REPORT", None)
+    yield server
+    server.stop()
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """
+    Copy of test folder with generated seed image next to every meta data file.
+    """
+    import cv2
+    import numpy as np
+    import dataprocess as dp
+    monkeypatch.setattr(dp, "DEDUP", False)
+    path = tmp_path / "images"
+    shutil.copytree(ROOT / "test", path)
+    for i, meta in enumerate(sorted(path.rglob("*_meta.xml"))):
+        img = np.full((800, 1000, 3), (40, 160, 60), np.uint8)
+        cv2.ellipse(img, (500, 400), (220 + i, 130), 20, 0, 360, (30, 90, 170), -1)
+        cv2.imwrite((meta.parent / (meta.name[:-len("_meta.xml")] + ".tif")).as_posix(), img,
+                    [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+    return path
+
+@pytest.fixture
+def preloaded(dataset):
+    """
+    Path to preload_data.json of dataset.
+    """
+    import dataprocess as dp
+    dp.preload_data(dataset.as_posix(), ORIGIN, output_path=dataset.as_posix(), save=True)
+    return dataset / "preload_data.json"
+
+def server_content(server):
+    """
+    Returns sorted (file name, SHA-256) of attachments of every finding on stand-in server.
+    """
+    return sorted(tuple(sorted((name, hashlib.sha256(data).hexdigest()) for name, data in server.attachments(finding).items()))
+                  for finding in list(server.findings))
+
+def quiet(*args, **kwargs):
+    """
+    Upload handler which prints nothing.
+    """
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+test_failed_groups.py: Group whose file failed to upload is neither checkpointed for resumed
+runs nor committed by watch mode.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+import threading
+import time
+
+import pytest
+
+from conftest import ORIGIN, quiet
+
+# Image whose upload fails
+FAILING = "aju rep_12.tif"
+
+@pytest.fixture
+def failing_upload(monkeypatch):
+    """
+    Makes upload of FAILING image fail after its upload has been created.
+    """
+    import uploader as up
+    send = up.Connector.__send__
+    def failing(self, uploader, size, chunk, file_record, *args, **kwargs):
+        if file_record["path"].endswith(FAILING):
+            raise IOError("Injected upload failure.")
+        return send(self, uploader, size, chunk, file_record, *args, **kwargs)
+    monkeypatch.setattr(up.Connector, "__send__", failing)
+
+def test_failed_group_is_not_checkpointed(standin, preloaded, failing_upload):
+    import uploader as up
+    from dataprocess import group_key
+    with open(preloaded, "r") as fin:
+        groups = json.load(fin)
+    failed = [group_key(group) for group in groups if any(data["img_path"].endswith(FAILING) for data in group)]
+    assert len(failed) == 1
+    done = []
+    summary = up.Connector().commit_all(preloaded.as_posix(), user="Test", uploaderhandler=quiet,
+                                        grouphandler=lambda key, group: done.append(key))
+    assert summary["failed_files"] == 1
+    assert failed[0] not in done
+    assert len(done) == len(groups) - 1
+
+def test_failed_group_is_not_checkpointed_all_in_one(standin, dataset, failing_upload):
+    import all_in_one as aio
+    done = []
+    summary = aio.all_in_one(dataset.as_posix(), ORIGIN, user="Test", uploaderhandler=quiet,
+                             grouphandler=lambda key, group: done.append(group))
+    assert summary["failed_files"] == 1
+    assert done
+    assert not any(data["img_path"].endswith(FAILING) for group in done for data in group)
+
+def test_watcher_does_not_commit_failed_group(standin, dataset, failing_upload):
+    from cancel import CancelToken
+    from watcher import FolderWatcher
+    images = [path.as_posix() for path in dataset.rglob("*.tif")]
+    watcher = FolderWatcher(dataset.as_posix(), ORIGIN, user="Test", uploaderhandler=quiet, settle=0.1,
+                            group_settle=0.2, poll=0.1, state_path=None, polling=True)
+    cancel = CancelToken()
+    thread = threading.Thread(target=watcher.run, args=(cancel,))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline and not all(path in watcher.committed or path in watcher.failed for path in images):
+            time.sleep(0.1)
+    finally:
+        cancel.cancel()
+        thread.join()
+    failed = next(path for path in images if path.endswith(FAILING))
+    assert failed in watcher.failed
+    assert failed not in watcher.committed
+    assert all(path in watcher.committed for path in images if path != failed)
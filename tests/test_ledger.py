@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+test_ledger.py: Reconcile deletes only findings left without all their files.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import json
+from pathlib import Path
+
+from conftest import quiet
+
+def test_reconcile_deletes_only_pending(tmp_path):
+    from ledger import FindingLedger, reconcile
+    folder = tmp_path / "findings_ledger"
+    finished = FindingLedger(folder)
+    finished.created("complete", "group 1", "workspace")
+    finished.created("pending", "group 2", "workspace")
+    finished.created("removed", "group 3", "workspace")
+    finished.completed("complete")
+    finished.deleted("removed")
+    finished.close()
+    # Ledger of running upload stays locked
+    running = FindingLedger(folder)
+    running.created("running", "group 4", "workspace")
+    deleted = []
+    try:
+        report = reconcile(folder, lambda workspace, finding_id: deleted.append(finding_id) or True)
+    finally:
+        running.close()
+    assert deleted == ["pending"]
+    assert report == {"pending": 1, "deleted": 1, "failed": 0, "running": 1}
+    # Resolved ledger is removed, ledger of running upload is left
+    assert not finished.path.exists()
+    assert running.path.exists()
+
+def test_reconcile_keeps_failed_deletion(tmp_path):
+    from ledger import FindingLedger, reconcile, read_ledger
+    ledger = FindingLedger(tmp_path)
+    ledger.created("pending", "group 1", "workspace")
+    ledger.created("refused", "group 2", "workspace")
+    ledger.close()
+    report = reconcile(tmp_path, lambda workspace, finding_id: finding_id != "refused")
+    assert report["deleted"] == 1 and report["failed"] == 1
+    assert list(read_ledger(ledger.path)) == ["refused"]
+
+def test_reconcile_findings_of_failed_upload(standin, preloaded):
+    import uploader as up
+    with open(preloaded, "r") as fin:
+        groups = json.load(fin)
+    # Image missing at upload leaves its finding without files
+    missing = groups[0][0]["img_path"]
+    Path(missing).unlink()
+    summary = up.Connector().commit_all(preloaded.as_posix(), user="Test", uploaderhandler=quiet)
+    assert summary["failed_files"] == 1
+    findings = set(standin.findings)
+    assert len(findings) == len(groups)
+    report = up.Connector().reconcile_findings()
+    assert report["deleted"] == 1
+    assert len(standin.findings) == len(groups) - 1
+    assert set(standin.findings) < findings
+    # Only finding with missing image is gone, complete ones keep their files
+    names = {name for finding in list(standin.findings) for name in standin.attachments(finding)}
+    assert Path(missing).name not in names
+    assert all(standin.attachments(finding) for finding in list(standin.findings))
+    assert up.Connector().reconcile_findings()["pending"] == 0
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+test_parallel_upload.py: Files uploaded in parallel parts end up on server the same as
+files uploaded in one piece, server without concatenation gets them in one piece.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import hashlib
+import json
+from pathlib import Path
+
+import config
+from conftest import server_content, quiet
+
+def upload(preloaded, report, monkeypatch, parts):
+    """
+    Uploads preloaded data split into given amount of parts and returns files of run report.
+    """
+    import uploader as up
+    monkeypatch.setattr(config, "PARALLEL_UPLOAD_PARTS", parts)
+    # Every generated image is large enough to be split
+    monkeypatch.setattr(config, "PARALLEL_UPLOAD_MIN", 0.5)
+    summary = up.Connector().commit_all(preloaded.as_posix(), user="Test", uploaderhandler=quiet, report_path=report)
+    assert not summary["failed_files"] and not summary["failed_findings"]
+    with open(report, "r") as fin:
+        return json.load(fin)["files"]
+
+def test_parallel_upload_matches_sequential(standin, preloaded, tmp_path, monkeypatch):
+    from standin import StandinServer
+    upload(preloaded, tmp_path / "sequential.json", monkeypatch, 1)
+    sequential = server_content(standin)
+    # Second server gets the same data in parts
+    parallel_server = StandinServer(port=0).start()
+    try:
+        monkeypatch.setattr(config, "SERVER", parallel_server.url)
+        files = upload(preloaded, tmp_path / "parallel.json", monkeypatch, 3)
+        assert server_content(parallel_server) == sequential
+    finally:
+        parallel_server.stop()
+    images = [record for record in files if record["path"].endswith(".tif")]
+    assert images
+    for record in images:
+        # Digests of parts are computed from the same reads and cover the whole file
+        data = Path(record["path"]).read_bytes()
+        assert record["sha256"] is None
+        ranges = [part.split(":") for part in record["part_sha256"].split(";")]
+        assert len(ranges) > 1
+        covered = 0
+        for span, digest in ranges:
+            start, end = map(int, span.split("-"))
+            assert start == covered
+            assert hashlib.sha256(data[start:end]).hexdigest() == digest
+            covered = end
+        assert covered == len(data)
+
+def test_parallel_upload_without_concatenation(standin, preloaded, tmp_path, monkeypatch):
+    import standin as standin_module
+    monkeypatch.setattr(standin_module, "TUS_EXTENSIONS", "creation,checksum,termination")
+    files = upload(preloaded, tmp_path / "report.json", monkeypatch, 3)
+    # Server which can not join parts gets every file in one piece
+    assert all(record["part_sha256"] is None for record in files)
+    for record in files:
+        assert record["sha256"] == hashlib.sha256(Path(record["path"]).read_bytes()).hexdigest()
+    assert standin.summary()["uploads"] == len(files)
+    expected = {hashlib.sha256(Path(record["path"]).read_bytes()).hexdigest() for record in files}
+    assert {digest for finding in server_content(standin) for _, digest in finding} == expected
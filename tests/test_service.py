@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+test_service.py: Batches submitted to local upload service are uploaded to stand-in server,
+groups and images which service already has are skipped.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import hashlib
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import config
+from conftest import server_content
+
+@pytest.fixture
+def service(standin, monkeypatch):
+    """
+    Running upload service on free port which compares content of submitted images.
+    """
+    from cancel import CancelToken
+    from service import UploadService
+    monkeypatch.setattr(config, "DEDUP", True)
+    monkeypatch.setattr(config, "DEDUP_STORE", None)
+    service = UploadService(port=0)
+    cancel = CancelToken()
+    thread = threading.Thread(target=service.run, args=(cancel,))
+    thread.start()
+    # Deduplicator is set up by run
+    while service.uploader is None:
+        time.sleep(0.01)
+    yield service
+    cancel.cancel()
+    thread.join()
+
+def wait_finished(service, batches, timeout=60):
+    """
+    Waits until all given batches are uploaded and returns their states.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        states = [service.batch(batch["id"]) for batch in batches]
+        if all(state["state"] == "finished" for state in states):
+            return states
+        time.sleep(0.05)
+    raise TimeoutError("Batches were not uploaded in time.")
+
+def copy_preload(preloaded, name):
+    """
+    Copies images of preload into folder of given name and returns path of its preload json.
+    """
+    with open(preloaded, "r") as fin:
+        groups = json.load(fin)
+    folder = preloaded.parent.with_name(name)
+    for group in groups:
+        for data in group:
+            for key in ("img_path", "meta_path"):
+                target = folder / Path(data[key]).relative_to(preloaded.parent)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(data[key], target)
+                data[key] = target.as_posix()
+    path = folder / "preload_data.json"
+    with open(path, "w") as fout:
+        json.dump(groups, fout)
+    return path
+
+def test_service_uploads_submitted_batch(service, standin, preloaded):
+    from service import submit_batch
+    batch = submit_batch(preloaded.as_posix(), "Test", url=service.url)
+    assert batch["groups"] > 0
+    state, = wait_finished(service, [batch])
+    assert state["done"] == batch["groups"] and not state["failed"]
+    assert len(standin.findings) == batch["groups"]
+    # Groups which service already has are skipped
+    again = submit_batch(preloaded.as_posix(), "Test", url=service.url)
+    assert again["groups"] == 0 and again["skipped_groups"] == batch["groups"]
+
+def test_service_uploads_concurrent_copies_once(service, standin, preloaded):
+    from service import submit_batch
+    copies = [copy_preload(preloaded, f"copy {i}") for i in range(3)]
+    batches = []
+    threads = [threading.Thread(target=lambda path, user: batches.append(submit_batch(path.as_posix(), user, url=service.url)),
+                                args=(path, f"User {i}")) for i, path in enumerate([preloaded] + copies)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    states = wait_finished(service, batches)
+    # Images of concurrently submitted batches are compared with each other
+    with open(preloaded, "r") as fin:
+        images = [data["img_path"] for group in json.load(fin) for data in group]
+    assert sum(len(state["duplicate_images"]) for state in states) == len(copies) * len(images)
+    uploaded = [digest for finding in server_content(standin) for name, digest in finding if name.endswith(".tif")]
+    assert sorted(uploaded) == sorted(hashlib.sha256(Path(path).read_bytes()).hexdigest() for path in images)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+test_upload.py: Uploads of preloaded data to stand-in server, their run report, duplicate
+images and uploads selected from preload store.
+
+__doc__ using Sphnix Style
+"""
+
+# Copyright 2022 University Southern Bohemia
+
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+__author__ = "Ondrej Budik"
+__copyright__ = "<2022> <University Southern Bohemia>"
+__credits__ = ["Vojtech Barnat", "Ivo Bukovsky"]
+
+__license__ = "MIT (X11)"
+__version__ = "1.0.0"
+__maintainer__ = ["Ondrej Budik"]
+__email__ = ["obudik@prf.jcu.cz"]
+__status__ = "Beta"
+
+__python__ = "3.8.0"
+
+# Import required libs
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+import config
+from conftest import server_content, quiet
+
+def digests(paths):
+    """
+    Returns sorted SHA-256 of given files.
+    """
+    return sorted(hashlib.sha256(Path(path).read_bytes()).hexdigest() for path in paths)
+
+def test_upload_report(standin, preloaded, tmp_path):
+    import uploader as up
+    import unicatdb
+    chunk = unicatdb.Constants.DEFAULT_CHUNK_SIZE
+    report = tmp_path / "report.json"
+    summary = up.Connector().commit_all(preloaded.as_posix(), user="Test", uploaderhandler=quiet, report_path=report)
+    with open(report, "r") as fin:
+        files = json.load(fin)["files"]
+    with open(preloaded, "r") as fin:
+        groups = json.load(fin)
+    paths = [path for group in groups for data in group for path in (data["img_path"], data["meta_path"])]
+    assert summary["files"] == len(files) == len(paths)
+    assert not summary["failed_files"] and not summary["failed_findings"]
+    for record in files:
+        data = Path(record["path"]).read_bytes()
+        assert record["bytes"] == len(data)
+        assert record["chunks"] == max(1, -(-len(data) // chunk))
+        # Digest comes from the reads of upload, chunks were verified by server
+        assert record["sha256"] == hashlib.sha256(data).hexdigest()
+        assert record["chunk_checksum"] is not None
+        assert record["error"] is None
+    assert sorted(digest for finding in server_content(standin) for _, digest in finding) == digests(paths)
+
+def test_duplicate_images_are_uploaded_once(standin, preloaded, monkeypatch):
+    import uploader as up
+    monkeypatch.setattr(config, "DEDUP", True)
+    monkeypatch.setattr(config, "DEDUP_STORE", None)
+    with open(preloaded, "r") as fin:
+        groups = json.load(fin)
+    # Copied species folder is preloaded once more
+    copy = json.loads(json.dumps(groups[0]))
+    for data in copy:
+        for key in ("img_path", "meta_path"):
+            target = Path(data[key]).parent.with_name("copy") / Path(data[key]).name
+            target.parent.mkdir(exist_ok=True)
+            shutil.copyfile(data[key], target)
+            data[key] = target.as_posix()
+    with open(preloaded, "w") as fout:
+        json.dump(groups + [copy], fout)
+    up.Connector().commit_all(preloaded.as_posix(), user="Test", uploaderhandler=quiet)
+    assert len(standin.findings) == len(groups)
+    images = [data["img_path"] for group in groups for data in group]
+    uploaded = [digest for finding in server_content(standin) for name, digest in finding if name.endswith(".tif")]
+    assert sorted(uploaded) == digests(images)
+
+def test_upload_selected_from_store(standin, preloaded):
+    import uploader as up
+    from preloadstore import PreloadStore, load_groups, save_groups
+    store = save_groups(load_groups(preloaded), preloaded.parent, store=True)
+    species = sorted({data["species_name"] for group in load_groups(store) for data in group})
+    assert len(species) > 1
+    selected = load_groups(store, species=species[0])
+    up.Connector().commit_all(store.as_posix(), user="Test", uploaderhandler=quiet, select={"species": species[0]})
+    assert len(standin.findings) == len(selected)
+    # Upload status is kept in store, other species are still pending
+    counts = PreloadStore(store).counts(species=species[0])
+    assert counts["uploaded"] == sum(len(group) for group in selected) and not counts["pending"]
+    assert not PreloadStore(store).counts(species=species[1])["uploaded"]
+    pending = {data["img_path"] for group in load_groups(store, status="pending") for data in group}
+    assert pending == {data["img_path"] for group in load_groups(store) for data in group if data["species_name"] != species[0]}